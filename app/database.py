@@ -1,13 +1,12 @@
-from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-# --- NEW: Use a local SQLite database ---
+from src.models.engine_factory import DatabaseConfig, build_engine
+
+# --- Local SQLite database unless DATABASE_URL is set (same settings as the src backend) ---
 SQLALCHEMY_DATABASE_URL = "sqlite:///./360_local.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = build_engine(DatabaseConfig.from_env(default_url=SQLALCHEMY_DATABASE_URL))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
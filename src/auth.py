@@ -1,33 +1,72 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Import schemas and DB models
 from src import schemas
+from src.cache import TTLCache
 from src.models import identity
-from src.models.database import SessionLocal
+from src.models.database import get_async_db
 
 # --- Configuration ---
 SECRET_KEY = "YOUR_VERY_SECRET_KEY_CHANGE_THIS"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Authenticated principals are cached per token subject for this long (per worker)
+PRINCIPAL_CACHE_TTL_SECONDS = 60
+PRINCIPAL_CACHE_SIZE = 10000
+# Build the principal from the token's uid/eid claims without any lookup. Faster, but a
+# removed user or a changed enterprise is only noticed when the token expires.
+TRUST_TOKEN_CLAIMS = False
 
 # --- Password Hashing ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor; hashes made with other rounds are upgraded on the next successful login
+PASSWORD_HASH_ROUNDS = 12
+# Hashes run on a dedicated pool so a login burst can't starve the event loop or the request threadpool
+PASSWORD_HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+# Logins beyond this many waiting hashes are turned away with a 503 instead of queueing up
+PASSWORD_HASH_MAX_PENDING = 64
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_HASH_ROUNDS)
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# --- Database Dependency ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# --- Principal Cache ---
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+def invalidate_principal(email: str):
+    principal_cache.pop(email)
+
+def invalidate_enterprise_principals(enterprise_id: int):
+    principal_cache.remove_where(lambda principal: principal.enterprise_id == enterprise_id)
+
+# Any ORM change to a user or an enterprise drops the affected principals.
+# Bulk query.update()/delete() bypass these events and rely on the TTL.
+@event.listens_for(identity.User, "after_update")
+@event.listens_for(identity.User, "after_delete")
+def _user_changed(mapper, connection, target):
+    invalidate_principal(target.email)
+    old_emails = inspect(target).attrs.email.history.deleted
+    for email in old_emails or ():
+        invalidate_principal(email)
+
+@event.listens_for(identity.EnterpriseProfile, "after_update")
+@event.listens_for(identity.EnterpriseProfile, "after_delete")
+def _enterprise_changed(mapper, connection, target):
+    invalidate_enterprise_principals(target.id)
 
 # --- Functions ---
 def verify_password(plain_password, hashed_password):
@@ -36,6 +75,38 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_hash(func, *args):
+    """Runs a password hash function on the hashing pool, or raises 503 when it is saturated."""
+    if not _hash_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please retry shortly.",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_slots.release()
+
+async def verify_and_update_password(plain_password, hashed_password):
+    """
+    Checks a password off the event loop. Returns (valid, new_hash); new_hash is set when the
+    stored hash uses outdated settings (e.g. fewer rounds) and should be saved instead.
+    With no stored hash, a dummy verification keeps the timing the same as a wrong password.
+    """
+    if not hashed_password:
+        await _run_hash(pwd_context.dummy_verify)
+        return False, None
+    return await _run_hash(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def hash_password(password):
+    """get_password_hash, off the event loop."""
+    return await _run_hash(pwd_context.hash, password)
+
+def token_claims(user) -> dict:
+    """The claims identifying `user` in an access token: subject plus user and enterprise ids."""
+    return {"sub": user.email, "uid": user.id, "eid": user.enterprise_id}
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -46,36 +117,37 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(identity.User).filter(identity.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(identity.User).where(identity.User.email == email))
+    return result.scalars().first()
 
-def create_user(db: Session, user: schemas.UserCreate):
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     # Create a new, empty enterprise for this user
     # The user will fill in the details during the onboarding process
     new_enterprise = identity.EnterpriseProfile(
         name=f"بنگاه کاربر {user.email}", # Placeholder name
         national_id="", # To be filled in during onboarding
-        registration_id="",
+        economic_code="",
         scale_name="Small", # Default value
-        ceo_name="",
-        ceo_national_id="",
-        address=""
     )
     db.add(new_enterprise)
-    db.flush() # Use flush to get the ID of the new enterprise before committing
+    await db.flush() # Use flush to get the ID of the new enterprise before committing
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = identity.User(
         email=user.email, 
         hashed_password=hashed_password, 
         enterprise_id=new_enterprise.id
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     return db_user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> identity.User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.User:
+    """
+    Returns the authenticated principal. Looked up by the token subject at most once per
+    PRINCIPAL_CACHE_TTL_SECONDS; the session only connects on a cache miss.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -89,8 +161,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    
-    user = get_user_by_email(db, email=token_data.email)
-    if user is None:
-        raise credentials_exception
-    return user
+
+    principal = principal_cache.get(token_data.email)
+    if principal is not None:
+        return principal
+
+    if TRUST_TOKEN_CLAIMS and payload.get("uid") is not None and payload.get("eid") is not None:
+        principal = schemas.User(id=payload["uid"], email=token_data.email, enterprise_id=payload["eid"])
+    else:
+        user = await get_user_by_email(db, email=token_data.email)
+        if user is None:
+            raise credentials_exception
+        principal = schemas.User.model_validate(user, from_attributes=True)
+    principal_cache.set(token_data.email, principal)
+    return principal
@@ -0,0 +1,211 @@
+import math
+import threading
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from src import data_versions
+from src.models import watchdog
+from src.persian_text import similarity, token_key
+
+
+class TrademarkIndex:
+    """
+    Character n-gram inverted index over trademark names.
+
+    Instead of running token_set_ratio against every registered mark, a query first
+    collects the marks that share a whole token or enough n-grams with it, and only those
+    candidates get the exact score. Everything works on the precomputed Persian token keys
+    (see src.persian_text), so spelling variants index and score the same. The pruning is conservative: a mark that is dropped
+    provably scores below the threshold, so the results are the same as the full scan.
+
+    The index is built once and kept current by `add`, which is cheap enough to call for
+    every row a crawl inserts or changes.
+    """
+
+    def __init__(self, n: int = 2):
+        self.n = n
+        self._lock = threading.Lock()
+        self._entries = {}        # trademark id -> trademark dict (name, owner_name, source_url)
+        self._keys = {}           # trademark id -> (sorted token string, distinct gram count)
+        self._gram_postings = {}  # n-gram -> set of trademark ids
+        self._token_postings = {} # token -> set of trademark ids
+        self.max_id = 0
+        self.version = 0          # watchdog data version synced up to, see sync_trademark_index
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(trademark):
+        key = trademark.get('name_tokens')
+        return key if key is not None else token_key(trademark.get('name'))
+
+    def _grams(self, key):
+        padded = f" {key} "
+        return {padded[i:i + self.n] for i in range(len(padded) - self.n + 1)}
+
+    def add(self, trademark_id: int, trademark: dict):
+        """Adds (or replaces) one trademark in the index."""
+        key = self._key(trademark)
+        tokens = key.split()
+        grams = self._grams(key) if key else set()
+        with self._lock:
+            if trademark_id in self._entries:
+                self._remove_locked(trademark_id)
+            self._entries[trademark_id] = trademark
+            self._keys[trademark_id] = (key, len(grams))
+            for gram in grams:
+                self._gram_postings.setdefault(gram, set()).add(trademark_id)
+            for token in tokens:
+                self._token_postings.setdefault(token, set()).add(trademark_id)
+            self.max_id = max(self.max_id, trademark_id)
+
+    def remove(self, trademark_id: int):
+        with self._lock:
+            self._remove_locked(trademark_id)
+
+    def _remove_locked(self, trademark_id):
+        key, _ = self._keys.pop(trademark_id, ('', 0))
+        self._entries.pop(trademark_id, None)
+        for gram in self._grams(key) if key else ():
+            postings = self._gram_postings.get(gram)
+            if postings is not None:
+                postings.discard(trademark_id)
+                if not postings:
+                    del self._gram_postings[gram]
+        for token in key.split():
+            postings = self._token_postings.get(token)
+            if postings is not None:
+                postings.discard(trademark_id)
+                if not postings:
+                    del self._token_postings[token]
+
+    def candidates(self, query: str, similarity_threshold=80, query_key: str = None):
+        """
+        Returns the ids of trademarks that may score >= similarity_threshold against `query`.
+
+        Marks sharing a token with the query are always kept (token_set_ratio can reach 100
+        for them). For the rest, token_set_ratio is a plain ratio of the sorted token strings,
+        so the q-gram lemma applies: with indel distance at most k, the two strings still share
+        at least max(grams_a, grams_b) - n * k distinct n-grams.
+        """
+        key = query_key if query_key is not None else token_key(query)
+        tokens = key.split()
+        if not tokens:
+            return []
+        query_grams = self._grams(key)
+        len_a = len(key)
+        # token_set_ratio rounds to an int, so a raw score half a point below still counts
+        t = max(similarity_threshold - 0.5, 0) / 100
+
+        with self._lock:
+            if not self._can_prune(len(query_grams), len_a, t):
+                return list(self._entries)
+
+            result = set()
+            for token in tokens:
+                result.update(self._token_postings.get(token, ()))
+
+            shared = {}
+            for gram in query_grams:
+                for trademark_id in self._gram_postings.get(gram, ()):
+                    shared[trademark_id] = shared.get(trademark_id, 0) + 1
+
+            for trademark_id, shared_count in shared.items():
+                if trademark_id in result:
+                    continue
+                other_key, other_grams = self._keys[trademark_id]
+                len_b = len(other_key)
+                # Length filter: ratio = 2 * LCS / (len_a + len_b) <= 2 * min / (len_a + len_b)
+                if 2 * min(len_a, len_b) < t * (len_a + len_b):
+                    continue
+                max_distance = math.floor((1 - t) * (len_a + len_b))
+                if shared_count >= max(len(query_grams), other_grams) - self.n * max_distance:
+                    result.add(trademark_id)
+            return list(result)
+
+    def _can_prune(self, query_gram_count, len_a, t):
+        """
+        Marks that share no n-gram with the query are never looked at, which is only safe
+        if every possible match would have to share at least one.
+        """
+        if t <= 0:
+            return False
+        # Longest mark that could still pass the length filter
+        max_len_b = math.floor(len_a * (2 - t) / t)
+        max_distance = math.floor((1 - t) * (len_a + max_len_b))
+        return query_gram_count - self.n * max_distance >= 1
+
+    def search(self, query: str, similarity_threshold=80, query_key: str = None):
+        """Returns (trademark dict, similarity) for every indexed mark scoring >= the threshold."""
+        if query_key is None:
+            query_key = token_key(query)
+        hits = []
+        for trademark_id in self.candidates(query, similarity_threshold, query_key):
+            entry = self._keys.get(trademark_id)
+            trademark = self._entries.get(trademark_id)
+            if entry is None or trademark is None:
+                continue
+            score = similarity(query_key, entry[0])
+            if score >= similarity_threshold:
+                hits.append((trademark_id, trademark, score))
+        hits.sort(key=lambda hit: hit[0])
+        return [(trademark, score) for _, trademark, score in hits]
+
+
+# --- Shared Index ---
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+def get_shared_trademark_index() -> TrademarkIndex:
+    """Returns the process-wide trademark index, creating it empty on first use."""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_index_lock:
+            if _shared_index is None:
+                _shared_index = TrademarkIndex()
+    return _shared_index
+
+def sync_trademark_index(index: TrademarkIndex, db: Session, batch_size: int = 10000) -> int:
+    """
+    Adds trademark rows inserted since the index was last synced (by id watermark) and
+    replaces the ones changed since (by their changed_version). The first call builds the
+    whole index; later calls only read the new and changed rows.
+    """
+    # Read first: rows committed meanwhile are read now or, at worst, again next time
+    version = data_versions.watchdog_version(db)
+    changed_since = or_(
+        watchdog.TrademarkRegistration.id > index.max_id,
+        watchdog.TrademarkRegistration.changed_version > index.version,
+    )
+    added, last_id = 0, 0
+    while True:
+        rows = (
+            db.query(
+                watchdog.TrademarkRegistration.id,
+                watchdog.TrademarkRegistration.name,
+                watchdog.TrademarkRegistration.name_tokens,
+                watchdog.TrademarkRegistration.owner_name,
+                watchdog.TrademarkRegistration.source_url,
+            )
+            .filter(changed_since, watchdog.TrademarkRegistration.id > last_id)
+            .order_by(watchdog.TrademarkRegistration.id)
+            .limit(batch_size)
+            .all()
+        )
+        for row in rows:
+            # Replaces the entry of a changed row
+            index.add(row.id, {
+                "name": row.name,
+                "name_tokens": row.name_tokens,
+                "owner_name": row.owner_name,
+                "source_url": row.source_url,
+            })
+        added += len(rows)
+        if rows:
+            last_id = rows[-1].id
+        if len(rows) < batch_size:
+            index.version = max(index.version, version)
+            return added
@@ -0,0 +1,323 @@
+"""
+In-process and shared caches.
+
+TTLCache is a bounded, thread-safe LRU map whose entries also expire `ttl` seconds after
+they were set. It is per process: with several workers, a change in one worker is only
+seen by the others once their entries expire, so keep `ttl` short for anything that can
+change.
+
+SharedCache puts an optional Redis tier (REDIS_URL) behind a TTLCache per namespace, so a
+result computed by one worker or container is reused by all of them. Each namespace has
+its own TTL and serializer. `get_or_compute` coalesces concurrent misses for the same key:
+within a process only one caller computes while the others wait for it, and across
+processes a short Redis lock lets the other workers wait for the value instead of
+computing it too. Without REDIS_URL, or while Redis is unreachable, it works from the
+local tier alone.
+"""
+import asyncio
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Only needed with REDIS_URL
+    redis = None
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A least-recently-used cache of at most `maxsize` entries, each valid for `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[1]
+
+    def remove_where(self, predicate) -> int:
+        """Drops every entry whose value matches `predicate`. Returns the number removed."""
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(value)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# --- Serializers ---
+
+class JsonSerializer:
+    """For JSON-compatible values (e.g. jsonable_encoder output); safe to share."""
+
+    def dumps(self, value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+
+class PickleSerializer:
+    """For arbitrary Python objects. Only use with a Redis that nothing untrusted can write to."""
+
+    def dumps(self, value) -> bytes:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes):
+        return pickle.loads(data)
+
+
+SERIALIZERS = {'json': JsonSerializer(), 'pickle': PickleSerializer()}
+
+
+# --- Shared Cache ---
+
+class SharedCache:
+    """
+    Namespaced two-tier cache; see the module docstring.
+
+    :param redis_client: A redis.Redis (or compatible) client, or None for local-only.
+    :param lock_timeout: Seconds a worker may hold a key's compute lock, and the longest
+        others wait for its value before computing it themselves.
+    :param retry_after: Seconds to skip the Redis tier after it failed.
+    """
+
+    def __init__(self, redis_client=None, prefix: str = 'dastyar:', lock_timeout: float = 10.0,
+                 poll_interval: float = 0.05, retry_after: float = 30.0, clock=time.monotonic):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.retry_after = retry_after
+        self._clock = clock
+        self._down_until = 0.0
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Uses Redis when REDIS_URL is set (e.g. redis://redis:6379/0), else the local tier only."""
+        url = os.environ.get('REDIS_URL')
+        if not url:
+            return cls()
+        if redis is None:
+            print("Warning: REDIS_URL is set but the redis package is not installed; caching per process only.")
+            return cls()
+        client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        return cls(client, prefix=os.environ.get('CACHE_PREFIX', 'dastyar:'))
+
+    def namespace(self, name: str, ttl: float, local_ttl: float = None, local_size: int = 1024, serializer: str = 'json') -> 'Namespace':
+        """Returns the namespace `name`, creating it with these settings on first use."""
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = Namespace(self, name, ttl, local_ttl, local_size, SERIALIZERS[serializer])
+            return self._namespaces[name]
+
+    def clear_local(self):
+        """Empties the local tier of every namespace."""
+        for namespace in list(self._namespaces.values()):
+            namespace.local.clear()
+
+    def _remote(self, operation, default=None):
+        """Runs `operation(redis)`, or returns `default` without Redis or when it fails."""
+        if self.redis is None or self._clock() < self._down_until:
+            return default
+        try:
+            return operation(self.redis)
+        except (OSError, *((redis.RedisError,) if redis else ())) as e:
+            self._down_until = self._clock() + self.retry_after
+            print(f"Warning: Redis cache unavailable, caching per process for {self.retry_after:.0f}s: {e}")
+            return default
+
+
+class Namespace:
+    """One namespace of a SharedCache, with its own TTLs and serializer."""
+
+    def __init__(self, cache: SharedCache, name: str, ttl: float, local_ttl: float, local_size: int, serializer):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.serializer = serializer
+        self.local = TTLCache(maxsize=local_size, ttl=ttl if local_ttl is None else local_ttl)
+        # key -> threading.Event / asyncio.Future of the caller computing it in this process
+        self._inflight = {}
+        self._async_inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _key(self, key) -> str:
+        return f"{self.cache.prefix}{self.name}:{key}"
+
+    # Remote tier. All of these are blocking calls; the async methods run them in a thread.
+
+    def _remote_get(self, key):
+        data = self.cache._remote(lambda client: client.get(self._key(key)))
+        if data is None:
+            return _MISSING
+        value = self.serializer.loads(data)
+        self.local.set(key, value)
+        return value
+
+    def _remote_set(self, key, value):
+        data = self.serializer.dumps(value)
+        self.cache._remote(lambda client: client.set(self._key(key), data, px=int(self.ttl * 1000)))
+
+    def _remote_lock(self, key) -> bool:
+        """Takes the key's compute lock. True if we got it, or there is no Redis to coordinate with."""
+        timeout_ms = int(self.cache.lock_timeout * 1000)
+        return bool(self.cache._remote(lambda client: client.set(self._key(key) + ':lock', b'1', nx=True, px=timeout_ms), default=True))
+
+    def _remote_unlock(self, key):
+        self.cache._remote(lambda client: client.delete(self._key(key) + ':lock'))
+
+    # Plain access
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._remote_get(key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        self._remote_set(key, value)
+
+    def delete(self, key):
+        self.local.pop(key)
+        self.cache._remote(lambda client: client.delete(self._key(key)))
+
+    # Coalesced computation
+
+    def get_or_compute(self, key, compute):
+        """The cached value of `key`, or the result of `compute()`, which is then cached."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._inflight_lock:
+            waiter = self._inflight.get(key)
+            leader = waiter is None
+            if leader:
+                waiter = self._inflight[key] = threading.Event()
+        if not leader:
+            waiter.wait(self.cache.lock_timeout)
+            value = self.local.get(key, _MISSING)
+            # The leader failed or took too long: compute without coalescing
+            return compute() if value is _MISSING else value
+
+        try:
+            locked = self._remote_lock(key)
+            if not locked:
+                # Another worker is computing it
+                deadline = time.monotonic() + self.cache.lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(self.cache.poll_interval)
+                    value = self._remote_get(key)
+                    if value is not _MISSING:
+                        return value
+            try:
+                value = compute()
+                self.set(key, value)
+                return value
+            finally:
+                if locked:
+                    self._remote_unlock(key)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            waiter.set()
+
+    async def aget_or_compute(self, key, compute):
+        """get_or_compute for an async `compute`; Redis calls run in a worker thread."""
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        remote = self.cache.redis is not None
+        if remote:
+            value = await asyncio.to_thread(self._remote_get, key)
+            if value is not _MISSING:
+                return value
+
+        loop = asyncio.get_running_loop()
+        with self._inflight_lock:
+            waiter = self._async_inflight.get(key)
+            leader = waiter is None or waiter.get_loop() is not loop
+            if leader:
+                waiter = self._async_inflight[key] = loop.create_future()
+        if not leader:
+            try:
+                return await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                if not waiter.cancelled():
+                    raise  # This caller was cancelled
+                return await compute()  # The leader was
+
+        try:
+            locked = await asyncio.to_thread(self._remote_lock, key) if remote else True
+            if not locked:
+                deadline = time.monotonic() + self.cache.lock_timeout
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(self.cache.poll_interval)
+                    value = await asyncio.to_thread(self._remote_get, key)
+                    if value is not _MISSING:
+                        waiter.set_result(value)
+                        return value
+            try:
+                value = await compute()
+                self.local.set(key, value)
+                if remote:
+                    await asyncio.to_thread(self._remote_set, key, value)
+            finally:
+                if locked and remote:
+                    await asyncio.to_thread(self._remote_unlock, key)
+            waiter.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            waiter.cancel()
+            raise
+        except Exception as e:
+            if not waiter.done():
+                waiter.set_exception(e)
+                waiter.exception()  # Retrieved here, so an unawaited failure isn't logged
+            raise
+        finally:
+            with self._inflight_lock:
+                if self._async_inflight.get(key) is waiter:
+                    del self._async_inflight[key]
+
+
+shared_cache = SharedCache.from_env()
@@ -0,0 +1,291 @@
+"""
+Runs the watchdog spiders in a long-lived crawl process instead of one `scrapy crawl` per run.
+
+The crawl process is started once (on the first crawl) and keeps Scrapy imported and a
+Twisted reactor running; each crawl is a CrawlerRunner job on that reactor. Scraped items
+come back to the caller through a queue as they are produced, so ingestion starts with
+the first item and nothing goes through a temporary file. At most `max_buffered_items`
+of a crawl are on their way to the caller at a time: past that, the crawl process holds
+the item_scraped signal (which holds back the spider) until the caller takes some.
+
+    crawl = crawl_process.crawl('gazette', page_validators=...)
+    for item in crawl:
+        ...
+    crawl.stats, crawl.pages
+
+Pages are fetched conditionally (dastyar_crawlers.middlewares.ConditionalFetchMiddleware):
+pass the validators stored for the crawler's pages, and store `crawl.pages` afterwards.
+
+Scrapy stays out of the API process: it is only imported in the crawl process.
+"""
+import collections
+import itertools
+import multiprocessing
+import queue
+import threading
+
+# Spider class per crawler name
+SPIDERS = {
+    'gazette': 'src.crawlers.dastyar_crawlers.spiders.gazette_spider.GazetteSpider',
+    'brand': 'src.crawlers.dastyar_crawlers.spiders.brand_spider.BrandSpider',
+}
+
+CRAWL_SETTINGS = {
+    'LOG_LEVEL': 'INFO',
+    'ROBOTSTXT_OBEY': True,
+    'TELNETCONSOLE_ENABLED': False,
+    'REMOTE_CONTROL_ENABLED': False,
+    'DOWNLOADER_MIDDLEWARES': {
+        'src.crawlers.dastyar_crawlers.middlewares.ConditionalFetchMiddleware': 580,
+    },
+}
+
+# A crawl fails if no item (or end of crawl) arrives for this many seconds
+CRAWL_IDLE_TIMEOUT_SECONDS = 600
+# Items of one crawl sent to the caller and not taken yet, at most
+CRAWL_MAX_BUFFERED_ITEMS = 1000
+
+
+class CrawlError(Exception):
+    """The crawl failed, or the crawl process went away during it."""
+
+
+def _serve(commands, results, settings: dict, max_buffered_items: int):
+    """
+    Body of the crawl process. Commands are ('start', run_id, spider path, spider kwargs),
+    run as a CrawlerRunner job; ('release', run_id, count) when the caller took `count`
+    items of the run; and ('cancel', run_id) when it stopped reading.
+    """
+    from scrapy import signals
+    from scrapy.crawler import CrawlerRunner
+    from scrapy.settings import Settings
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.misc import load_object
+    from scrapy.utils.reactor import install_reactor
+
+    settings = Settings(settings)
+    if settings.get('TWISTED_REACTOR'):
+        install_reactor(settings['TWISTED_REACTOR'])
+    from twisted.internet import defer, reactor
+
+    configure_logging(settings)
+    runner = CrawlerRunner(settings)
+    receivers = {}
+    crawlers = {}
+    in_flight = {}  # run_id -> items sent and not yet taken by the caller
+    held = {}  # run_id -> (Deferred, item) of the items waiting for room, in order
+    cancelled = set()
+
+    def send_item(run_id, item):
+        in_flight[run_id] += 1
+        results.put(('item', run_id, item))
+
+    def start(run_id, spider_path, spider_kwargs):
+        try:
+            crawler = runner.create_crawler(load_object(spider_path))
+        except Exception as e:
+            results.put(('error', run_id, f"Could not load spider {spider_path}: {e}"))
+            return
+        crawlers[run_id] = crawler
+        in_flight[run_id] = 0
+        held[run_id] = collections.deque()
+
+        def item_scraped(item, response, spider):
+            if run_id in cancelled:
+                return None
+            if in_flight[run_id] < max_buffered_items and not held[run_id]:
+                send_item(run_id, dict(item))
+                return None
+            # Scrapy waits for the Deferred before finishing the item, so the spider slows down too
+            waiting = defer.Deferred()
+            held[run_id].append((waiting, dict(item)))
+            return waiting
+        # Signal receivers are held weakly; keep this one alive until the crawl ends
+        receivers[run_id] = item_scraped
+        crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+        finished = runner.crawl(crawler, **spider_kwargs)
+
+        def forget_run(result):
+            for state in (receivers, crawlers, in_flight, held):
+                state.pop(run_id, None)
+            cancelled.discard(run_id)
+            return result
+        finished.addBoth(forget_run)
+        finished.addCallbacks(
+            lambda _: results.put(('done', run_id, {
+                'items': crawler.stats.get_value('item_scraped_count', 0),
+                'errors': crawler.stats.get_value('log_count/ERROR', 0),
+                'finish_reason': crawler.stats.get_value('finish_reason'),
+                'not_modified': crawler.stats.get_value('conditional/not_modified', 0),
+                'unchanged': crawler.stats.get_value('conditional/unchanged', 0),
+                'pages': getattr(crawler.spider, 'fetched_pages', {}),
+            })),
+            lambda failure: results.put(('error', run_id, failure.getErrorMessage())),
+        )
+
+    def release(run_id, count):
+        if run_id not in in_flight:
+            return
+        in_flight[run_id] -= count
+        waiting = held[run_id]
+        while waiting and in_flight[run_id] < max_buffered_items:
+            deferred, item = waiting.popleft()
+            send_item(run_id, item)
+            deferred.callback(None)
+
+    def cancel(run_id):
+        if run_id not in crawlers:
+            return
+        cancelled.add(run_id)
+        waiting = held[run_id]
+        while waiting:
+            waiting.popleft()[0].callback(None)
+        crawler = crawlers[run_id]
+        # stop_async() replaces stop() from Scrapy 2.13
+        if hasattr(crawler, 'stop_async'):
+            defer.ensureDeferred(crawler.stop_async())
+        else:
+            crawler.stop()
+
+    handlers = {'start': start, 'release': release, 'cancel': cancel}
+
+    def listen():
+        while True:
+            command = commands.get()
+            if command is None:
+                reactor.callFromThread(reactor.stop)
+                return
+            reactor.callFromThread(handlers[command[0]], *command[1:])
+
+    reactor.callInThread(listen)
+    reactor.run(installSignalHandlers=False)
+
+
+class Crawl:
+    """
+    The items of one crawl, in the order they are scraped; iterate it once. When it ends,
+    `stats` holds {'items', 'errors', 'finish_reason', 'not_modified', 'unchanged'} and
+    `pages` the validators of the pages fetched (url -> {'etag', 'last_modified', 'content_hash'}).
+    """
+
+    def __init__(self, messages):
+        self._messages = messages
+        self.stats = None
+        self.pages = None
+
+    def __iter__(self):
+        stats = yield from self._messages
+        self.pages = stats.pop('pages')
+        self.stats = stats
+
+
+class CrawlProcess:
+    """Handle on the crawl process. Thread-safe; several crawls can run at the same time."""
+
+    def __init__(self, settings: dict = None, idle_timeout: float = CRAWL_IDLE_TIMEOUT_SECONDS, max_buffered_items: int = CRAWL_MAX_BUFFERED_ITEMS):
+        self.settings = {**CRAWL_SETTINGS, **(settings or {})}
+        self.idle_timeout = idle_timeout
+        self.max_buffered_items = max_buffered_items
+        # Taken items are released to the crawl process in chunks of this many
+        self._release_every = max(1, max_buffered_items // 10)
+        # spawn: a fork would copy the API's threads, sockets and database connections
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._commands = None
+        self._runs = {}  # run_id -> (crawl process, queue.Queue of messages for that crawl)
+        self._run_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        self._commands = self._context.Queue()
+        results = self._context.Queue()
+        self._process = self._context.Process(
+            target=_serve, args=(self._commands, results, self.settings, self.max_buffered_items), name='crawl-process', daemon=True
+        )
+        self._process.start()
+        threading.Thread(target=self._dispatch, args=(self._process, results), name='crawl-results', daemon=True).start()
+
+    def _dispatch(self, process, results):
+        """Routes messages from the crawl process to the crawls waiting for them."""
+        while True:
+            try:
+                kind, run_id, payload = results.get(timeout=1)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                with self._lock:
+                    orphaned = [run for run_process, run in self._runs.values() if run_process is process]
+                for run in orphaned:
+                    run.put(('error', f"The crawl process exited with code {process.exitcode}"))
+                return
+            with self._lock:
+                _, run = self._runs.get(run_id, (None, None))
+            if run is not None:
+                run.put((kind, payload))
+
+    def crawl(self, crawler_name: str, **spider_kwargs) -> Crawl:
+        """
+        Runs the spider of `crawler_name` with `spider_kwargs` (e.g. page_validators) when the
+        returned Crawl is iterated, yielding its items as they are scraped.
+
+        :raises CrawlError: If the crawl fails, stalls for `idle_timeout`, or the crawl process dies.
+        """
+        return Crawl(self._run(crawler_name, spider_kwargs))
+
+    def _run(self, crawler_name: str, spider_kwargs: dict):
+        """Yields the crawl's items and returns its final stats."""
+        if crawler_name not in SPIDERS:
+            raise CrawlError(f"Unknown crawler '{crawler_name}'")
+        # Holds at most max_buffered_items items: the crawl process waits for them to be released
+        run = queue.Queue()
+        with self._lock:
+            self._ensure_started()
+            run_id = next(self._run_ids)
+            commands = self._commands
+            self._runs[run_id] = (self._process, run)
+            commands.put(('start', run_id, SPIDERS[crawler_name], spider_kwargs))
+        taken = 0
+        finished = False
+        try:
+            while True:
+                try:
+                    kind, payload = run.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    raise CrawlError(f"No progress from the '{crawler_name}' crawl in {self.idle_timeout}s")
+                if kind == 'item':
+                    yield payload
+                    taken += 1
+                    if taken == self._release_every:
+                        commands.put(('release', run_id, taken))
+                        taken = 0
+                elif kind == 'done':
+                    finished = True
+                    return payload
+                else:
+                    finished = True
+                    raise CrawlError(payload)
+        finally:
+            with self._lock:
+                self._runs.pop(run_id, None)
+            if not finished:
+                # The caller stopped reading: don't leave the spider waiting for it
+                commands.put(('cancel', run_id))
+
+    def stop(self, timeout: float = 10):
+        """Stops the crawl process; running crawls fail. A new process starts with the next crawl."""
+        with self._lock:
+            process, commands = self._process, self._commands
+            self._process = None
+        if process is None:
+            return
+        if process.is_alive():
+            commands.put(None)
+            process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+
+crawl_process = CrawlProcess()
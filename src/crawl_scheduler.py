@@ -0,0 +1,272 @@
+"""
+Schedules the watchdog crawls: at most one active run per crawler, a cap on the runs
+active at the same time, and cron-style periodic runs. Periodic batch jobs (e.g.
+'legal-tasks') are scheduled the same way, under their own names.
+
+A trigger (a /watchdog/run-*-crawler/ request or a schedule coming due) queues a run of
+the crawler. A trigger for a crawler that already has a queued run joins that run
+instead, so any number of triggers while a crawl is running add up to one follow-up run.
+Queued runs start in the order they were queued as slots free up, skipping crawlers that
+are still running.
+
+Each process has its own scheduler, so runs are also claimed in the database
+(`claim_run`): a trigger is satisfied by any run of the crawler that started after it,
+in any worker, and a crawler never runs in two workers at once.
+
+Settings come from environment variables:
+
+    CRAWL_MAX_CONCURRENT   runs active at the same time (default 2)
+    CRAWL_SCHEDULES        e.g. "gazette=0 2 * * *; brand=30 2 * * *; legal-tasks=15 * * * *" (server local time);
+                           empty for no periodic runs (default DEFAULT_SCHEDULES)
+"""
+import collections
+import datetime
+import os
+import threading
+import time
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from src.models import upsert
+from src.models.watchdog import CrawlerRunLog
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_SCHEDULES = {'gazette': '0 2 * * *', 'brand': '30 2 * * *', 'legal-tasks': '15 * * * *'}
+# A 'running' run log older than this is left over from a worker that died mid-crawl
+RUN_LEASE_SECONDS = 6 * 3600
+# Wait times kept for the status report
+WAIT_HISTORY_SIZE = 100
+
+
+class CronSchedule:
+    """
+    A five-field cron expression: minute, hour, day of month, month, day of week (0 or 7 =
+    Sunday). Fields take *, n, a-b, lists and /step. As in cron, when both day fields are
+    restricted a day matching either one matches.
+    """
+
+    _FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7)]
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(self._FIELDS):
+            raise ValueError(f"Cron expression '{expression}' needs {len(self._FIELDS)} fields")
+        values = {}
+        for text, (name, low, high) in zip(fields, self._FIELDS):
+            values[name] = self._parse_field(text, low, high)
+        self.minutes = sorted(values['minute'])
+        self.hours = sorted(values['hour'])
+        self.days = values['day']
+        self.months = values['month']
+        self.weekdays = {day % 7 for day in values['weekday']}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(text: str, low: int, high: int) -> set:
+        values = set()
+        for part in text.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = (int(bound) for bound in span.split('-', 1))
+            else:
+                start = end = int(span)
+                if step:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError(f"Cron field '{text}' is outside {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _matches_day(self, day: datetime.date) -> bool:
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = day.isoweekday() % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """The first matching minute after `moment`."""
+        moment = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day, earliest = moment.date(), (moment.hour, moment.minute)
+        # Long enough for a 29 February that falls on a given weekday
+        for _ in range(28 * 366):
+            if self._matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        if (hour, minute) >= earliest:
+                            return datetime.datetime.combine(day, datetime.time(hour, minute))
+            day += datetime.timedelta(days=1)
+            earliest = (0, 0)
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+
+def parse_schedules(text: str) -> dict:
+    """'gazette=0 2 * * *; brand=30 2 * * *' -> {'gazette': '0 2 * * *', 'brand': '30 2 * * *'}"""
+    schedules = {}
+    for entry in text.split(';'):
+        if entry.strip():
+            name, _, expression = entry.partition('=')
+            schedules[name.strip()] = expression.strip()
+    return schedules
+
+
+def claim_run(db: Session, crawler_name: str, requested_at: datetime.datetime) -> bool:
+    """
+    Marks the crawler's run log as running and commits, unless the crawler is running
+    elsewhere or a run started since `requested_at` (UTC), which then covers this one.
+
+    :return: Whether the caller now owns the run.
+    """
+    log = CrawlerRunLog
+    # Without a start time, so the first claim is not taken for a run covering it
+    db.execute(upsert.insert_ignoring_conflicts(db, log.__table__), [{'crawler_name': crawler_name, 'last_run_start': None}])
+    now = datetime.datetime.utcnow()
+    claimed = db.execute(
+        update(log)
+        .where(
+            log.crawler_name == crawler_name,
+            or_(log.status.is_(None), log.status != 'running', log.last_run_start < now - datetime.timedelta(seconds=RUN_LEASE_SECONDS)),
+            or_(log.last_run_start.is_(None), log.last_run_start < requested_at),
+        )
+        .values(status='running', last_run_start=now, last_run_finish=None, details=None, items_added=0)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return claimed == 1
+
+
+class CrawlScheduler:
+    """
+    Runs `run(crawler_name, requested_at)` for triggered crawlers on background threads;
+    `requested_at` is when (UTC) the run's first trigger came in. Thread-safe.
+    """
+
+    def __init__(self, run, max_concurrent: int = DEFAULT_MAX_CONCURRENT, schedules: dict = None, clock=time.monotonic):
+        self._run = run
+        self.max_concurrent = max_concurrent
+        self.schedules = {name: CronSchedule(expression) for name, expression in (schedules or {}).items()}
+        self._clock = clock
+        self._queue = collections.OrderedDict()  # crawler_name -> (queued at by the clock, requested_at)
+        self._running = {}  # crawler_name -> started at by the clock
+        self._waits = collections.deque(maxlen=WAIT_HISTORY_SIZE)
+        self._last_wait = {}  # crawler_name -> seconds its last run waited in the queue
+        self._next_due = {}  # crawler_name -> next scheduled run, local time
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._ticker = None
+
+    @classmethod
+    def from_env(cls, run):
+        schedules = os.environ.get('CRAWL_SCHEDULES')
+        return cls(
+            run,
+            max_concurrent=int(os.environ.get('CRAWL_MAX_CONCURRENT') or DEFAULT_MAX_CONCURRENT),
+            schedules=DEFAULT_SCHEDULES if schedules is None else parse_schedules(schedules),
+        )
+
+    def trigger(self, crawler_name: str, requested_at: datetime.datetime = None) -> str:
+        """
+        Queues a run of `crawler_name`.
+
+        :param requested_at: When the run was asked for, in UTC; now by default.
+        :return: 'queued', or 'coalesced' if the trigger joined the run already queued.
+        """
+        requested_at = requested_at or datetime.datetime.utcnow()
+        with self._lock:
+            if crawler_name in self._queue:
+                queued_at, first_requested_at = self._queue[crawler_name]
+                self._queue[crawler_name] = (queued_at, min(first_requested_at, requested_at))
+                return 'coalesced'
+            self._queue[crawler_name] = (self._clock(), requested_at)
+            self._start_ready()
+        return 'queued'
+
+    def _start_ready(self):
+        """Starts queued runs while there are free slots. Call with the lock held."""
+        for crawler_name in list(self._queue):
+            if len(self._running) >= self.max_concurrent:
+                return
+            if crawler_name in self._running:
+                continue
+            queued_at, requested_at = self._queue.pop(crawler_name)
+            now = self._clock()
+            self._running[crawler_name] = now
+            self._last_wait[crawler_name] = now - queued_at
+            self._waits.append(now - queued_at)
+            threading.Thread(target=self._execute, args=(crawler_name, requested_at), name=f'crawl-{crawler_name}', daemon=True).start()
+
+    def _execute(self, crawler_name: str, requested_at: datetime.datetime):
+        try:
+            self._run(crawler_name, requested_at)
+        except Exception as e:
+            print(f"Warning: the '{crawler_name}' crawl failed: {e}")
+        finally:
+            with self._lock:
+                self._running.pop(crawler_name, None)
+                self._start_ready()
+
+    def run_due(self, now: datetime.datetime) -> list:
+        """Triggers the scheduled crawlers due at local time `now`. Returns their names."""
+        due = []
+        for crawler_name, schedule in self.schedules.items():
+            next_due = self._next_due.setdefault(crawler_name, schedule.next_after(now))
+            if next_due <= now:
+                # Every worker requests a scheduled run for the same moment, so only one of them runs it
+                self.trigger(crawler_name, requested_at=next_due.astimezone(datetime.timezone.utc).replace(tzinfo=None))
+                self._next_due[crawler_name] = schedule.next_after(now)
+                due.append(crawler_name)
+        return due
+
+    def _tick(self):
+        while not self._stopped.is_set():
+            self.run_due(datetime.datetime.now())
+            wait = min((due - datetime.datetime.now()).total_seconds() for due in self._next_due.values())
+            self._stopped.wait(min(max(wait, 1), 60))
+
+    def start(self):
+        """Starts triggering the scheduled crawlers, if any."""
+        if self.schedules and self._ticker is None:
+            self._stopped.clear()
+            self._ticker = threading.Thread(target=self._tick, name='crawl-schedules', daemon=True)
+            self._ticker.start()
+
+    def stop(self):
+        """Stops the schedules. Queued and running crawls are not waited for."""
+        self._stopped.set()
+        if self._ticker is not None:
+            self._ticker.join()
+            self._ticker = None
+
+    def status(self, crawler_name: str) -> dict:
+        """The crawler's state in this process and the scheduler's queue, for /watchdog/status/."""
+        with self._lock:
+            now = self._clock()
+            if crawler_name in self._running and crawler_name in self._queue:
+                state = 'running, queued'
+            elif crawler_name in self._running:
+                state = 'running'
+            elif crawler_name in self._queue:
+                state = 'queued'
+            else:
+                state = 'idle'
+            queued = self._queue.get(crawler_name)
+            next_due = self._next_due.get(crawler_name)
+            if next_due is None and crawler_name in self.schedules:
+                next_due = self.schedules[crawler_name].next_after(datetime.datetime.now())
+            return {
+                'scheduler_state': state,
+                'queued_seconds': now - queued[0] if queued else None,
+                'last_wait_seconds': self._last_wait.get(crawler_name),
+                'next_scheduled_run': next_due,
+                'queue_depth': len(self._queue),
+                'active_runs': len(self._running),
+                'max_concurrent_runs': self.max_concurrent,
+                'mean_wait_seconds': sum(self._waits) / len(self._waits) if self._waits else None,
+            }
@@ -0,0 +1,64 @@
+"""
+Downloader middlewares for the watchdog spiders.
+
+Enabled through crawl_runner.CRAWL_SETTINGS.
+"""
+import hashlib
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.httpobj import urlparse_cached
+
+
+class ConditionalFetchMiddleware:
+    """
+    Skips pages that are unchanged since the last crawl, before they are parsed.
+
+    The spider's `page_validators` argument holds what was stored for each page
+    (url -> {'etag', 'last_modified', 'content_hash'}). Requests for a known page are sent
+    with If-None-Match / If-Modified-Since; a 304, or a body with the stored sha256, is
+    dropped. The pages that did change are collected in `spider.fetched_pages` with their
+    new validators, for the caller to store once their items are stored.
+
+    Runs after HttpCompressionMiddleware (590) on responses, so it hashes the decoded body.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def _stored(self, request) -> dict:
+        if urlparse_cached(request).path == '/robots.txt':
+            return None
+        validators = getattr(self.crawler.spider, 'page_validators', None) or {}
+        return validators.get(request.url, {})
+
+    def process_request(self, request, spider=None):
+        stored = self._stored(request)
+        if stored:
+            if stored.get('etag'):
+                request.headers.setdefault('If-None-Match', stored['etag'])
+            if stored.get('last_modified'):
+                request.headers.setdefault('If-Modified-Since', stored['last_modified'])
+        return None
+
+    def process_response(self, request, response, spider=None):
+        stored = self._stored(request)
+        if stored is None:
+            return response
+        if response.status == 304:
+            self.crawler.stats.inc_value('conditional/not_modified')
+            raise IgnoreRequest(f"Not modified: {request.url}")
+        if response.status != 200:
+            return response
+
+        body_hash = hashlib.sha256(response.body).hexdigest()
+        if body_hash == stored.get('content_hash'):
+            self.crawler.stats.inc_value('conditional/unchanged')
+            raise IgnoreRequest(f"Unchanged: {request.url}")
+        header = lambda name: response.headers.get(name, b'').decode('latin-1') or None
+        fetched = self.crawler.spider.__dict__.setdefault('fetched_pages', {})
+        fetched[request.url] = {'etag': header('ETag'), 'last_modified': header('Last-Modified'), 'content_hash': body_hash}
+        return response
@@ -1,15 +1,21 @@
 
 import scrapy
 import os
+import pathlib
 
 class BrandSpider(scrapy.Spider):
     name = 'brand'
 
+    async def start(self):
+        # Scrapy >= 2.13 calls start(); older versions call start_requests() directly
+        for request in self.start_requests():
+            yield request
+
     def start_requests(self):
         # Get the absolute path to the sample HTML file
         base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         file_path = os.path.join(base_dir, 'sample_brand_search.html')
-        url = 'file:///' + file_path.replace('\\', '/')
+        url = pathlib.Path(file_path).as_uri()
         self.logger.info(f'Starting to parse local file: {url}')
         yield scrapy.Request(url, self.parse_brands)
 
@@ -22,9 +28,11 @@ class BrandSpider(scrapy.Spider):
         for row in table_body.css('tr'):
             cells = row.css('td')
             if len(cells) == 4:
+                # Items carry the TrademarkRegistration fields
                 yield {
-                    'title': cells[0].css('::text').get(default='').strip(),
-                    'reg_number': cells[1].css('::text').get(default='').strip(),
+                    'name': cells[0].css('::text').get(default='').strip(),
+                    'registration_number': cells[1].css('::text').get(default='').strip(),
                     'status': cells[2].css('::text').get(default='').strip(),
-                    'owner': cells[3].css('::text').get(default='').strip(),
+                    'owner_name': cells[3].css('::text').get(default='').strip(),
+                    'source_url': response.url,
                 }
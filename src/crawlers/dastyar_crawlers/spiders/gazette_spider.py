@@ -1,17 +1,25 @@
 
 import scrapy
 import os
+import pathlib
+
+from src import jalali
 
 class GazetteSpider(scrapy.Spider):
     name = 'gazette'
 
+    async def start(self):
+        # Scrapy >= 2.13 calls start(); older versions call start_requests() directly
+        for request in self.start_requests():
+            yield request
+
     def start_requests(self):
         # Get the absolute path to the sample HTML file
         # This makes the spider independent of where it's run from
         base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         file_path = os.path.join(base_dir, 'sample_agahi.html')
-        # Scrapy can handle file:/// paths for local testing
-        url = 'file:///' + file_path.replace('\\', '/')
+        # Scrapy can handle file:// URLs for local testing
+        url = pathlib.Path(file_path).as_uri()
         self.logger.info(f'Starting to parse local file: {url}')
         yield scrapy.Request(url, self.parse_agahi)
 
@@ -21,17 +29,16 @@ class GazetteSpider(scrapy.Spider):
         
         # Using Scrapy's CSS selectors which are powerful
         title = response.css('h2#agahi-title::text').get()
-        agahi_number = response.css('span#agahi-number::text').get()
         rooznameh_date = response.css('span#rooznameh-date::text').get()
         
         # For the text, we get all paragraphs inside the div and join them
         text_paragraphs = response.css('div#agahi-text p::text').getall()
         full_text = '\n'.join(p.strip() for p in text_paragraphs if p.strip())
 
-        # Yielding the data as a dictionary, Scrapy handles the rest
+        # Items carry the GazetteAnnouncement fields; the date is published in the Jalali calendar
         yield {
             'title': title.strip() if title else None,
-            'agahi_number': agahi_number.strip() if agahi_number else None,
-            'date': rooznameh_date.strip() if rooznameh_date else None,
-            'text': full_text
+            'date': jalali.parse(rooznameh_date),
+            'content': full_text,
+            'source_url': response.url,
         }
@@ -0,0 +1,115 @@
+"""
+Data versions, ETags and cached results for the computed endpoints.
+
+Every enterprise has a version that is bumped whenever its transactions, invoices, profile
+or legal tasks change, and the watchdog feeds (gazette announcements, trademarks) share
+one global version. Every write to those tables must call `bump_enterprise(s)` or
+`bump_watchdog` in the same session before committing, like rollups.record_*.
+
+An endpoint's ETag is a hash of the versions it reads, the taxonomy version and its own
+parameters, so it changes exactly when the result can. `respond` answers If-None-Match
+with a 304 and otherwise serves the result cached under the ETag in a shared cache
+namespace, computing it only once per version across all workers. The versions live in
+the database, so all workers agree on them.
+"""
+import hashlib
+import json
+
+from fastapi import Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.cache import Namespace, shared_cache
+from src.models import upsert
+from src.models.versions import DataVersion
+
+WATCHDOG = 'watchdog'
+# Computed results, keyed by ETag. Entries never go stale (a change means a new ETag), the
+# TTL only returns the memory of versions nobody asks for anymore.
+RESULT_CACHE_SIZE = 2000
+RESULT_CACHE_TTL_SECONDS = 600
+# Browsers keep the response but revalidate it with If-None-Match on every use
+CACHE_CONTROL = "private, no-cache"
+
+results = shared_cache.namespace('results', ttl=RESULT_CACHE_TTL_SECONDS, local_size=RESULT_CACHE_SIZE)
+
+
+def enterprise_scope(enterprise_id: int) -> str:
+    return f"enterprise:{enterprise_id}"
+
+
+def bump(db: Session, scopes):
+    """Increments the version of each scope, starting at 1 for a scope seen for the first time."""
+    scopes = sorted(set(scopes))  # a fixed order, so concurrent bumps can't deadlock
+    if not scopes:
+        return
+    table = DataVersion.__table__
+    stmt = upsert.insert(db, table).on_conflict_do_update(index_elements=['scope'], set_={'version': table.c.version + 1})
+    db.execute(stmt, [{'scope': scope, 'version': 1} for scope in scopes])
+
+
+def bump_enterprise(db: Session, enterprise_id: int):
+    bump(db, [enterprise_scope(enterprise_id)])
+
+
+def bump_enterprises(db: Session, enterprise_ids):
+    bump(db, [enterprise_scope(enterprise_id) for enterprise_id in enterprise_ids])
+
+
+def bump_watchdog(db: Session):
+    bump(db, [WATCHDOG])
+
+
+def watchdog_version(db: Session) -> int:
+    """
+    The current watchdog version. Right after `bump_watchdog` it is the version of the
+    session's own write: the bumped row stays locked until commit, so rows stamped with it
+    commit in version order.
+    """
+    return get_versions(db, [WATCHDOG])[WATCHDOG]
+
+
+def get_versions(db: Session, scopes) -> dict:
+    """The current version of each scope; 0 for a scope that was never bumped."""
+    stored = dict(db.execute(select(DataVersion.scope, DataVersion.version).where(DataVersion.scope.in_(scopes))).all())
+    return {scope: stored.get(scope, 0) for scope in scopes}
+
+
+def make_etag(name: str, versions: dict, *parts) -> str:
+    """A weak ETag for endpoint `name` over `versions` and any other inputs in `parts`."""
+    payload = json.dumps([name, sorted(versions.items()), [str(part) for part in parts]], ensure_ascii=False)
+    return f'W/"{hashlib.sha1(payload.encode("utf-8")).hexdigest()}"'
+
+
+async def current_etag(db: AsyncSession, name: str, scopes, *parts) -> str:
+    """make_etag over the current versions of `scopes`, read in one query."""
+    return make_etag(name, await db.run_sync(get_versions, scopes), *parts)
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against `etag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = lambda tag: tag.strip().removeprefix('W/')
+    return opaque(etag) in {opaque(tag) for tag in if_none_match.split(',')}
+
+
+async def respond(request: Request, response: Response, etag: str, compute, namespace: Namespace = results):
+    """
+    Returns a 304 if the client already has `etag`, otherwise the result cached under it in
+    `namespace`, calling `await compute()` on a miss. Either way the response carries the ETag.
+    """
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+    async def compute_encoded():
+        # Cached as plain JSON data, so any worker can serve it
+        return jsonable_encoder(await compute())
+
+    return await namespace.aget_or_compute(etag, compute_encoded)
@@ -0,0 +1,148 @@
+"""
+Deadline calendar engine for the Gantt rules.
+
+Each `deadline_rule` string from the taxonomy is compiled once into a Recurrence
+(period kind + offset + calendar). A DeadlineTable then lays out every period of a
+horizon (24 months by default) as sorted arrays of start dates and due dates, so the
+due date of any task on any day is a binary search instead of date arithmetic.
+
+Supported rules:
+    end_of_month | end_of_season | end_of_year
+    <N>_days_after_month_end | <N>_days_after_season_end | <N>_days_after_year_end
+
+Periods are computed in the Solar Hijri calendar ('jalali', the default, which is what
+Iranian authorities use; seasons are the Jalali quarters starting 1 Farvardin, 1 Tir,
+1 Mehr and 1 Dey) or in the Gregorian calendar ('gregorian').
+"""
+import bisect
+import calendar as gregorian_calendar
+import datetime
+import re
+
+from src import jalali
+
+CALENDARS = ('jalali', 'gregorian')
+DEFAULT_CALENDAR = 'jalali'
+DEFAULT_HORIZON_MONTHS = 24
+
+_PERIOD_MONTHS = {'month': 1, 'season': 3, 'year': 12}
+_RULE_PATTERN = re.compile(r'^(?:end_of_(month|season|year)|(\d+)_days_after_(month|season|year)_end)$')
+
+
+class Recurrence:
+    """A compiled deadline rule: due `offset_days` after the last day of each period."""
+
+    def __init__(self, period: str, offset_days: int, calendar: str):
+        self.period = period
+        self.offset_days = offset_days
+        self.calendar = calendar
+
+    def __repr__(self):
+        return f"<Recurrence(period='{self.period}', offset_days={self.offset_days}, calendar='{self.calendar}')>"
+
+
+def compile_deadline_rule(rule: str, calendar: str = DEFAULT_CALENDAR):
+    """Compiles a deadline_rule string. Returns None for rules the engine doesn't know."""
+    if calendar not in CALENDARS:
+        raise ValueError(f"Unknown calendar '{calendar}', expected one of {CALENDARS}")
+    match = _RULE_PATTERN.match(rule or '')
+    if not match:
+        return None
+    if match.group(1):
+        return Recurrence(match.group(1), 0, calendar)
+    return Recurrence(match.group(3), int(match.group(2)), calendar)
+
+
+def add_months(day: datetime.date, months: int) -> datetime.date:
+    """Same day `months` Gregorian months later, clamped to the end of the target month."""
+    year, month = divmod(day.month - 1 + months, 12)
+    year, month = day.year + year, month + 1
+    return datetime.date(year, month, min(day.day, gregorian_calendar.monthrange(year, month)[1]))
+
+
+def _month_start(calendar, year, month):
+    if calendar == 'jalali':
+        return jalali.to_gregorian(year, month, 1)
+    return datetime.date(year, month, 1)
+
+
+def _year_month(calendar, date):
+    if calendar == 'jalali':
+        year, month, _ = jalali.from_gregorian(date)
+        return year, month
+    return date.year, date.month
+
+
+def period_starts(calendar: str, period: str, start: datetime.date, months: int):
+    """
+    Returns the start dates of consecutive periods, from the period containing `start`
+    through at least `months` months later, plus the start of the period after the last one.
+    """
+    step = _PERIOD_MONTHS[period]
+    year, month = _year_month(calendar, start)
+    month -= (month - 1) % step  # Align to the period boundary
+    starts = []
+    for _ in range(months // step + 2):
+        starts.append(_month_start(calendar, year, month))
+        month += step
+        if month > 12:
+            year, month = year + 1, month - 12
+    return starts
+
+
+class DeadlineTable:
+    """
+    Precomputed due dates of a set of recurrences over a horizon.
+
+    For every (calendar, period kind) the table keeps the sorted ordinals of the period
+    start dates; every recurrence on that grid keeps the due-date ordinal of each period.
+    """
+
+    def __init__(self, recurrences: dict, start: datetime.date, horizon_months: int = DEFAULT_HORIZON_MONTHS):
+        self.start = start
+        self.horizon_months = horizon_months
+        self.horizon_end = add_months(start, horizon_months)
+        self._grids = {}  # (calendar, period) -> list of period start ordinals (one extra at the end)
+        self._dues = {}   # task_id -> ((calendar, period), list of due ordinals)
+
+        by_grid = {}
+        for task_id, recurrence in recurrences.items():
+            if recurrence is not None:
+                by_grid.setdefault((recurrence.calendar, recurrence.period), []).append((task_id, recurrence))
+
+        for (calendar, period), members in by_grid.items():
+            # Start early enough that deadlines of earlier periods still falling after `start`
+            # (e.g. last season's 45-days-after deadline) are in the table too
+            max_offset = max(recurrence.offset_days for _, recurrence in members)
+            grid_start = start - datetime.timedelta(days=max_offset)
+            grid_months = horizon_months + max_offset // 28 + 1
+            starts = [day.toordinal() for day in period_starts(calendar, period, grid_start, grid_months)]
+            self._grids[(calendar, period)] = starts
+            for task_id, recurrence in members:
+                # Last day of period i is the day before period i + 1 starts
+                self._dues[task_id] = ((calendar, period), [starts[i + 1] - 1 + recurrence.offset_days for i in range(len(starts) - 1)])
+
+    def covers(self, day: datetime.date, months: int = 0) -> bool:
+        """True if the table holds every period from `day` through `months` months later."""
+        return self.start <= day and add_months(day, months) <= self.horizon_end
+
+    def due_date(self, task_id, day: datetime.date):
+        """Due date of the task for the period containing `day`, or None if unknown/out of range."""
+        entry = self._dues.get(task_id)
+        if entry is None:
+            return None
+        grid_key, dues = entry
+        index = bisect.bisect_right(self._grids[grid_key], day.toordinal()) - 1
+        if index < 0 or index >= len(dues):
+            return None
+        return datetime.date.fromordinal(dues[index])
+
+    def due_dates(self, task_id, first_day: datetime.date, last_day: datetime.date):
+        """All due dates of the task that fall within [first_day, last_day]."""
+        entry = self._dues.get(task_id)
+        if entry is None:
+            return []
+        _, dues = entry
+        lo = bisect.bisect_left(dues, first_day.toordinal())
+        hi = bisect.bisect_right(dues, last_day.toordinal())
+        return [datetime.date.fromordinal(due) for due in dues[lo:hi]]
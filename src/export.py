@@ -0,0 +1,62 @@
+"""
+Streaming exports of whole tables as NDJSON or CSV.
+
+Rows are read through a server-side cursor (`AsyncSession.stream` with `yield_per`) and
+serialized one chunk at a time, so the memory used by an export does not depend on how
+many rows it has. The generators open their own session: the request's session is closed
+once the endpoint returns, before the response body has been streamed.
+"""
+import csv
+import io
+
+from fastapi.responses import StreamingResponse
+
+from src.models.database import AsyncSessionLocal
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+CHUNK_SIZE = 1000
+
+
+def _csv_line(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+async def iter_export(statement, schema, fmt: str, chunk_size: int = CHUNK_SIZE, session_factory=AsyncSessionLocal):
+    """
+    Yields the serialized rows of `statement` (a select() of one entity) in chunks of
+    `chunk_size` rows.
+
+    :param schema: Pydantic model each row is serialized through (the list endpoint's response model).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {tuple(FORMATS)}")
+    fields = list(schema.model_fields)
+    if fmt == 'csv':
+        # Excel needs the BOM to read UTF-8 (Persian) text
+        yield '\ufeff' + _csv_line(fields)
+
+    async with session_factory() as db:
+        result = await db.stream(statement.execution_options(yield_per=chunk_size))
+        async for rows in result.scalars().partitions():
+            chunk = []
+            for row in rows:
+                item = schema.model_validate(row, from_attributes=True)
+                if fmt == 'ndjson':
+                    chunk.append(item.model_dump_json() + '\n')
+                else:
+                    values = item.model_dump(mode='json')
+                    chunk.append(_csv_line(['' if values[field] is None else values[field] for field in fields]))
+                # The row is serialized; drop it from the session so the identity map stays small
+                db.expunge(row)
+            yield ''.join(chunk)
+
+
+def export_response(statement, schema, fmt: str, filename: str) -> StreamingResponse:
+    """A StreamingResponse that downloads the export as `<filename>.<fmt>`."""
+    return StreamingResponse(
+        iter_export(statement, schema, fmt),
+        media_type=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
@@ -0,0 +1,104 @@
+"""
+Solar Hijri (Jalali) calendar conversions, using the 33-year break table of the
+jalaali algorithm (valid for Jalali years -61 to 3177).
+
+Dates are exchanged as `datetime.date` on the Gregorian side and (year, month, day)
+tuples on the Jalali side.
+"""
+import datetime
+
+_BREAKS = [-61, 9, 38, 199, 426, 686, 756, 818, 1111, 1181, 1210, 1635, 2060, 2097, 2192, 2262, 2324, 2394, 2456, 3178]
+
+
+def _div(a, b):
+    # Integer division truncating toward zero, as in the reference algorithm
+    return int(a / b)
+
+
+def _mod(a, b):
+    return a - _div(a, b) * b
+
+
+def _jal_cal(jy):
+    """Returns (leap, gregorian year, march day of Farvardin 1) for a Jalali year."""
+    if jy < _BREAKS[0] or jy >= _BREAKS[-1]:
+        raise ValueError(f"Jalali year {jy} is out of the supported range")
+
+    gy = jy + 621
+    leap_j = -14
+    jp = _BREAKS[0]
+    jump = 0
+    for jm in _BREAKS[1:]:
+        jump = jm - jp
+        if jy < jm:
+            break
+        leap_j += _div(jump, 33) * 8 + _div(_mod(jump, 33), 4)
+        jp = jm
+
+    n = jy - jp
+    leap_j += _div(n, 33) * 8 + _div(_mod(n, 33) + 3, 4)
+    if _mod(jump, 33) == 4 and jump - n == 4:
+        leap_j += 1
+
+    leap_g = _div(gy, 4) - _div((_div(gy, 100) + 1) * 3, 4) - 150
+    march = 20 + leap_j - leap_g
+
+    if jump - n < 6:
+        n = n - jump + _div(jump + 4, 33) * 33
+    leap = _mod(_mod(n + 1, 33) - 1, 4)
+    if leap == -1:
+        leap = 4
+    return leap, gy, march
+
+
+def is_leap(jy: int) -> bool:
+    return _jal_cal(jy)[0] == 0
+
+
+def month_length(jy: int, jm: int) -> int:
+    if jm <= 6:
+        return 31
+    if jm <= 11:
+        return 30
+    return 30 if is_leap(jy) else 29
+
+
+def to_gregorian(jy: int, jm: int, jd: int) -> datetime.date:
+    _, gy, march = _jal_cal(jy)
+    ordinal = datetime.date(gy, 3, march).toordinal() + (jm - 1) * 31 - _div(jm, 7) * (jm - 7) + jd - 1
+    return datetime.date.fromordinal(ordinal)
+
+
+def from_gregorian(date: datetime.date):
+    """Returns the (year, month, day) Jalali date of a Gregorian date."""
+    ordinal = date.toordinal()
+    jy = date.year - 621
+    leap, gy, march = _jal_cal(jy)
+    k = ordinal - datetime.date(gy, 3, march).toordinal()
+    if k >= 0:
+        if k <= 185:
+            return jy, 1 + _div(k, 31), _mod(k, 31) + 1
+        k -= 186
+    else:
+        jy -= 1
+        k += 179
+        if leap == 1:
+            k += 1
+    return jy, 7 + _div(k, 30), _mod(k, 30) + 1
+
+
+_DIGITS = str.maketrans({**{chr(0x06F0 + i): str(i) for i in range(10)}, **{chr(0x0660 + i): str(i) for i in range(10)}})
+
+
+def parse(text: str):
+    """Parses a 'YYYY/MM/DD' (or 'YYYY-MM-DD') Jalali date, in any digits, to a Gregorian date. None if it isn't one."""
+    if not text:
+        return None
+    parts = text.strip().translate(_DIGITS).replace('-', '/').split('/')
+    try:
+        jy, jm, jd = (int(part) for part in parts)
+        if not 1 <= jm <= 12 or not 1 <= jd <= month_length(jy, jm):
+            return None
+        return to_gregorian(jy, jm, jd)
+    except ValueError:
+        return None
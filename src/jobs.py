@@ -0,0 +1,304 @@
+"""
+Background batch jobs. Each job can be triggered from the API as a background task
+or run from the command line, e.g. `python -m src.jobs brand-matching`.
+"""
+import datetime
+import sys
+
+from sqlalchemy import or_, tuple_
+from sqlalchemy.orm import Session
+
+from src.logic_engine import get_shared_engine
+from src.models import gantt, identity, upsert, watchdog
+from src.models.database import SessionLocal
+from src.persian_text import normalize, token_key
+from src import data_versions, migrations, rollups
+
+BRAND_MATCHING_JOB = 'brand_matching'
+
+
+def _start_run_log(db_session: Session, job_name: str) -> watchdog.CrawlerRunLog:
+    log_entry = db_session.query(watchdog.CrawlerRunLog).filter_by(crawler_name=job_name).first()
+    if not log_entry:
+        log_entry = watchdog.CrawlerRunLog(crawler_name=job_name)
+        db_session.add(log_entry)
+
+    log_entry.last_run_start = datetime.datetime.utcnow()
+    log_entry.status = 'running'
+    log_entry.details = None
+    log_entry.items_added = 0
+    db_session.commit()
+    return log_entry
+
+
+def run_brand_matching(db_session: Session, similarity_threshold=80, max_workers=None, batch_size=50000):
+    """
+    Matches every enterprise's brand against the trademarks inserted or changed since the
+    last run and stores the hits as BrandMatch rows.
+
+    The last processed trademark id is kept on the job's CrawlerRunLog row, so each run only
+    pays for new trademarks x clients. Batches are committed together with the watermark, so
+    an interrupted run resumes where it stopped. Trademarks changed in place since the last
+    complete run (changed_version above the log's last_version) have their matches replaced.
+    """
+    log_entry = _start_run_log(db_session, BRAND_MATCHING_JOB)
+    matches_added = 0
+    try:
+        # Read first: rows committed meanwhile are matched now or, at worst, again next run
+        version = data_versions.watchdog_version(db_session)
+        watermark = log_entry.last_item_id or 0
+        changed_since = or_(
+            watchdog.TrademarkRegistration.id > watermark,
+            watchdog.TrademarkRegistration.changed_version > (log_entry.last_version or 0),
+        )
+        last_id = 0
+        logic_engine = get_shared_engine()
+        enterprises = [
+            (row.id, row.name_tokens if row.name_tokens is not None else token_key(row.name))
+            for row in db_session.query(
+                identity.EnterpriseProfile.id,
+                identity.EnterpriseProfile.name,
+                identity.EnterpriseProfile.name_tokens,
+            )
+            if row.name
+        ]
+
+        while True:
+            rows = (
+                db_session.query(
+                    watchdog.TrademarkRegistration.id,
+                    watchdog.TrademarkRegistration.name,
+                    watchdog.TrademarkRegistration.name_tokens,
+                )
+                .filter(changed_since, watchdog.TrademarkRegistration.id > last_id)
+                .order_by(watchdog.TrademarkRegistration.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+
+            new_trademarks = [{"id": row.id, "name": row.name, "name_tokens": row.name_tokens} for row in rows]
+            hits = logic_engine.batch_match_brands(enterprises, new_trademarks, similarity_threshold, max_workers=max_workers)
+
+            # Trademarks matched before and changed since: their old matches may no longer hold
+            revisited = [row.id for row in rows if row.id <= watermark]
+            previous = set()
+            if revisited:
+                previous = set(
+                    db_session.query(watchdog.BrandMatch.enterprise_id, watchdog.BrandMatch.trademark_id)
+                    .filter(watchdog.BrandMatch.trademark_id.in_(revisited))
+                    .all()
+                )
+                db_session.query(watchdog.BrandMatch).filter(watchdog.BrandMatch.trademark_id.in_(revisited)).delete(synchronize_session=False)
+
+            # Re-runs over the same ids (e.g. after a crash before the commit) must not duplicate hits
+            existing = set()
+            if hits:
+                existing = set(
+                    db_session.query(watchdog.BrandMatch.enterprise_id, watchdog.BrandMatch.trademark_id)
+                    .filter(watchdog.BrandMatch.trademark_id.in_({trademark_id for _, trademark_id, _ in hits}))
+                    .all()
+                )
+            new_matches = [
+                watchdog.BrandMatch(enterprise_id=enterprise_id, trademark_id=trademark_id, similarity=similarity)
+                for enterprise_id, trademark_id, similarity in hits
+                if (enterprise_id, trademark_id) not in existing
+            ]
+            db_session.add_all(new_matches)
+            matches_added += len([match for match in new_matches if (match.enterprise_id, match.trademark_id) not in previous])
+
+            last_id = rows[-1].id
+            log_entry.last_item_id = max(watermark, last_id)
+            log_entry.items_added = matches_added
+            db_session.commit()
+
+        log_entry.last_version = version
+        log_entry.status = 'success'
+        log_entry.details = f"Successfully added {matches_added} new brand matches."
+    except Exception as e:
+        db_session.rollback()
+        log_entry.status = 'failed'
+        log_entry.details = f"An unexpected error occurred: {str(e)[:500]}"
+    finally:
+        log_entry.last_run_finish = datetime.datetime.utcnow()
+        db_session.commit()
+    return matches_added
+
+
+# Tasks are materialized again, rolling the horizon forward, once they are this many days old
+TASK_REFRESH_DAYS = 30
+
+
+def needs_legal_tasks(enterprise: identity.EnterpriseProfile, today: datetime.date, taxonomy_version: str) -> bool:
+    """Whether materialize_legal_tasks(only_changed=True) would process the enterprise."""
+    if not enterprise.scale_name:
+        return False
+    return (
+        enterprise.tasks_materialized_scale != enterprise.scale_name
+        or enterprise.tasks_materialized_taxonomy != taxonomy_version
+        or enterprise.tasks_materialized_on is None
+        or enterprise.tasks_materialized_on < today - datetime.timedelta(days=TASK_REFRESH_DAYS)
+    )
+
+
+def materialize_legal_tasks(db_session: Session, only_changed=True, horizon_months=12, batch_size=500, today=None, enterprise_ids=None, logic_engine=None):
+    """
+    Writes the LegalTask rows of the next `horizon_months` for many enterprises at once.
+
+    With only_changed=True, only enterprises that are new, changed scale or taxonomy version
+    since their tasks were materialized, or were materialized more than TASK_REFRESH_DAYS
+    ago (so their horizon rolls forward) are processed; otherwise all of them. Inserts are
+    one multi-row statement per batch; existing (enterprise_id, task_id, due_date) rows
+    that are still pending get the rule's current title and responsible body, so re-running
+    is harmless. Pending future tasks the rules no longer produce (after a scale change or
+    a rule edit) are removed.
+
+    :param enterprise_ids: Restrict the run to these enterprises.
+    :param logic_engine: The LogicEngine whose rules to apply; the shared one by default.
+    :return: Number of task rows sent for insert (existing occurrences are updated instead).
+    """
+    logic_engine = logic_engine or get_shared_engine()
+    # Read first: if the taxonomy reloads mid-run, the older version is stored and the next run redoes it
+    taxonomy_version = logic_engine.taxonomy_version
+    today = today or datetime.date.today()
+    table = gantt.LegalTask.__table__
+    insert_stmt = upsert.insert(db_session, table)
+    insert_stmt = insert_stmt.on_conflict_do_update(
+        index_elements=['enterprise_id', 'task_id', 'due_date'],
+        set_={'title': insert_stmt.excluded.title, 'responsible_body': insert_stmt.excluded.responsible_body},
+        where=table.c.status == gantt.TaskStatus.pending,
+    )
+
+    query = db_session.query(identity.EnterpriseProfile.id, identity.EnterpriseProfile.scale_name).filter(
+        identity.EnterpriseProfile.scale_name.isnot(None)
+    )
+    if enterprise_ids is not None:
+        query = query.filter(identity.EnterpriseProfile.id.in_(enterprise_ids))
+    if only_changed:
+        # Same conditions as needs_legal_tasks
+        query = query.filter(or_(
+            identity.EnterpriseProfile.tasks_materialized_scale.is_(None),
+            identity.EnterpriseProfile.tasks_materialized_scale != identity.EnterpriseProfile.scale_name,
+            identity.EnterpriseProfile.tasks_materialized_taxonomy.is_(None),
+            identity.EnterpriseProfile.tasks_materialized_taxonomy != taxonomy_version,
+            identity.EnterpriseProfile.tasks_materialized_on.is_(None),
+            identity.EnterpriseProfile.tasks_materialized_on < today - datetime.timedelta(days=TASK_REFRESH_DAYS),
+        ))
+    enterprises = query.order_by(identity.EnterpriseProfile.id).all()
+
+    # Enterprises of the same scale get the same schedule; compute it once per scale
+    schedules = {}
+    tasks_written = 0
+    for offset in range(0, len(enterprises), batch_size):
+        batch = enterprises[offset:offset + batch_size]
+        by_scale = {}
+        for enterprise_id, scale_name in batch:
+            by_scale.setdefault(scale_name, []).append(enterprise_id)
+
+        rows = []
+        for scale_name, scale_enterprise_ids in by_scale.items():
+            if scale_name not in schedules:
+                schedules[scale_name] = logic_engine.get_deadline_horizon({"scale_name": scale_name}, today, horizon_months)
+            schedule = schedules[scale_name]
+
+            # Drop pending future occurrences the rules no longer produce: rules that stopped
+            # applying to this scale, or whose deadline_rule now gives other due dates
+            stale = db_session.query(gantt.LegalTask).filter(
+                gantt.LegalTask.enterprise_id.in_(scale_enterprise_ids),
+                gantt.LegalTask.status == gantt.TaskStatus.pending,
+                gantt.LegalTask.due_date >= today,
+            )
+            occurrences = {(rule['task_id'], due_date) for rule, due_date in schedule}
+            if occurrences:
+                stale = stale.filter(tuple_(gantt.LegalTask.task_id, gantt.LegalTask.due_date).notin_(occurrences))
+            stale.delete(synchronize_session=False)
+
+            for enterprise_id in scale_enterprise_ids:
+                for rule, due_date in schedule:
+                    rows.append({
+                        "enterprise_id": enterprise_id,
+                        "task_id": rule['task_id'],
+                        "title": rule['title'],
+                        "responsible_body": rule['responsible_body'],
+                        "due_date": due_date,
+                        "status": gantt.TaskStatus.pending,
+                    })
+
+        if rows:
+            db_session.execute(insert_stmt, rows)
+        db_session.query(identity.EnterpriseProfile).filter(
+            identity.EnterpriseProfile.id.in_([enterprise_id for enterprise_id, _ in batch])
+        ).update({
+            identity.EnterpriseProfile.tasks_materialized_scale: identity.EnterpriseProfile.scale_name,
+            identity.EnterpriseProfile.tasks_materialized_taxonomy: taxonomy_version,
+            identity.EnterpriseProfile.tasks_materialized_on: today,
+        }, synchronize_session=False)
+        data_versions.bump_enterprises(db_session, [enterprise_id for enterprise_id, _ in batch])
+        db_session.commit()
+        tasks_written += len(rows)
+    return tasks_written
+
+
+def backfill_name_keys(db_session: Session, batch_size=5000):
+    """
+    Fills name_normalized/name_tokens for enterprise and trademark rows stored before the
+    keys existed. New and updated rows get their keys from the model validators.
+    """
+    updated = 0
+    for model in (identity.EnterpriseProfile, watchdog.TrademarkRegistration):
+        while True:
+            rows = db_session.query(model).filter(model.name_tokens.is_(None)).limit(batch_size).all()
+            for row in rows:
+                row.name_normalized = normalize(row.name)
+                row.name_tokens = token_key(row.name)
+            # The keys feed brand matching, so cached brand alerts are out of date
+            if model is identity.EnterpriseProfile:
+                data_versions.bump_enterprises(db_session, [row.id for row in rows])
+            elif rows:
+                # New keys match differently: let the brand index and the matching job re-read the rows
+                data_versions.bump_watchdog(db_session)
+                version = data_versions.watchdog_version(db_session)
+                for row in rows:
+                    row.changed_version = version
+            db_session.commit()
+            updated += len(rows)
+            if len(rows) < batch_size:
+                break
+    return updated
+
+
+def rebuild_rollups(db_session: Session):
+    """Recomputes every FinancialRollup row from the ledger tables."""
+    return rollups.rebuild_rollups(db_session)
+
+
+def check_rollups(db_session: Session):
+    """Prints every period whose rollup disagrees with the ledger tables."""
+    mismatches = rollups.check_rollups(db_session)
+    for enterprise_id, period, expected, stored in mismatches:
+        print(f"enterprise {enterprise_id} {period}: expected {expected}, stored {stored}")
+    return f"{len(mismatches)} mismatched periods"
+
+
+JOBS = {
+    'brand-matching': run_brand_matching,
+    'backfill-name-keys': backfill_name_keys,
+    'rebuild-rollups': rebuild_rollups,
+    'materialize-legal-tasks': lambda db_session: materialize_legal_tasks(db_session, only_changed=False),
+    'check-rollups': check_rollups,
+    'migrate': lambda db_session: migrations.upgrade(db_session.get_bind()),
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in JOBS:
+        print(f"Usage: python -m src.jobs [{'|'.join(JOBS)}]")
+        sys.exit(1)
+
+    db_session = SessionLocal()
+    try:
+        result = JOBS[sys.argv[1]](db_session)
+        print(f"{sys.argv[1]}: {result}")
+    finally:
+        db_session.close()
@@ -0,0 +1,159 @@
+"""
+Bulk import of bank transactions and tax invoices from CSV or NDJSON uploads.
+
+The upload is parsed row by row, each row is validated against the same schema as the
+single-row POST endpoints, and valid rows are written in batches: one SELECT for the rows
+the batch replaces, one multi-row INSERT ... ON CONFLICT DO UPDATE keyed on reference_id
+(transactions) or tax_id (invoices), one rollup update per touched month and one commit.
+Invalid rows don't stop the import; they are returned in the report with their line number.
+A row followed by another row with the same key in its batch is counted as a duplicate and
+not written, so every received row is inserted, updated, a duplicate or an error.
+"""
+import codecs
+import csv
+import json
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from src import data_versions, rollups, schemas
+from src.models import finance, upsert
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 1000
+
+
+class LedgerKind:
+    """What is imported: the row schema, the table, its natural key and its rollup writer."""
+
+    def __init__(self, schema, model, key, record_rollups):
+        self.schema = schema
+        self.model = model
+        self.key = key
+        self.record_rollups = record_rollups
+
+
+TRANSACTIONS = LedgerKind(schemas.BankTransactionCreate, finance.BankTransaction, 'reference_id', rollups.record_transactions)
+INVOICES = LedgerKind(schemas.TaxInvoiceCreate, finance.TaxInvoice, 'tax_id', rollups.record_invoices)
+
+
+def detect_format(filename: str = None, content_type: str = None) -> str:
+    """Guesses the upload format from its file name or content type; NDJSON unless it looks like CSV."""
+    if (filename or '').lower().endswith('.csv') or 'csv' in (content_type or ''):
+        return 'csv'
+    return 'ndjson'
+
+
+def parse_rows(stream, fmt: str):
+    """
+    Yields (line number, row dict or None, error or None) from a binary stream, one line at
+    a time, so an upload of any size is never held in memory. Empty CSV cells become None.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown import format '{fmt}', expected one of {FORMATS}")
+    text = codecs.getreader('utf-8-sig')(stream)
+
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {key: (value if value != '' else None) for key, value in row.items() if key}, None
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "Expected a JSON object"
+            continue
+        yield line_no, row, None
+
+
+def _upsert_statement(db: Session, kind: LedgerKind):
+    """INSERT ... ON CONFLICT (key) DO UPDATE, only ever overwriting rows of the same enterprise."""
+    table = kind.model.__table__
+    stmt = upsert.insert(db, table)
+    columns = [name for name in kind.schema.model_fields if name != kind.key]
+    return stmt.on_conflict_do_update(
+        index_elements=[kind.key],
+        set_={name: stmt.excluded[name] for name in columns},
+        where=table.c.enterprise_id == stmt.excluded.enterprise_id,
+    )
+
+
+def _write_batch(db: Session, kind: LedgerKind, enterprise_id: int, batch: list, report: dict):
+    """Upserts one batch of (line number, row) and keeps the rollups in step."""
+    # Later rows win over earlier rows with the same key in the same batch
+    by_key, rows = {}, []
+    for line_no, row in batch:
+        key = row.get(kind.key)
+        if key is None:
+            rows.append((line_no, row))
+        else:
+            if key in by_key:
+                report['duplicates'] += 1
+            by_key[key] = (line_no, row)
+    rows.extend(by_key.values())
+
+    model = kind.model
+    existing = {}
+    if by_key:
+        found = db.query(model.enterprise_id, *[getattr(model, name) for name in kind.schema.model_fields]).filter(
+            getattr(model, kind.key).in_(list(by_key))
+        )
+        existing = {row._mapping[kind.key]: dict(row._mapping) for row in found}
+
+    values = []
+    for line_no, row in rows:
+        previous = existing.get(row.get(kind.key))
+        if previous is not None and previous['enterprise_id'] != enterprise_id:
+            report['errors'].append({"line": line_no, "error": f"{kind.key} '{row[kind.key]}' belongs to another enterprise"})
+            continue
+        values.append({**row, "enterprise_id": enterprise_id})
+    if not values:
+        return
+
+    replaced = [row for row in existing.values() if row['enterprise_id'] == enterprise_id]
+    kind.record_rollups(db, replaced, -1)
+    db.execute(_upsert_statement(db, kind), values)
+    kind.record_rollups(db, values)
+    data_versions.bump_enterprise(db, enterprise_id)
+    db.commit()
+
+    report['updated'] += len(replaced)
+    report['inserted'] += len(values) - len(replaced)
+
+
+def import_ledger(db: Session, enterprise_id: int, kind: LedgerKind, stream, fmt: str, batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """
+    Imports an uploaded file of transactions or invoices into an enterprise's ledger.
+
+    Each batch is committed on its own, so a failure part way through keeps earlier batches.
+
+    :param kind: TRANSACTIONS or INVOICES.
+    :return: {'received', 'inserted', 'updated', 'duplicates', 'errors': [{'line', 'error'}]}
+    """
+    report = {"received": 0, "inserted": 0, "updated": 0, "duplicates": 0, "errors": []}
+    batch = []
+    for line_no, row, error in parse_rows(stream, fmt):
+        report['received'] += 1
+        if error is None:
+            try:
+                batch.append((line_no, kind.schema(**row).model_dump()))
+            except ValidationError as e:
+                error = "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+        if error is not None:
+            report['errors'].append({"line": line_no, "error": error})
+
+        if len(batch) >= batch_size:
+            _write_batch(db, kind, enterprise_id, batch, report)
+            batch = []
+
+    if batch:
+        _write_batch(db, kind, enterprise_id, batch, report)
+    report['errors'].sort(key=lambda err: err['line'])
+    return report
@@ -0,0 +1,107 @@
+"""
+Aggregate queries over an enterprise's ledger.
+
+These push the summing into the database (SUM ... GROUP BY), so callers get a handful of
+numbers instead of every BankTransaction and TaxInvoice row of the tenant.
+
+Months and seasons are Jalali, like the filing periods of src/deadlines.py: month
+'1401-10' is Dey 1401 and season '1401-Q4' is Dey to Esfand.
+"""
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from src.models import finance
+from src.models.finance import FinancialRollup, TransactionType
+from src.rollups import ROLLUP_FIELDS, day_of, period_of
+
+PERIODS = (None, 'month', 'season')
+
+
+def _period_label(period, month_label):
+    """The bucket of a Jalali month ('YYYY-MM', as from rollups.period_of)."""
+    if period == 'month':
+        return month_label
+    if period == 'season':
+        year, month = month_label.split('-')
+        return f"{year}-Q{(int(month) - 1) // 3 + 1}"
+    return None
+
+
+def _sums_by_month(db: Session, amount_col, date_col, *filters):
+    """Returns {Jalali month: total} for the rows matching `filters`."""
+    # Jalali months don't start on Gregorian ones, so SQL groups by day and days fold into months here
+    day = day_of(date_col)
+    rows = db.query(day, func.coalesce(func.sum(amount_col), 0)).filter(*filters).group_by(day).all()
+    sums = {}
+    for d, total in rows:
+        month_label = period_of(d)
+        sums[month_label] = sums.get(month_label, 0) + int(total)
+    return sums
+
+
+def get_reconciliation_totals(db: Session, enterprise_id: int, period: str = None):
+    """
+    Returns the deposit and invoice totals of an enterprise, optionally bucketed by period.
+
+    :param period: None for a single overall bucket, 'month' or 'season' (Jalali).
+    :return: List of dicts with 'period', 'total_deposits' and 'total_invoiced', ordered by period.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}")
+
+    if period is None:
+        total_deposits = db.query(func.coalesce(func.sum(finance.BankTransaction.amount), 0)).filter(
+            finance.BankTransaction.enterprise_id == enterprise_id,
+            finance.BankTransaction.type == TransactionType.DEPOSIT
+        ).scalar()
+        total_invoiced = db.query(func.coalesce(func.sum(finance.TaxInvoice.amount), 0)).filter(
+            finance.TaxInvoice.enterprise_id == enterprise_id
+        ).scalar()
+        return [{"period": None, "total_deposits": int(total_deposits), "total_invoiced": int(total_invoiced)}]
+
+    deposits = _sums_by_month(
+        db, finance.BankTransaction.amount, finance.BankTransaction.transaction_date,
+        finance.BankTransaction.enterprise_id == enterprise_id,
+        finance.BankTransaction.type == TransactionType.DEPOSIT,
+    )
+    invoiced = _sums_by_month(
+        db, finance.TaxInvoice.amount, finance.TaxInvoice.issue_date,
+        finance.TaxInvoice.enterprise_id == enterprise_id,
+    )
+
+    buckets = {}
+    for source, field in ((deposits, "total_deposits"), (invoiced, "total_invoiced")):
+        for month_label, total in source.items():
+            label = _period_label(period, month_label)
+            bucket = buckets.setdefault(label, {"period": label, "total_deposits": 0, "total_invoiced": 0})
+            bucket[field] += total
+    return [buckets[label] for label in sorted(buckets)]
+
+
+def get_rollup_summary(db: Session, enterprise_id: int, period: str = None):
+    """
+    Returns the ledger totals and row counts of an enterprise from its FinancialRollup rows
+    (one row per Jalali month), optionally bucketed by period. No ledger rows are read.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}")
+
+    rows = db.query(FinancialRollup).filter(FinancialRollup.enterprise_id == enterprise_id).all()
+    buckets = {}
+    for row in rows:
+        label = _period_label(period, row.period)
+        bucket = buckets.setdefault(label, {"period": label, **{field: 0 for field in ROLLUP_FIELDS}})
+        for field in ROLLUP_FIELDS:
+            bucket[field] += getattr(row, field)
+
+    if period is None and not buckets:
+        buckets[None] = {"period": None, **{field: 0 for field in ROLLUP_FIELDS}}
+    return [buckets[label] for label in sorted(buckets, key=lambda label: label or '')]
+
+
+def get_rollup_totals(db: Session, enterprise_id: int, period: str = None):
+    """get_reconciliation_totals, answered from the rollups."""
+    return [
+        {"period": bucket["period"], "total_deposits": bucket["deposits_total"], "total_invoiced": bucket["invoiced_total"]}
+        for bucket in get_rollup_summary(db, enterprise_id, period)
+    ]
@@ -1,31 +1,56 @@
 
-import json
-from thefuzz import fuzz
 import datetime
-from dateutil.relativedelta import relativedelta
-from dateutil.rrule import rrule, MONTHLY, FR
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from src.taxonomy import TaxonomyStore, DEFAULT_TAXONOMY_PATH
+from src.brand_index import TrademarkIndex
+from src.persian_text import similarity as key_similarity, token_key
+from src.deadlines import add_months
+from src.reconciliation import LedgerItem, match_deposits_to_invoices
+from src.models.finance import TransactionType
 
 class LogicEngine:
-    def __init__(self, taxonomy_path='c:\\Users\\Administrator\\Documents\\dastyar-360\\src\\content_taxonomy.json'):
+    def __init__(self, taxonomy_path=DEFAULT_TAXONOMY_PATH, store: TaxonomyStore = None):
         """Initializes the Logic Engine by loading the content taxonomy."""
-        self.taxonomy = self._load_taxonomy(taxonomy_path)
-        if not self.taxonomy:
-            raise ValueError("Failed to load or parse the content taxonomy.")
-        
-        self.alert_structure = self.taxonomy.get('alert_message_structure', {})
-        self.gantt_tasks = self.taxonomy.get('gantt_chart_tasks', [])
-
-    def _load_taxonomy(self, path):
-        """Loads the JSON taxonomy file from the given path."""
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            print(f"Error: Taxonomy file not found at {path}")
-            return None
-        except json.JSONDecodeError:
-            print(f"Error: Could not decode JSON from {path}")
-            return None
+        self.store = store or TaxonomyStore(taxonomy_path)
+
+    @property
+    def taxonomy(self):
+        return self.store.snapshot.taxonomy
+
+    @property
+    def taxonomy_version(self):
+        return self.store.version
+
+    @property
+    def alert_structure(self):
+        return self.taxonomy.get('alert_message_structure', {})
+
+    @property
+    def gantt_tasks(self):
+        return self.taxonomy.get('gantt_chart_tasks', [])
+
+    @property
+    def compiled(self):
+        return self.store.snapshot.compiled
+
+    def get_scale_rule(self, scale_name):
+        """Returns the scale_logic rule for a scale name, or None."""
+        return self.compiled.scale_rules.get(scale_name)
+
+    def get_gantt_rules_for_scale(self, scale_name):
+        """Returns the Gantt rules that apply to a scale, in taxonomy order."""
+        return self.compiled.gantt_rules_by_scale.get(scale_name, [])
+
+    def get_activity_tasks(self, activity_id):
+        """Returns the tasks of a sub-activity, or of every sub-activity in a cluster."""
+        return self.compiled.activity_tasks.get(activity_id, [])
+
+    def reload_if_changed(self):
+        """Swaps in a new taxonomy if the file on disk has changed since it was loaded."""
+        return self.store.reload_if_changed()
 
     def generate_health_checklist_alert(self, company_profile):
         """
@@ -36,8 +61,8 @@ class LogicEngine:
         if not company_scale_name:
             return None
 
-        # Find the rule for the specific scale from the list of rules
-        scale_rule = next((rule for rule in self.taxonomy.get('scale_logic', []) if rule.get('name') == company_scale_name), None)
+        # Find the rule for the specific scale
+        scale_rule = self.get_scale_rule(company_scale_name)
 
         if not scale_rule:
             return None # No rule found for this scale name
@@ -72,77 +97,107 @@ class LogicEngine:
         :param tax_invoices: List of TaxInvoice SQLAlchemy objects.
         :param tolerance_percentage: The allowed percentage difference before triggering an alert.
         """
-        alerts = []
-        
-        # Calculate total deposits (where is_debit is False)
-        total_deposits = sum(tx.amount for tx in bank_transactions if not tx.is_debit)
+        # Calculate total deposits (withdrawals are ignored)
+        total_deposits = sum(tx.amount for tx in bank_transactions if tx.type == TransactionType.DEPOSIT)
         
         # Calculate total from all tax invoices
-        total_invoiced = sum(inv.total_amount for inv in tax_invoices)
-        
-        # Check if deposits exceed invoices beyond the tolerance threshold
-        if total_deposits > total_invoiced * (1 + tolerance_percentage / 100):
-            unaccounted_amount = total_deposits - total_invoiced
-            
-            alert = self.alert_structure.copy()
-            alert['alert_id'] = "FIN-002" # Financial Alert 002 - Mismatch Summary
-            alert['type'] = "Financial"
-            alert['priority'] = "High"
-            alert['title'] = "مغایرت بین مجموع واریزی‌ها و فاکتورهای صادره"
-            alert['summary'] = (
-                f"مجموع واریزی‌های بانکی شما ({total_deposits:,.0f} ریال) به طور قابل توجهی "
-                f"بیشتر از مجموع فاکتورهای صادر شده شما ({total_invoiced:,.0f} ریال) است. "
-                f"این مغایرت به میزان {unaccounted_amount:,.0f} ریال می‌تواند نشان‌دهنده درآمد ثبت نشده باشد."
-            )
-            alert['call_to_action'] = "تراکنش‌های بانکی و فاکتورهای خود را بررسی کرده و در صورت نیاز فاکتورهای جدید صادر کنید."
-            alert['source'] = "Dastyar 360 Reconciliation Engine"
-            
-            # Add more details for context
-            alert['details'] = {
-                "total_deposits_rial": total_deposits,
-                "total_invoiced_rial": total_invoiced,
-                "unaccounted_amount_rial": unaccounted_amount,
-                "tolerance_percentage": tolerance_percentage
-            }
-            
-            alerts.append(alert)
+        total_invoiced = sum(inv.amount for inv in tax_invoices)
+
+        totals = [{"period": None, "total_deposits": total_deposits, "total_invoiced": total_invoiced}]
+        return self.reconcile_totals(totals, tolerance_percentage)
+
+    def reconcile_totals(self, totals: list, tolerance_percentage=5):
+        """
+        Same check as reconcile_transactions, on totals that were already aggregated
+        (see src.ledger_queries.get_reconciliation_totals). One alert per period whose
+        deposits exceed its invoices beyond the tolerance.
+
+        :param totals: List of dicts with 'period', 'total_deposits' and 'total_invoiced'.
+        :param tolerance_percentage: The allowed percentage difference before triggering an alert.
+        """
+        alerts = []
+
+        for bucket in totals:
+            period = bucket.get('period')
+            total_deposits = bucket['total_deposits']
+            total_invoiced = bucket['total_invoiced']
+
+            # Check if deposits exceed invoices beyond the tolerance threshold
+            if total_deposits > total_invoiced * (1 + tolerance_percentage / 100):
+                unaccounted_amount = total_deposits - total_invoiced
+                
+                alert = self.alert_structure.copy()
+                alert['alert_id'] = "FIN-002" # Financial Alert 002 - Mismatch Summary
+                alert['type'] = "Financial"
+                alert['priority'] = "High"
+                alert['title'] = "مغایرت بین مجموع واریزی‌ها و فاکتورهای صادره"
+                if period:
+                    alert['title'] += f" ({period})"
+                alert['summary'] = (
+                    f"مجموع واریزی‌های بانکی شما ({total_deposits:,.0f} ریال) به طور قابل توجهی "
+                    f"بیشتر از مجموع فاکتورهای صادر شده شما ({total_invoiced:,.0f} ریال) است. "
+                    f"این مغایرت به میزان {unaccounted_amount:,.0f} ریال می‌تواند نشان‌دهنده درآمد ثبت نشده باشد."
+                )
+                alert['call_to_action'] = "تراکنش‌های بانکی و فاکتورهای خود را بررسی کرده و در صورت نیاز فاکتورهای جدید صادر کنید."
+                alert['source'] = "Dastyar 360 Reconciliation Engine"
+                
+                # Add more details for context
+                alert['details'] = {
+                    "period": period,
+                    "total_deposits_rial": total_deposits,
+                    "total_invoiced_rial": total_invoiced,
+                    "unaccounted_amount_rial": unaccounted_amount,
+                    "tolerance_percentage": tolerance_percentage
+                }
+                
+                alerts.append(alert)
             
         return alerts
 
-    def generate_legal_gantt_chart(self, enterprise_profile: dict):
+    def match_transactions(self, bank_transactions: list, tax_invoices: list, amount_tolerance=0, date_window_days=30):
+        """
+        Pairs individual deposits with tax invoices by amount (within `amount_tolerance` rials)
+        and date (within `date_window_days`), so unexplained deposits can be listed one by one.
+
+        :param bank_transactions: List of BankTransaction SQLAlchemy objects; withdrawals are ignored.
+        :param tax_invoices: List of TaxInvoice SQLAlchemy objects.
+        :return: Dict with 'matched' (transaction, invoice) pairs, 'unmatched_transactions'
+            and 'unmatched_invoices'.
+        """
+        deposits = [
+            LedgerItem(tx.id, tx.amount, tx.transaction_date, tx)
+            for tx in bank_transactions
+            if tx.type == TransactionType.DEPOSIT
+        ]
+        invoices = [LedgerItem(inv.id, inv.amount, inv.issue_date, inv) for inv in tax_invoices]
+
+        matched, unmatched_deposits, unmatched_invoices = match_deposits_to_invoices(
+            deposits, invoices, amount_tolerance, date_window_days
+        )
+        return {
+            "matched": [(deposit.source, invoice.source) for deposit, invoice in matched],
+            "unmatched_transactions": [deposit.source for deposit in unmatched_deposits],
+            "unmatched_invoices": [invoice.source for invoice in unmatched_invoices],
+        }
+
+    def generate_legal_gantt_chart(self, enterprise_profile: dict, today: datetime.date = None):
         """
         Generates a list of applicable legal tasks for an enterprise based on its profile.
+        Due dates are the deadlines of the current period, read from the precomputed deadline table.
         """
         tasks = []
-        today = datetime.date.today()
+        today = today or datetime.date.today()
         enterprise_scale = enterprise_profile.get('scale_name')
         # enterprise_industry = enterprise_profile.get('industry') # Assuming industry is part of the profile
 
-        gantt_rules = self.gantt_tasks
+        compiled = self.compiled
+        deadline_table = compiled.deadline_table(today)
+
+        # Only the rules that apply to the enterprise's scale
+        gantt_rules = compiled.gantt_rules_by_scale.get(enterprise_scale, [])
 
         for rule in gantt_rules:
-            # Check if the rule applies to the enterprise's scale
-            if enterprise_scale not in rule['applies_to_scale']:
-                continue
-
-            # --- Deadline Calculation Logic ---
-            due_date = None
-            if rule['deadline_rule'] == 'end_of_month':
-                # Last day of the current month
-                due_date = today + relativedelta(day=31)
-            elif rule['deadline_rule'] == '15_days_after_season_end':
-                # Find the end of the current quarter/season
-                current_quarter = (today.month - 1) // 3 + 1
-                season_end_month = current_quarter * 3
-                season_end_day = 31 if season_end_month in [1, 3, 5, 7, 8, 10, 12] else 30
-                season_end_date = datetime.date(today.year, season_end_month, 1) + relativedelta(day=season_end_day)
-                due_date = season_end_date + relativedelta(days=15)
-            elif rule['deadline_rule'] == '45_days_after_season_end':
-                current_quarter = (today.month - 1) // 3 + 1
-                season_end_month = current_quarter * 3
-                season_end_day = 31 if season_end_month in [1, 3, 5, 7, 8, 10, 12] else 30
-                season_end_date = datetime.date(today.year, season_end_month, 1) + relativedelta(day=season_end_day)
-                due_date = season_end_date + relativedelta(days=45)
+            due_date = deadline_table.due_date(rule['task_id'], today)
 
             if due_date:
                 task = {
@@ -156,37 +211,139 @@ class LogicEngine:
 
         return tasks
 
-    def check_brand_similarity(self, client_brand_name: str, new_trademarks: list, similarity_threshold=80):
+    def get_deadline_horizon(self, enterprise_profile: dict, start: datetime.date = None, months: int = 24):
+        """
+        Returns every (rule, due_date) of the enterprise's Gantt rules due within the next
+        `months` months from `start`, in due-date order.
+        """
+        start = start or datetime.date.today()
+        compiled = self.compiled
+        deadline_table = compiled.deadline_table(start, months)
+        end = add_months(start, months)
+
+        horizon = []
+        for rule in compiled.gantt_rules_by_scale.get(enterprise_profile.get('scale_name'), []):
+            for due_date in deadline_table.due_dates(rule['task_id'], start, end):
+                horizon.append((rule, due_date))
+        horizon.sort(key=lambda item: item[1])
+        return horizon
+
+    def check_brand_similarity(self, client_brand_name: str, new_trademarks: list, similarity_threshold=80, client_brand_key: str = None):
         """
         Compares a client's brand name against a list of newly registered trademarks using thefuzz.
         Generates an alert if a similar name is found.
+
+        Names are compared on their normalized Persian token keys; pass `client_brand_key`
+        and a 'name_tokens' entry per trademark to reuse the keys stored in the database.
         """
         alerts = []
+        if client_brand_key is None:
+            client_brand_key = token_key(client_brand_name)
 
         for trademark in new_trademarks:
-            trademark_name = trademark.get('name', '')
+            trademark_key = trademark.get('name_tokens')
+            if trademark_key is None:
+                trademark_key = token_key(trademark.get('name', ''))
 
-            # Calculate similarity using token_set_ratio for robust matching
-            similarity = fuzz.token_set_ratio(client_brand_name, trademark_name)
+            # token_set_ratio on the precomputed keys for robust matching
+            similarity = key_similarity(client_brand_key, trademark_key)
 
             if similarity >= similarity_threshold:
-                alert = self.alert_structure.copy()
-                alert['alert_id'] = "WTC-001"  # Watchdog Trademark 001
-                alert['crisis_level'] = "critical"
-                alert['legal_reference'] = "قانون ثبت اختراعات، طرح‌های صنعتی و علائم تجاری"
-                alert['financial_impact_usd'] = 50000 # Example potential cost of legal action
-                alert['call_to_action_button'] = {
-                    "text": "بررسی و اقدام حقوقی",
-                    "type": "external_link",
-                    "target": trademark.get('source_url', '#')
-                }
-                alert['title'] = "هشدار شباهت نام تجاری"
-                alert['summary'] = f"یک علامت تجاری جدید با نام «{trademark.get('name')}» توسط «{trademark.get('owner_name')}» ثبت شده است که شباهت بالایی ({similarity}%) با نام شرکت شما «{client_brand_name}» دارد."
-                alert['source'] = "Dastyar 360 Brand Watchdog"
-                alerts.append(alert)
+                alerts.append(self._build_brand_alert(client_brand_name, trademark, similarity))
         
         return alerts
 
+    def check_brand_similarity_indexed(self, client_brand_name: str, trademark_index, similarity_threshold=80, client_brand_key: str = None):
+        """
+        Same alerts as check_brand_similarity, but only scores the candidates returned by a
+        TrademarkIndex instead of every registered trademark.
+        """
+        return [
+            self._build_brand_alert(client_brand_name, trademark, similarity)
+            for trademark, similarity in trademark_index.search(client_brand_name, similarity_threshold, client_brand_key)
+        ]
+
+    def batch_match_brands(self, enterprises: list, new_trademarks: list, similarity_threshold=80, max_workers=None, min_pool_work=50000):
+        """
+        Matches every client brand against a batch of newly crawled trademarks in one pass.
+
+        :param enterprises: List of (enterprise_id, brand_key) tuples, where brand_key is the
+            precomputed token key of the brand name (EnterpriseProfile.name_tokens).
+        :param new_trademarks: List of dicts with at least 'id' and 'name'.
+        :param max_workers: Process pool size (defaults to the number of CPUs).
+        :param min_pool_work: Below this many enterprise x trademark pairs the batch runs inline,
+            since starting the pool would cost more than the matching.
+        :return: List of (enterprise_id, trademark_id, similarity) hits.
+        """
+        if not enterprises or not new_trademarks:
+            return []
+
+        if len(enterprises) * len(new_trademarks) < min_pool_work or max_workers == 1:
+            _init_brand_match_worker(new_trademarks)
+            return _match_brand_chunk(enterprises, similarity_threshold)
+
+        max_workers = max_workers or os.cpu_count() or 1
+        chunk_size = max(1, -(-len(enterprises) // (max_workers * 4)))
+        chunks = [enterprises[i:i + chunk_size] for i in range(0, len(enterprises), chunk_size)]
+
+        hits = []
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_brand_match_worker, initargs=(new_trademarks,)) as pool:
+            for chunk_hits in pool.map(_match_brand_chunk, chunks, [similarity_threshold] * len(chunks)):
+                hits.extend(chunk_hits)
+        return hits
+
+    def _build_brand_alert(self, client_brand_name, trademark, similarity):
+        alert = self.alert_structure.copy()
+        alert['alert_id'] = "WTC-001"  # Watchdog Trademark 001
+        alert['crisis_level'] = "critical"
+        alert['legal_reference'] = "قانون ثبت اختراعات، طرح‌های صنعتی و علائم تجاری"
+        alert['financial_impact_usd'] = 50000 # Example potential cost of legal action
+        alert['call_to_action_button'] = {
+            "text": "بررسی و اقدام حقوقی",
+            "type": "external_link",
+            "target": trademark.get('source_url', '#')
+        }
+        alert['title'] = "هشدار شباهت نام تجاری"
+        alert['summary'] = f"یک علامت تجاری جدید با نام «{trademark.get('name')}» توسط «{trademark.get('owner_name')}» ثبت شده است که شباهت بالایی ({similarity}%) با نام شرکت شما «{client_brand_name}» دارد."
+        alert['source'] = "Dastyar 360 Brand Watchdog"
+        return alert
+
+
+# --- Batch Brand Matching Workers ---
+# Module-level so they can be pickled into the process pool. Each worker indexes the new
+# trademarks once and then matches its share of the enterprises against that index.
+
+_worker_trademark_index = None
+
+def _init_brand_match_worker(new_trademarks):
+    global _worker_trademark_index
+    _worker_trademark_index = TrademarkIndex()
+    for trademark in new_trademarks:
+        _worker_trademark_index.add(trademark['id'], trademark)
+
+def _match_brand_chunk(enterprises, similarity_threshold):
+    hits = []
+    for enterprise_id, brand_key in enterprises:
+        for trademark, similarity in _worker_trademark_index.search(None, similarity_threshold, brand_key):
+            hits.append((enterprise_id, trademark['id'], similarity))
+    return hits
+
+
+# --- Shared Engine ---
+# One engine per worker process; the taxonomy is parsed once and hot-reloaded when the file changes.
+
+_shared_engine = None
+_shared_engine_lock = threading.Lock()
+
+def get_shared_engine() -> LogicEngine:
+    """Returns the process-wide LogicEngine, creating it on first use."""
+    global _shared_engine
+    if _shared_engine is None:
+        with _shared_engine_lock:
+            if _shared_engine is None:
+                _shared_engine = LogicEngine()
+    return _shared_engine
+
 
 if __name__ == '__main__':
     print("--- Initializing Dastyar 360 Logic Engine ---")
@@ -1,37 +1,59 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, status
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, File, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import datetime
-import subprocess
-import json
-import os
 
 # Import our business logic and auth utilities
-from src.logic_engine import LogicEngine
-from src import auth, schemas
+from src.logic_engine import LogicEngine, get_shared_engine
+from src.brand_index import get_shared_trademark_index, sync_trademark_index
+from src import auth, schemas, crawl_scheduler, data_versions, export, jobs, ledger_import, ledger_queries, migrations, rollups, watchdog_ingest
+from src.pagination import PageParams, paginate_async
+from src.cache import shared_cache
+from src.crawl_runner import SPIDERS, CrawlError, crawl_process
 
 # Import our SQLAlchemy models and database session management
-from src.models import identity, finance, watchdog, gantt, database
-from src.models.database import SessionLocal, engine
+from src.models import identity, finance, watchdog, gantt, versions, database
+from src.models.database import SessionLocal, async_engine, engine, get_async_db
 from src.models.finance import TransactionType # Import the enum
 from pydantic import BaseModel, EmailStr
 
 # Create all tables in the database
 # This will include the new CrawlerRunLog table
 database.Base.metadata.create_all(bind=engine)
+# ...and bring tables created by older versions up to date (e.g. new indexes)
+migrations.upgrade(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    crawl_runs.start()
+    yield
+    crawl_runs.stop()
+    crawl_process.stop()
+    await async_engine.dispose()
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Dastyar 360 API",
     description="The backend API for the Dastyar 360 Business Assistant.",
     version="0.1.0"
 )
 
+# --- Shared Caches ---
+# Brand similarity hits and reconciliations are the most expensive results; share them across workers
+brand_hits = shared_cache.namespace('brand-hits', ttl=3600)
+reconciliations = shared_cache.namespace('reconciliations', ttl=600)
 
 
 # --- Dependencies ---
 
 def get_db():
+    """Sync session, for the few endpoints that run CPU-heavy work in the threadpool."""
     db = SessionLocal()
     try:
         yield db
@@ -39,6 +61,20 @@ def get_db():
         db.close()
 
 
+async def get_enterprise_or_404(db: AsyncSession, enterprise_id: int) -> identity.EnterpriseProfile:
+    db_enterprise = await db.get(identity.EnterpriseProfile, enterprise_id)
+    if not db_enterprise:
+        raise HTTPException(status_code=404, detail="Enterprise not found for the current user.")
+    return db_enterprise
+
+
+
+def get_logic_engine() -> LogicEngine:
+    """Returns the worker's shared LogicEngine, picking up taxonomy changes from disk."""
+    logic_engine = get_shared_engine()
+    logic_engine.reload_if_changed()
+    return logic_engine
+
 
 async def get_current_active_user(current_user: schemas.User = Depends(auth.get_current_user)) -> schemas.User:
     # In the future, we can add a check here to see if the user is active.
@@ -47,388 +83,547 @@ async def get_current_active_user(current_user: schemas.User = Depends(auth.get_
 # --- API Endpoints ---
 
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(identity.User).filter(identity.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await auth.get_user_by_email(db, email=form_data.username)
+    valid, new_hash = await auth.verify_and_update_password(form_data.password, user.hashed_password if user else None)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
+    if new_hash:
+        # Transparent upgrade to the current PASSWORD_HASH_ROUNDS
+        user.hashed_password = new_hash
+        await db.commit()
+    access_token_expires = datetime.timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=auth.token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/users/register", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = auth.get_user_by_email(db, email=user.email)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await auth.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return auth.create_user(db=db, user=user)
+    return await auth.create_user(db=db, user=user)
 
 @app.get("/users/me", response_model=schemas.User)
 async def read_users_me(current_user: schemas.User = Depends(get_current_active_user)):
     return current_user
 
 @app.post("/enterprises/", response_model=schemas.Enterprise)
-def create_enterprise(enterprise: schemas.EnterpriseCreate, db: Session = Depends(get_db)):
-    db_enterprise = db.query(identity.EnterpriseProfile).filter(identity.EnterpriseProfile.national_id == enterprise.national_id).first()
+async def create_enterprise(enterprise: schemas.EnterpriseCreate, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    db_enterprise = await db.scalar(select(identity.EnterpriseProfile).where(identity.EnterpriseProfile.national_id == enterprise.national_id))
     if db_enterprise:
         raise HTTPException(status_code=400, detail="Enterprise with this National ID already registered.")
     new_enterprise = identity.EnterpriseProfile(**enterprise.dict())
     db.add(new_enterprise)
-    db.commit()
-    db.refresh(new_enterprise)
+    await db.commit()
+    # Have the legal tasks ready before the first dashboard load
+    background_tasks.add_task(run_job_in_background, jobs.materialize_legal_tasks)
     return new_enterprise
 
 @app.get("/enterprises/my", response_model=schemas.Enterprise)
-def get_my_enterprise(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    db_enterprise = db.query(identity.EnterpriseProfile).filter(identity.EnterpriseProfile.id == current_user.enterprise_id).first()
-    if not db_enterprise:
-        raise HTTPException(status_code=404, detail="Enterprise not found for the current user.")
-    return db_enterprise
+async def get_my_enterprise(current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+    return await get_enterprise_or_404(db, current_user.enterprise_id)
 
 @app.put("/enterprises/my", response_model=schemas.Enterprise)
-def update_my_enterprise(enterprise_update: schemas.EnterpriseCreate, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    db_enterprise = db.query(identity.EnterpriseProfile).filter(identity.EnterpriseProfile.id == current_user.enterprise_id).first()
-    if not db_enterprise:
-        raise HTTPException(status_code=404, detail="Enterprise not found for the current user.")
+async def update_my_enterprise(enterprise_update: schemas.EnterpriseCreate, background_tasks: BackgroundTasks, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+    db_enterprise = await get_enterprise_or_404(db, current_user.enterprise_id)
     
     update_data = enterprise_update.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_enterprise, key, value)
+    await db.run_sync(data_versions.bump_enterprise, db_enterprise.id)
     
-    db.add(db_enterprise)
-    db.commit()
-    db.refresh(db_enterprise)
+    await db.commit()
+    if db_enterprise.tasks_materialized_scale != db_enterprise.scale_name:
+        background_tasks.add_task(run_job_in_background, jobs.materialize_legal_tasks)
     return db_enterprise
 
 @app.post("/enterprises/my/transactions/", response_model=schemas.BankTransaction)
-def create_bank_transaction(transaction: schemas.BankTransactionCreate, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def create_bank_transaction(transaction: schemas.BankTransactionCreate, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     new_transaction = finance.BankTransaction(**transaction.dict(), enterprise_id=current_user.enterprise_id)
     db.add(new_transaction)
-    db.commit()
-    db.refresh(new_transaction)
+    await db.flush()
+    await db.run_sync(rollups.record_transaction, new_transaction)
+    await db.run_sync(data_versions.bump_enterprise, current_user.enterprise_id)
+    await db.commit()
     return new_transaction
 
 @app.get("/enterprises/my/transactions/", response_model=List[schemas.BankTransaction])
-def get_bank_transactions(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    transactions = db.query(finance.BankTransaction).filter(finance.BankTransaction.enterprise_id == current_user.enterprise_id).order_by(finance.BankTransaction.transaction_date.desc()).all()
+async def get_bank_transactions(response: Response, page: PageParams = Depends(), current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    Returns a page of the enterprise's transactions, newest first.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
+    """
+    query = select(finance.BankTransaction).where(finance.BankTransaction.enterprise_id == current_user.enterprise_id)
+    transactions, _ = await paginate_async(db, query, [finance.BankTransaction.transaction_date, finance.BankTransaction.id], page, response)
     return transactions
 
+def _check_export_format(format: str):
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected one of {tuple(export.FORMATS)}")
+
+@app.get("/enterprises/my/transactions/export")
+async def export_bank_transactions(format: str = 'ndjson', current_user: schemas.User = Depends(get_current_active_user)):
+    """Streams all of the enterprise's transactions as NDJSON or CSV."""
+    _check_export_format(format)
+    return export.export_response(
+        select(finance.BankTransaction).where(finance.BankTransaction.enterprise_id == current_user.enterprise_id).order_by(finance.BankTransaction.id),
+        schemas.BankTransaction, format, "transactions"
+    )
+
 @app.post("/enterprises/my/invoices/", response_model=schemas.TaxInvoice)
-def create_tax_invoice(invoice: schemas.TaxInvoiceCreate, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def create_tax_invoice(invoice: schemas.TaxInvoiceCreate, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     new_invoice = finance.TaxInvoice(**invoice.dict(), enterprise_id=current_user.enterprise_id)
     db.add(new_invoice)
-    db.commit()
-    db.refresh(new_invoice)
+    await db.flush()
+    await db.run_sync(rollups.record_invoice, new_invoice)
+    await db.run_sync(data_versions.bump_enterprise, current_user.enterprise_id)
+    await db.commit()
     return new_invoice
 
+# Parsing and validating thousands of rows is CPU work, so imports run in the threadpool on a sync session
+def _import_upload(kind, file: UploadFile, format: Optional[str], enterprise_id: int, db: Session):
+    fmt = format or ledger_import.detect_format(file.filename, file.content_type)
+    if fmt not in ledger_import.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{fmt}', expected one of {ledger_import.FORMATS}")
+    try:
+        return ledger_import.import_ledger(db, enterprise_id, kind, file.file, fmt)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="The uploaded file is not UTF-8 encoded.")
+
+@app.post("/enterprises/my/transactions/import", response_model=schemas.ImportReport)
+def import_bank_transactions(file: UploadFile = File(...), format: Optional[str] = None, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """
+    Bulk-imports transactions from a CSV (header row with the BankTransactionCreate fields)
+    or NDJSON file. Rows with an existing reference_id are updated. Returns a per-row error report.
+    """
+    return _import_upload(ledger_import.TRANSACTIONS, file, format, current_user.enterprise_id, db)
+
+@app.post("/enterprises/my/invoices/import", response_model=schemas.ImportReport)
+def import_tax_invoices(file: UploadFile = File(...), format: Optional[str] = None, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """
+    Bulk-imports tax invoices from a CSV or NDJSON file. Rows with an existing tax_id are
+    updated. Returns a per-row error report.
+    """
+    return _import_upload(ledger_import.INVOICES, file, format, current_user.enterprise_id, db)
+
 @app.delete("/enterprises/my/transactions/{transaction_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_transaction_for_user(transaction_id: int, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def delete_transaction_for_user(transaction_id: int, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     enterprise_id = current_user.enterprise_id
-    db_transaction = db.query(finance.BankTransaction).filter(
-        finance.BankTransaction.id == transaction_id, 
+    db_transaction = await db.scalar(select(finance.BankTransaction).where(
+        finance.BankTransaction.id == transaction_id,
         finance.BankTransaction.enterprise_id == enterprise_id
-    ).first()
+    ))
     
     if not db_transaction:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found or access denied.")
         
-    db.delete(db_transaction)
-    db.commit()
+    await db.run_sync(rollups.record_transaction, db_transaction, -1)
+    await db.delete(db_transaction)
+    await db.run_sync(data_versions.bump_enterprise, enterprise_id)
+    await db.commit()
     return
 
 @app.delete("/enterprises/my/invoices/{invoice_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_invoice_for_user(invoice_id: int, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def delete_invoice_for_user(invoice_id: int, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     enterprise_id = current_user.enterprise_id
-    db_invoice = db.query(finance.TaxInvoice).filter(
-        finance.TaxInvoice.id == invoice_id, 
+    db_invoice = await db.scalar(select(finance.TaxInvoice).where(
+        finance.TaxInvoice.id == invoice_id,
         finance.TaxInvoice.enterprise_id == enterprise_id
-    ).first()
+    ))
     
     if not db_invoice:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invoice not found or access denied.")
         
-    db.delete(db_invoice)
-    db.commit()
+    await db.run_sync(rollups.record_invoice, db_invoice, -1)
+    await db.delete(db_invoice)
+    await db.run_sync(data_versions.bump_enterprise, enterprise_id)
+    await db.commit()
     return
 
 @app.put("/enterprises/my/transactions/{transaction_id}", response_model=schemas.BankTransaction)
-def update_transaction_for_user(transaction_id: int, transaction_update: schemas.BankTransactionCreate, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def update_transaction_for_user(transaction_id: int, transaction_update: schemas.BankTransactionCreate, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     enterprise_id = current_user.enterprise_id
-    db_transaction = db.query(finance.BankTransaction).filter(
-        finance.BankTransaction.id == transaction_id, 
+    db_transaction = await db.scalar(select(finance.BankTransaction).where(
+        finance.BankTransaction.id == transaction_id,
         finance.BankTransaction.enterprise_id == enterprise_id
-    ).first()
+    ))
     
     if not db_transaction:
         raise HTTPException(status_code=404, detail="Transaction not found or access denied.")
 
+    # Move the row's contribution from its old month/type to its new one
+    await db.run_sync(rollups.record_transaction, db_transaction, -1)
     for key, value in transaction_update.dict().items():
         setattr(db_transaction, key, value)
+    await db.run_sync(rollups.record_transaction, db_transaction)
+    await db.run_sync(data_versions.bump_enterprise, current_user.enterprise_id)
         
-    db.commit()
-    db.refresh(db_transaction)
+    await db.commit()
     return db_transaction
 
 @app.put("/enterprises/my/invoices/{invoice_id}", response_model=schemas.TaxInvoice)
-def update_invoice_for_user(invoice_id: int, invoice_update: schemas.TaxInvoiceCreate, current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def update_invoice_for_user(invoice_id: int, invoice_update: schemas.TaxInvoiceCreate, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     enterprise_id = current_user.enterprise_id
-    db_invoice = db.query(finance.TaxInvoice).filter(
-        finance.TaxInvoice.id == invoice_id, 
+    db_invoice = await db.scalar(select(finance.TaxInvoice).where(
+        finance.TaxInvoice.id == invoice_id,
         finance.TaxInvoice.enterprise_id == enterprise_id
-    ).first()
+    ))
     
     if not db_invoice:
         raise HTTPException(status_code=404, detail="Invoice not found or access denied.")
 
+    await db.run_sync(rollups.record_invoice, db_invoice, -1)
     for key, value in invoice_update.dict().items():
         setattr(db_invoice, key, value)
+    await db.run_sync(rollups.record_invoice, db_invoice)
+    await db.run_sync(data_versions.bump_enterprise, current_user.enterprise_id)
         
-    db.commit()
-    db.refresh(db_invoice)
+    await db.commit()
     return db_invoice
 
 @app.get("/enterprises/my/invoices/", response_model=List[schemas.TaxInvoice])
-def get_tax_invoices(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    invoices = db.query(finance.TaxInvoice).filter(finance.TaxInvoice.enterprise_id == current_user.enterprise_id).order_by(finance.TaxInvoice.invoice_date.desc()).all()
+async def get_tax_invoices(response: Response, page: PageParams = Depends(), current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    Returns a page of the enterprise's tax invoices, newest first.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
+    """
+    query = select(finance.TaxInvoice).where(finance.TaxInvoice.enterprise_id == current_user.enterprise_id)
+    invoices, _ = await paginate_async(db, query, [finance.TaxInvoice.issue_date, finance.TaxInvoice.id], page, response)
     return invoices
 
+@app.get("/enterprises/my/invoices/export")
+async def export_tax_invoices(format: str = 'ndjson', current_user: schemas.User = Depends(get_current_active_user)):
+    """Streams all of the enterprise's tax invoices as NDJSON or CSV."""
+    _check_export_format(format)
+    return export.export_response(
+        select(finance.TaxInvoice).where(finance.TaxInvoice.enterprise_id == current_user.enterprise_id).order_by(finance.TaxInvoice.id),
+        schemas.TaxInvoice, format, "invoices"
+    )
+
 # Example of a protected endpoint
 @app.get("/enterprises/my/financial-alerts/", response_model=List[schemas.Alert])
-def get_financial_alerts(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_financial_alerts(request: Request, response: Response, period: Optional[str] = None, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db), logic_engine: LogicEngine = Depends(get_logic_engine)):
+    """
+    Compares deposit and invoice totals, overall or per Jalali 'month'/'season' when `period` is given.
+    Honors If-None-Match; the ETag changes with the enterprise's data and the taxonomy.
+    """
     enterprise_id = current_user.enterprise_id
-    db_enterprise = db.query(identity.EnterpriseProfile).filter(identity.EnterpriseProfile.id == enterprise_id).first()
-    if not db_enterprise:
-        raise HTTPException(status_code=404, detail="Enterprise not found for the current user.")
+    await get_enterprise_or_404(db, enterprise_id)
+    if period not in ledger_queries.PERIODS:
+        raise HTTPException(status_code=400, detail="period must be 'month' or 'season'.")
+    etag = await data_versions.current_etag(db, "financial-alerts", [data_versions.enterprise_scope(enterprise_id)], logic_engine.taxonomy_version, period)
+
+    async def compute():
+        # Read the maintained rollups instead of aggregating the ledger
+        totals = await db.run_sync(ledger_queries.get_rollup_totals, enterprise_id, period)
+        try:
+            return logic_engine.reconcile_totals(totals)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Internal error in logic engine: {e}")
+
+    return await data_versions.respond(request, response, etag, compute)
+
+@app.get("/enterprises/my/financial-summary/", response_model=List[schemas.FinancialSummary])
+async def get_financial_summary(request: Request, response: Response, period: Optional[str] = None, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    Dashboard totals for the ledger, overall or per Jalali 'month'/'season', read from the rollups.
+    Honors If-None-Match.
+    """
+    if period not in ledger_queries.PERIODS:
+        raise HTTPException(status_code=400, detail="period must be 'month' or 'season'.")
+    enterprise_id = current_user.enterprise_id
+    etag = await data_versions.current_etag(db, "financial-summary", [data_versions.enterprise_scope(enterprise_id)], period)
 
-    transactions = db.query(finance.BankTransaction).filter(finance.BankTransaction.enterprise_id == enterprise_id).all()
-    invoices = db.query(finance.TaxInvoice).filter(finance.TaxInvoice.enterprise_id == enterprise_id).all()
+    async def compute():
+        return await db.run_sync(ledger_queries.get_rollup_summary, enterprise_id, period)
 
-    try:
-        logic_engine = LogicEngine()
-        # Pass the raw SQLAlchemy objects to the logic engine
-        alerts = logic_engine.reconcile_transactions(transactions, invoices)
-        return alerts
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal error in logic engine: {e}")
+    return await data_versions.respond(request, response, etag, compute)
+
+@app.get("/enterprises/my/reconciliation/", response_model=schemas.ReconciliationResult)
+async def get_reconciliation(request: Request, response: Response, amount_tolerance: int = 0, date_window_days: int = 30, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db), logic_engine: LogicEngine = Depends(get_logic_engine)):
+    """
+    Matches each deposit to a tax invoice and lists the deposits and invoices left unmatched.
+    Honors If-None-Match.
+    """
+    enterprise_id = current_user.enterprise_id
+    etag = await data_versions.current_etag(db, "reconciliation", [data_versions.enterprise_scope(enterprise_id)], amount_tolerance, date_window_days)
+    return await data_versions.respond(request, response, etag, lambda: _reconcile(db, enterprise_id, amount_tolerance, date_window_days, logic_engine), reconciliations)
+
+async def _reconcile(db: AsyncSession, enterprise_id: int, amount_tolerance: int, date_window_days: int, logic_engine: LogicEngine):
+    transactions = (await db.scalars(select(finance.BankTransaction).where(
+        finance.BankTransaction.enterprise_id == enterprise_id,
+        finance.BankTransaction.type == TransactionType.DEPOSIT
+    ))).all()
+    invoices = (await db.scalars(select(finance.TaxInvoice).where(finance.TaxInvoice.enterprise_id == enterprise_id))).all()
+
+    # The matching sweep is CPU-bound; keep it off the event loop
+    result = await run_in_threadpool(logic_engine.match_transactions, transactions, invoices, amount_tolerance, date_window_days)
+    return {
+        "matched": [
+            {
+                "transaction_id": tx.id,
+                "invoice_id": inv.id,
+                "amount_difference": tx.amount - inv.amount,
+                "days_apart": abs((tx.transaction_date - inv.issue_date).days),
+            }
+            for tx, inv in result["matched"]
+        ],
+        "unmatched_transaction_ids": [tx.id for tx in result["unmatched_transactions"]],
+        "unmatched_invoice_ids": [inv.id for inv in result["unmatched_invoices"]],
+        "unmatched_deposits_total": sum(tx.amount for tx in result["unmatched_transactions"]),
+    }
 
 @app.get("/enterprises/my/gantt-chart/", response_model=List[schemas.LegalTask])
-def get_gantt_chart_tasks(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_gantt_chart_tasks(request: Request, response: Response, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     """
-    Generates and returns a list of legal tasks for the Gantt chart based on the user's enterprise profile.
+    Returns the enterprise's legal tasks for the Gantt chart: everything still pending plus
+    upcoming tasks, in due-date order. Tasks are materialized ahead of time by
+    jobs.materialize_legal_tasks, on changes and on a schedule. Honors If-None-Match.
     """
     enterprise_id = current_user.enterprise_id
-    db_enterprise = db.query(identity.EnterpriseProfile).filter(identity.EnterpriseProfile.id == enterprise_id).first()
-    if not db_enterprise:
-        raise HTTPException(status_code=404, detail="Enterprise not found for the current user.")
+    db_enterprise = await get_enterprise_or_404(db, enterprise_id)
 
-    # Check if tasks already exist for this enterprise
-    existing_tasks = db.query(gantt.LegalTask).filter(gantt.LegalTask.enterprise_id == enterprise_id).all()
-    if existing_tasks:
-        return existing_tasks
+    # Which tasks are upcoming depends on the date, too
+    today = datetime.date.today()
 
-    # If not, generate them
-    try:
-        logic_engine = LogicEngine()
-        enterprise_profile_dict = {
-            "scale": db_enterprise.scale,
-            "activity_type": db_enterprise.activity_type
-        }
-        tasks_to_create = logic_engine.generate_legal_gantt_chart(enterprise_profile_dict)
-
-        new_tasks = []
-        for task_data in tasks_to_create:
-            new_task = gantt.LegalTask(
-                enterprise_id=enterprise_id,
-                name=task_data["name"],
-                start_date=datetime.datetime.strptime(task_data["start"], "%Y-%m-%d").date(),
-                end_date=datetime.datetime.strptime(task_data["end"], "%Y-%m-%d").date(),
-                progress=task_data["progress"],
-                dependencies=task_data.get("dependencies", "")
-            )
-            new_tasks.append(new_task)
-        
-        db.add_all(new_tasks)
-        db.commit()
-        
-        # Re-query to get the objects with IDs
-        for task in new_tasks:
-            db.refresh(task)
-            
-        return new_tasks
-    except Exception as e:
-        # Rollback in case of error
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Internal error in logic engine: {e}")
+    # Only a new tenant the background job hasn't reached yet is materialized here; scale and
+    # rule changes and rolling the horizon forward are left to the scheduled 'legal-tasks' job
+    if db_enterprise.scale_name and db_enterprise.tasks_materialized_on is None:
+        await db.run_sync(jobs.materialize_legal_tasks, today=today, enterprise_ids=[enterprise_id])
+    etag = await data_versions.current_etag(db, "gantt-chart", [data_versions.enterprise_scope(enterprise_id)], today)
+
+    async def compute():
+        tasks = await db.scalars(select(gantt.LegalTask).where(
+            gantt.LegalTask.enterprise_id == enterprise_id,
+            or_(gantt.LegalTask.due_date >= today, gantt.LegalTask.status == gantt.TaskStatus.pending)
+        ).order_by(gantt.LegalTask.due_date, gantt.LegalTask.id))
+        return [schemas.LegalTask.model_validate(task, from_attributes=True) for task in tasks]
+
+    return await data_versions.respond(request, response, etag, compute)
+
+
+@app.get("/taxonomy/version")
+def get_taxonomy_version(logic_engine: LogicEngine = Depends(get_logic_engine)):
+    """
+    Returns the version (content checksum) of the taxonomy currently served by this worker.
+    """
+    snapshot = logic_engine.store.snapshot
+    return {"version": snapshot.version, "loaded_at": snapshot.loaded_at}
 
 
 # ... (rest of the endpoints remain the same for now)
 
 
-def run_and_process_crawler(crawler_name: str, output_file: str, model, db_session: Session):
+def run_and_process_crawler(crawler_name: str, db_session: Session, requested_at: datetime.datetime = None):
     """
-    A background task function to run a Scrapy crawler, process its output, and log the status.
+    A background task function to run a crawler in the crawl process, store its items, and log the status.
+    Does nothing if the crawler is running in another worker, or a run started since `requested_at` (UTC).
     """
     # Log the start of the crawler run
-    log_entry = db_session.query(watchdog.CrawlerRunLog).filter_by(crawler_name=crawler_name).first()
-    if not log_entry:
-        log_entry = watchdog.CrawlerRunLog(crawler_name=crawler_name)
-        db_session.add(log_entry)
-    
-    log_entry.last_run_start = datetime.datetime.utcnow()
-    log_entry.status = 'running'
-    log_entry.details = None
-    log_entry.items_added = 0
-    db_session.commit()
+    if not crawl_scheduler.claim_run(db_session, crawler_name, requested_at or datetime.datetime.utcnow()):
+        db_session.close()
+        return
+    log_entry = db_session.get(watchdog.CrawlerRunLog, crawler_name)
+
+    def progress(report):
+        # Each batch is committed, so show what is stored so far
+        log_entry.items_added = report['inserted']
+        db_session.commit()
 
     try:
-        # Define paths
-        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-        crawler_project_path = os.path.join(project_root, 'crawlers', 'dastyar_crawlers')
-        output_path = os.path.join(crawler_project_path, output_file)
-
-        # Ensure the output file from previous runs is deleted
-        if os.path.exists(output_path):
-            os.remove(output_path)
-
-        # Run the Scrapy crawler
-        subprocess.run(
-            ['scrapy', 'crawl', crawler_name, '-o', output_path],
-            cwd=crawler_project_path,
-            check=True,
-            capture_output=True,
-            text=True
-        )
+        # Pages unchanged since the last run are not fetched again
+        crawl = crawl_process.crawl(crawler_name, page_validators=watchdog_ingest.load_pages(db_session, crawler_name))
+        # Items are stored batch by batch as the spider scrapes them
+        report = watchdog_ingest.ingest_items(db_session, watchdog_ingest.KINDS[crawler_name], crawl, on_batch=progress)
+        # Only now that their items are stored may the next run skip these pages
+        watchdog_ingest.save_pages(db_session, crawler_name, crawl.pages)
 
-        # Process the output file
-        if not os.path.exists(output_path):
-            raise FileNotFoundError("Crawler did not produce an output file.")
-
-        with open(output_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        items_added = 0
-        for item_data in data:
-            # Simple check to avoid duplicates based on source_url
-            exists = db_session.query(model).filter_by(source_url=item_data.get('source_url')).first()
-            if not exists:
-                new_item = model(**item_data)
-                db_session.add(new_item)
-                items_added += 1
-        
         # Update log with success status
         log_entry.status = 'success'
-        log_entry.items_added = items_added
-        log_entry.details = f"Successfully added {items_added} new items."
+        log_entry.items_added = report['inserted']
+        log_entry.details = (
+            f"Added {report['inserted']} new and updated {report['updated']} items, {report['unchanged']} were unchanged "
+            f"and {report['skipped']} skipped; "
+            f"{crawl.stats['not_modified'] + crawl.stats['unchanged']} pages were unchanged."
+        )
 
-    except subprocess.CalledProcessError as e:
+    # Batches committed before a failure are kept (and counted in items_added)
+    except CrawlError as e:
         log_entry.status = 'failed'
-        log_entry.details = f"Crawler process failed: {e.stderr[:500]}" # Truncate error
-    except FileNotFoundError as e:
+        log_entry.details = f"Crawl failed: {str(e)[:500]}"
+    except Exception as e:
         log_entry.status = 'failed'
-        log_entry.details = f"File error: {e}"
+        log_entry.details = f"An unexpected error occurred: {str(e)[:500]}"
+    finally:
+        log_entry.last_run_finish = datetime.datetime.utcnow()
+        db_session.commit()
+        db_session.close()
+
+
+def run_job_in_background(job):
+    """Runs a batch job from src.jobs with its own database session."""
+    db_session = SessionLocal()
+    try:
+        job(db_session)
+    finally:
+        db_session.close()
+
+
+# Batch jobs the crawl scheduler runs too, by name in CRAWL_SCHEDULES
+SCHEDULED_JOBS = {
+    # Picks up new tenants, scale and taxonomy changes, and rolls task horizons forward
+    'legal-tasks': jobs.materialize_legal_tasks,
+}
+
+
+def run_scheduled_job(job_name: str, requested_at: datetime.datetime):
+    """
+    A scheduled run of a batch job, with its own database session and run log. Claimed like
+    a crawl, so only one worker runs it.
+    """
+    db_session = SessionLocal()
+    if not crawl_scheduler.claim_run(db_session, job_name, requested_at):
+        db_session.close()
+        return
+    log_entry = db_session.get(watchdog.CrawlerRunLog, job_name)
+    try:
+        result = SCHEDULED_JOBS[job_name](db_session)
+        log_entry.status = 'success'
+        log_entry.details = f"Finished: {result}"
     except Exception as e:
+        db_session.rollback()
         log_entry.status = 'failed'
         log_entry.details = f"An unexpected error occurred: {str(e)[:500]}"
-        db_session.rollback() # Rollback item additions if commit fails
     finally:
         log_entry.last_run_finish = datetime.datetime.utcnow()
         db_session.commit()
-        
-        # Clean up the output file
-        if 'output_path' in locals() and os.path.exists(output_path):
-            os.remove(output_path)
-        
         db_session.close()
 
 
+def run_scheduled_crawler(crawler_name: str, requested_at: datetime.datetime):
+    """A crawl or batch job run of the scheduler, with its own database session."""
+    if crawler_name in SCHEDULED_JOBS:
+        run_scheduled_job(crawler_name, requested_at)
+        return
+    run_and_process_crawler(crawler_name, SessionLocal(), requested_at)
+    if crawler_name == 'brand':
+        # After the crawl, so the matching job sees the freshly crawled trademarks
+        run_job_in_background(jobs.run_brand_matching)
+
+
+# At most one run per crawler, and CRAWL_MAX_CONCURRENT runs in all; started in the lifespan
+crawl_runs = crawl_scheduler.CrawlScheduler.from_env(run_scheduled_crawler)
+
+CRAWL_TRIGGER_MESSAGES = {
+    'queued': "{} crawler has been queued. Processing will happen in the background.",
+    'coalesced': "{} crawler is already queued; this request joins that run.",
+}
+
+
 @app.post("/watchdog/run-gazette-crawler/", status_code=202)
-def trigger_gazette_crawler(background_tasks: BackgroundTasks):
+def trigger_gazette_crawler():
     """
-    Triggers the Official Gazette crawler as a background task.
+    Queues a run of the Official Gazette crawler, unless one is already queued.
     """
-    db_session = SessionLocal() # Create a new session for the background task
-    background_tasks.add_task(
-        run_and_process_crawler, 
-        'gazette', 
-        'gazette_output.json', 
-        watchdog.GazetteAnnouncement, 
-        db_session
-    )
-    return {"message": "Official Gazette crawler has been triggered. Processing will happen in the background."}
+    state = crawl_runs.trigger('gazette')
+    return {"message": CRAWL_TRIGGER_MESSAGES[state].format("Official Gazette"), "state": state}
 
 
 @app.post("/watchdog/run-brand-crawler/", status_code=202)
-def trigger_brand_crawler(background_tasks: BackgroundTasks):
+def trigger_brand_crawler():
     """
-    Triggers the Trademark crawler as a background task.
+    Queues a run of the Trademark crawler, unless one is already queued. Brand matching runs after it.
     """
-    db_session = SessionLocal() # Create a new session for the background task
-    background_tasks.add_task(
-        run_and_process_crawler, 
-        'brand', 
-        'brand_output.json', 
-        watchdog.TrademarkRegistration, 
-        db_session
-    )
-    return {"message": "Trademark crawler has been triggered. Processing will happen in the background."}
+    state = crawl_runs.trigger('brand')
+    return {"message": CRAWL_TRIGGER_MESSAGES[state].format("Trademark"), "state": state}
+
+
+@app.post("/watchdog/run-brand-matching/", status_code=202)
+def trigger_brand_matching(background_tasks: BackgroundTasks):
+    """
+    Matches all client brands against the trademarks added since the last run, as a background task.
+    """
+    background_tasks.add_task(run_job_in_background, jobs.run_brand_matching)
+    return {"message": "Brand matching has been triggered. Processing will happen in the background."}
 
 
 @app.get("/enterprises/my/brand-alerts/", response_model=List[schemas.Alert])
-def get_brand_alerts(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_brand_alerts(request: Request, response: Response, current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db), logic_engine: LogicEngine = Depends(get_logic_engine)):
     """
     Analyzes registered trademarks for similarities to the current user's enterprise brand and returns alerts.
+    Honors If-None-Match; the ETag changes with the enterprise, the trademarks and the taxonomy.
     """
-    enterprise_id = current_user.enterprise_id
-    db_enterprise = db.query(identity.EnterpriseProfile).filter(identity.EnterpriseProfile.id == enterprise_id).first()
-    if not db_enterprise:
-        raise HTTPException(status_code=404, detail="Enterprise not found for the current user.")
+    db_enterprise = await get_enterprise_or_404(db, current_user.enterprise_id)
+    etag = await data_versions.current_etag(
+        db, "brand-alerts", [data_versions.enterprise_scope(db_enterprise.id), data_versions.WATCHDOG], logic_engine.taxonomy_version
+    )
 
     client_brand_name = db_enterprise.name
 
-    new_trademarks = db.query(watchdog.TrademarkRegistration).all()
+    async def compute():
+        try:
+            # Pick up trademarks added by crawls since the last request, then match against the index
+            trademark_index = get_shared_trademark_index()
+            await db.run_sync(lambda session: sync_trademark_index(trademark_index, session))
+            return await run_in_threadpool(logic_engine.check_brand_similarity_indexed, client_brand_name, trademark_index, client_brand_key=db_enterprise.name_tokens)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Internal error in logic engine: {e}")
 
-    trademarks_dict = [
-        {
-            "name": tm.name,
-            "owner_name": tm.owner_name,
-            "source_url": tm.source_url
-        }
-        for tm in new_trademarks
-    ]
-
-    try:
-        logic_engine = LogicEngine()
-        alerts = logic_engine.check_brand_similarity(client_brand_name, trademarks_dict)
-        return alerts
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal error in logic engine: {e}")
+    return await data_versions.respond(request, response, etag, compute, brand_hits)
 
 
 @app.get("/watchdog/gazette-announcements/", response_model=List[schemas.GazetteAnnouncement])
-def get_gazette_announcements(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_gazette_announcements(response: Response, page: PageParams = Depends(), current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     """
-    Returns a list of all scraped gazette announcements.
+    Returns a page of the scraped gazette announcements, newest first.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
     """
-    announcements = db.query(watchdog.GazetteAnnouncement).order_by(watchdog.GazetteAnnouncement.id.desc()).all()
+    announcements, _ = await paginate_async(db, select(watchdog.GazetteAnnouncement), [watchdog.GazetteAnnouncement.id], page, response)
     return announcements
 
 @app.get("/watchdog/trademark-registrations/", response_model=List[schemas.TrademarkRegistration])
-def get_trademark_registrations(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_trademark_registrations(response: Response, page: PageParams = Depends(), current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     """
-    Returns a list of all scraped trademark registrations.
+    Returns a page of the scraped trademark registrations, newest first.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
     """
-    trademarks = db.query(watchdog.TrademarkRegistration).order_by(watchdog.TrademarkRegistration.id.desc()).all()
+    trademarks, _ = await paginate_async(db, select(watchdog.TrademarkRegistration), [watchdog.TrademarkRegistration.id], page, response)
     return trademarks
 
-@app.get("/watchdog/status/", response_model=List[schemas.CrawlerRunLog])
-def get_crawler_status(current_user: schemas.User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+@app.get("/watchdog/gazette-announcements/export")
+async def export_gazette_announcements(format: str = 'ndjson', current_user: schemas.User = Depends(get_current_active_user)):
+    """Streams all scraped gazette announcements as NDJSON or CSV."""
+    _check_export_format(format)
+    return export.export_response(
+        select(watchdog.GazetteAnnouncement).order_by(watchdog.GazetteAnnouncement.id),
+        schemas.GazetteAnnouncement, format, "gazette_announcements"
+    )
+
+@app.get("/watchdog/trademark-registrations/export")
+async def export_trademark_registrations(format: str = 'ndjson', current_user: schemas.User = Depends(get_current_active_user)):
+    """Streams all scraped trademark registrations as NDJSON or CSV."""
+    _check_export_format(format)
+    return export.export_response(
+        select(watchdog.TrademarkRegistration).order_by(watchdog.TrademarkRegistration.id),
+        schemas.TrademarkRegistration, format, "trademark_registrations"
+    )
+
+@app.get("/watchdog/status/", response_model=List[schemas.CrawlerStatus])
+async def get_crawler_status(current_user: schemas.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     """
-    Returns the status of all crawlers.
+    Returns the status of all crawlers: their last run, and their place in this worker's run queue.
     """
-    logs = db.query(watchdog.CrawlerRunLog).all()
-    return logs
+    logs = {log.crawler_name: log for log in await db.scalars(select(watchdog.CrawlerRunLog))}
+    statuses = []
+    for crawler_name in sorted(set(logs) | set(SPIDERS) | set(SCHEDULED_JOBS)):
+        status_entry = schemas.CrawlerRunLog.model_validate(logs[crawler_name], from_attributes=True).model_dump() if crawler_name in logs else {"crawler_name": crawler_name}
+        if crawler_name in SPIDERS or crawler_name in SCHEDULED_JOBS:
+            status_entry.update(crawl_runs.status(crawler_name))
+        statuses.append(status_entry)
+    return statuses
@@ -0,0 +1,114 @@
+"""
+Versioned schema migrations.
+
+`Base.metadata.create_all()` only creates missing tables, so an index or column added to
+an existing table needs a migration here. Applied versions are recorded in the
+schema_migrations table and `upgrade` runs the rest in order, each in its own
+transaction. Migrations must be idempotent (checkfirst / IF EXISTS), because on a fresh
+database create_all() has already built what they add.
+"""
+import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+from sqlalchemy.orm import Session
+
+from src import rollups
+from src.models import finance, identity, watchdog
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', String, primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def _create_indexes(connection, *indexes):
+    for index in indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _tenant_date_indexes(connection):
+    """Composite (enterprise_id, date, id) indexes for the ledgers, date indexes for the watchdog feeds."""
+    _create_indexes(
+        connection,
+        *finance.BankTransaction.__table__.indexes,
+        *finance.TaxInvoice.__table__.indexes,
+        *watchdog.GazetteAnnouncement.__table__.indexes,
+        *watchdog.TrademarkRegistration.__table__.indexes,
+    )
+    # Covered by the leading column of the composite indexes
+    connection.execute(text("DROP INDEX IF EXISTS ix_bank_transactions_enterprise_id"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_tax_invoices_enterprise_id"))
+
+
+def _add_columns(connection, *columns):
+    for column in columns:
+        existing = {c['name'] for c in inspect(connection).get_columns(column.table.name)}
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def _content_hashes(connection):
+    """content_hash of the crawled items; existing rows get theirs on their next crawl."""
+    _add_columns(
+        connection,
+        watchdog.GazetteAnnouncement.__table__.c.content_hash,
+        watchdog.TrademarkRegistration.__table__.c.content_hash,
+    )
+
+
+def _task_materialization_dates(connection):
+    """tasks_materialized_on of the enterprises; existing ones roll their tasks forward on the next run."""
+    _add_columns(connection, identity.EnterpriseProfile.__table__.c.tasks_materialized_on)
+
+
+def _task_taxonomy_versions(connection):
+    """tasks_materialized_taxonomy of the enterprises; existing ones are regenerated on the next run."""
+    _add_columns(connection, identity.EnterpriseProfile.__table__.c.tasks_materialized_taxonomy)
+
+
+def _change_versions(connection):
+    """changed_version of the trademarks and the version watermark of the run logs."""
+    trademarks = watchdog.TrademarkRegistration.__table__
+    _add_columns(connection, trademarks.c.changed_version, watchdog.CrawlerRunLog.__table__.c.last_version)
+    _create_indexes(connection, *trademarks.indexes)
+
+
+def _jalali_rollup_periods(connection):
+    """Re-keys the rollups from Gregorian to Jalali months by rebuilding them."""
+    # The session joins the migration's transaction; its commit doesn't end it
+    with Session(bind=connection) as db:
+        rollups.rebuild_rollups(db)
+
+
+MIGRATIONS = [
+    ('0001_tenant_date_indexes', _tenant_date_indexes),
+    ('0002_content_hashes', _content_hashes),
+    ('0003_task_materialization_dates', _task_materialization_dates),
+    ('0004_change_versions', _change_versions),
+    ('0005_jalali_rollup_periods', _jalali_rollup_periods),
+    ('0006_task_taxonomy_versions', _task_taxonomy_versions),
+]
+
+
+def applied_versions(engine) -> set:
+    metadata.create_all(engine)
+    with engine.connect() as connection:
+        return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade(engine) -> list:
+    """Applies the pending migrations. Returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, migration in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(schema_migrations.insert().values(version=version, applied_at=datetime.datetime.utcnow()))
+        applied.append(version)
+    return applied
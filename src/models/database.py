@@ -1,14 +1,27 @@
 
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-# In a real application, this would come from a config file
-DATABASE_URL = "sqlite:///:memory:" # Using in-memory for tests
+from src.models.engine_factory import MEMORY_URL, DatabaseConfig, build_async_engine, build_engine
 
-engine = create_engine(DATABASE_URL)
+# Configured through DATABASE_URL and the other DATABASE_* variables, see engine_factory
+config = DatabaseConfig.from_env(default_url=MEMORY_URL) # In-memory unless configured, e.g. for tests
+
+engine = build_engine(config)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The API runs on the async engine; batch jobs and scripts use the sync one above
+async_engine = build_async_engine(config)
+
+# expire_on_commit=False: attributes can't be lazy-loaded after a commit in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # This is the single, shared Base for all models in the project
 Base = declarative_base()
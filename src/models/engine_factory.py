@@ -0,0 +1,147 @@
+"""
+Database engine construction from configuration, shared by the `src` and `app` backends.
+
+Settings come from environment variables (or are passed explicitly):
+
+    DATABASE_URL                     e.g. postgresql://user:password@db:5432/business_360
+    DATABASE_POOL_SIZE               persistent connections per engine (default 5)
+    DATABASE_MAX_OVERFLOW            extra connections under load (default 10)
+    DATABASE_POOL_TIMEOUT            seconds to wait for a free connection (default 30)
+    DATABASE_POOL_PRE_PING           check connections before use (default true)
+    DATABASE_POOL_RECYCLE            seconds before a connection is replaced (default 1800)
+    DATABASE_STATEMENT_TIMEOUT_MS    Postgres statement_timeout, 0 = none (default 0)
+    DATABASE_SQLITE_WAL              WAL journal for file databases (default true)
+    DATABASE_SQLITE_BUSY_TIMEOUT_MS  wait on a locked SQLite database (default 5000)
+    DATABASE_ECHO                    log SQL (default false)
+
+Pool settings apply to Postgres. SQLite runs in single-node mode: file databases get WAL,
+synchronous=NORMAL and a busy timeout; in-memory databases use a single shared connection
+so every thread sees the same data. For the sync and async engines to see the same
+in-memory database, it needs a shared-cache URI (MEMORY_URL) rather than ':memory:'.
+"""
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# Async driver used by the API for each sync dialect
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+_TRUE = ('1', 'true', 'yes', 'on')
+
+# A named in-memory SQLite database, shared by every engine of the process
+MEMORY_URL = 'sqlite:///file:dastyar?mode=memory&cache=shared&uri=true'
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    return value.strip().lower() in _TRUE if value not in (None, '') else default
+
+
+class DatabaseConfig:
+    """Engine settings; see the module docstring for the matching environment variables."""
+
+    def __init__(self, url: str, pool_size: int = 5, max_overflow: int = 10, pool_timeout: int = 30,
+                 pool_pre_ping: bool = True, pool_recycle: int = 1800, statement_timeout_ms: int = 0,
+                 sqlite_wal: bool = True, sqlite_busy_timeout_ms: int = 5000, echo: bool = False):
+        self.url = url
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_pre_ping = pool_pre_ping
+        self.pool_recycle = pool_recycle
+        self.statement_timeout_ms = statement_timeout_ms
+        self.sqlite_wal = sqlite_wal
+        self.sqlite_busy_timeout_ms = sqlite_busy_timeout_ms
+        self.echo = echo
+
+    @classmethod
+    def from_env(cls, default_url: str):
+        """Reads the DATABASE_* environment variables; `default_url` is used when DATABASE_URL is unset."""
+        return cls(
+            url=os.environ.get('DATABASE_URL') or default_url,
+            pool_size=_env_int('DATABASE_POOL_SIZE', 5),
+            max_overflow=_env_int('DATABASE_MAX_OVERFLOW', 10),
+            pool_timeout=_env_int('DATABASE_POOL_TIMEOUT', 30),
+            pool_pre_ping=_env_bool('DATABASE_POOL_PRE_PING', True),
+            pool_recycle=_env_int('DATABASE_POOL_RECYCLE', 1800),
+            statement_timeout_ms=_env_int('DATABASE_STATEMENT_TIMEOUT_MS', 0),
+            sqlite_wal=_env_bool('DATABASE_SQLITE_WAL', True),
+            sqlite_busy_timeout_ms=_env_int('DATABASE_SQLITE_BUSY_TIMEOUT_MS', 5000),
+            echo=_env_bool('DATABASE_ECHO', False),
+        )
+
+    @property
+    def backend(self) -> str:
+        return make_url(self.url).get_backend_name()
+
+    @property
+    def is_memory_sqlite(self) -> bool:
+        url = make_url(self.url)
+        return self.backend == 'sqlite' and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory')
+
+
+def async_url(url: str):
+    """The same database URL with the dialect's async driver, e.g. sqlite:// -> sqlite+aiosqlite://."""
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}")
+
+
+def _engine_kwargs(config: DatabaseConfig, is_async: bool) -> dict:
+    kwargs = {'echo': config.echo}
+    if config.backend == 'sqlite':
+        # FastAPI runs sync endpoints and background tasks in a threadpool
+        kwargs['connect_args'] = {'check_same_thread': False}
+        if config.is_memory_sqlite:
+            kwargs['poolclass'] = StaticPool
+        return kwargs
+
+    kwargs.update(
+        pool_size=config.pool_size,
+        max_overflow=config.max_overflow,
+        pool_timeout=config.pool_timeout,
+        pool_pre_ping=config.pool_pre_ping,
+        pool_recycle=config.pool_recycle,
+    )
+    if config.backend == 'postgresql' and config.statement_timeout_ms:
+        if is_async:
+            kwargs['connect_args'] = {'server_settings': {'statement_timeout': str(config.statement_timeout_ms)}}
+        else:
+            kwargs['connect_args'] = {'options': f"-c statement_timeout={config.statement_timeout_ms}"}
+    return kwargs
+
+
+def _install_sqlite_pragmas(sync_engine, config: DatabaseConfig):
+    pragmas = [f"PRAGMA busy_timeout = {config.sqlite_busy_timeout_ms}"]
+    if config.sqlite_wal and not config.is_memory_sqlite:
+        pragmas += ["PRAGMA journal_mode = WAL", "PRAGMA synchronous = NORMAL"]
+
+    @event.listens_for(sync_engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def build_engine(config: DatabaseConfig):
+    """A sync Engine for `config`."""
+    engine = create_engine(config.url, **_engine_kwargs(config, is_async=False))
+    if config.backend == 'sqlite':
+        _install_sqlite_pragmas(engine, config)
+    return engine
+
+
+def build_async_engine(config: DatabaseConfig):
+    """An AsyncEngine for the same database, on the dialect's async driver."""
+    engine = create_async_engine(async_url(config.url), **_engine_kwargs(config, is_async=True))
+    if config.backend == 'sqlite':
+        _install_sqlite_pragmas(engine.sync_engine, config)
+    return engine
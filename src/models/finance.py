@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, BigInteger, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, BigInteger, Enum, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 import datetime
 import enum
@@ -15,9 +15,13 @@ class TransactionType(enum.Enum):
 class BankTransaction(Base):
     "Data model for a single bank transaction."
     __tablename__ = 'bank_transactions'
+    __table_args__ = (
+        # Tenant listing/keyset pages and per-month aggregates; also serves enterprise_id lookups
+        Index('ix_bank_transactions_enterprise_date', 'enterprise_id', 'transaction_date', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
-    enterprise_id = Column(Integer, ForeignKey('enterprise_profile.id'), nullable=False, index=True)
+    enterprise_id = Column(Integer, ForeignKey('enterprise_profile.id'), nullable=False)
     amount = Column(BigInteger, nullable=False) # Storing as integer (e.g., in Rials) to avoid floating point issues
     transaction_date = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     description = Column(String(512))
@@ -33,9 +37,12 @@ class BankTransaction(Base):
 class TaxInvoice(Base):
     "Data model for an invoice from the national tax system."
     __tablename__ = 'tax_invoices'
+    __table_args__ = (
+        Index('ix_tax_invoices_enterprise_date', 'enterprise_id', 'issue_date', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
-    enterprise_id = Column(Integer, ForeignKey('enterprise_profile.id'), nullable=False, index=True)
+    enterprise_id = Column(Integer, ForeignKey('enterprise_profile.id'), nullable=False)
     amount = Column(BigInteger, nullable=False)
     issue_date = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     tax_id = Column(String(22), unique=True, nullable=False, index=True) # Unique ID from tax authority
@@ -45,3 +52,24 @@ class TaxInvoice(Base):
 
     def __repr__(self):
         return f"<TaxInvoice(tax_id='{self.tax_id}', amount={self.amount})>"
+
+class FinancialRollup(Base):
+    """
+    Per-enterprise, per-month totals of the ledger, kept current by the transaction and
+    invoice endpoints (see src/rollups.py) so totals don't need a ledger scan.
+    """
+    __tablename__ = 'financial_rollups'
+    __table_args__ = (UniqueConstraint('enterprise_id', 'period', name='uq_financial_rollup_period'),)
+
+    id = Column(Integer, primary_key=True)
+    enterprise_id = Column(Integer, ForeignKey('enterprise_profile.id'), nullable=False, index=True)
+    period = Column(String(7), nullable=False) # Jalali month, 'YYYY-MM'
+    deposits_total = Column(BigInteger, nullable=False, default=0)
+    withdrawals_total = Column(BigInteger, nullable=False, default=0)
+    invoiced_total = Column(BigInteger, nullable=False, default=0)
+    deposit_count = Column(Integer, nullable=False, default=0)
+    withdrawal_count = Column(Integer, nullable=False, default=0)
+    invoice_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<FinancialRollup(enterprise_id={self.enterprise_id}, period='{self.period}')>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Enum, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 import enum
 
@@ -12,6 +12,11 @@ class TaskStatus(enum.Enum):
 class LegalTask(Base):
     """Data model for a legal/regulatory task assigned to an enterprise."""
     __tablename__ = 'legal_tasks'
+    __table_args__ = (
+        # One row per occurrence of a rule; lets the materialization job insert idempotently
+        UniqueConstraint('enterprise_id', 'task_id', 'due_date', name='uq_legal_task_occurrence'),
+        Index('ix_legal_tasks_enterprise_due_date', 'enterprise_id', 'due_date'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     enterprise_id = Column(Integer, ForeignKey('enterprise_profile.id'))
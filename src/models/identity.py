@@ -1,7 +1,8 @@
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Date, Integer, String, Text, ForeignKey
+from sqlalchemy.orm import relationship, validates
 from .database import Base # Import the shared Base
+from src.persian_text import normalize, token_key
 
 class EnterpriseProfile(Base):
     """Data model for the core identity of a business entity."""
@@ -9,9 +10,19 @@ class EnterpriseProfile(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
+    # Precomputed matching keys for `name`, kept in sync by the validator below
+    name_normalized = Column(String(255))
+    name_tokens = Column(String(255))
     national_id = Column(String(11), unique=True, nullable=False, index=True)
     economic_code = Column(String(14), unique=True, nullable=False)
     isic_code = Column(String(10), index=True) # International Standard Industrial Classification
+    scale_name = Column(String(20)) # Micro / Medium / Large / Mega, see scale_logic in the taxonomy
+    # Scale the legal tasks were last materialized for; differs from scale_name when they need regenerating
+    tasks_materialized_scale = Column(String(20))
+    # When they were last materialized; the horizon is rolled forward once this gets old
+    tasks_materialized_on = Column(Date)
+    # Taxonomy version they were materialized against; a rule edit makes them regenerate
+    tasks_materialized_taxonomy = Column(String(64))
     
     # This field will store sensitive tokens, encrypted at the application level.
     # Using Text to accommodate potentially long encrypted strings.
@@ -19,6 +30,12 @@ class EnterpriseProfile(Base):
 
     users = relationship("User", back_populates="enterprise")
 
+    @validates('name')
+    def _set_name_keys(self, key, value):
+        self.name_normalized = normalize(value)
+        self.name_tokens = token_key(value)
+        return value
+
     def __repr__(self):
         return f"<EnterpriseProfile(name='{self.name}', national_id='{self.national_id}')>"
 
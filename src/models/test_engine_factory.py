@@ -0,0 +1,65 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import text
+
+from src.models.engine_factory import DatabaseConfig, _engine_kwargs, async_url, build_async_engine, build_engine
+
+
+class TestEngineFactory(unittest.TestCase):
+
+    def test_config_from_env(self):
+        env = {'DATABASE_URL': 'postgresql://user:password@db:5432/business_360', 'DATABASE_POOL_SIZE': '20',
+               'DATABASE_POOL_PRE_PING': 'false', 'DATABASE_STATEMENT_TIMEOUT_MS': '30000'}
+        with mock.patch.dict(os.environ, env):
+            config = DatabaseConfig.from_env(default_url='sqlite:///:memory:')
+        self.assertEqual((config.url, config.pool_size, config.max_overflow, config.pool_pre_ping), (env['DATABASE_URL'], 20, 10, False))
+
+        kwargs = _engine_kwargs(config, is_async=False)
+        self.assertEqual((kwargs['pool_size'], kwargs['pool_recycle']), (20, 1800))
+        self.assertEqual(kwargs['connect_args'], {'options': '-c statement_timeout=30000'})
+        self.assertEqual(_engine_kwargs(config, is_async=True)['connect_args'], {'server_settings': {'statement_timeout': '30000'}})
+        self.assertEqual(async_url(config.url).drivername, 'postgresql+asyncpg')
+
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(DatabaseConfig.from_env(default_url='sqlite:///./local.db').url, 'sqlite:///./local.db')
+
+    def test_sqlite_file_uses_wal_on_sync_and_async_engines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = DatabaseConfig(f"sqlite:///{os.path.join(directory, 'test.db')}", sqlite_busy_timeout_ms=1234)
+            engine = build_engine(config)
+            with engine.connect() as connection:
+                self.assertEqual(connection.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+                self.assertEqual(connection.execute(text('PRAGMA busy_timeout')).scalar(), 1234)
+            engine.dispose()
+
+            async def async_pragmas():
+                async_engine = build_async_engine(config)
+                async with async_engine.connect() as connection:
+                    result = (await connection.execute(text('PRAGMA journal_mode'))).scalar(), (await connection.execute(text('PRAGMA synchronous'))).scalar()
+                await async_engine.dispose()
+                return result
+            self.assertEqual(asyncio.run(async_pragmas()), ('wal', 1))  # 1 = NORMAL
+
+    def test_in_memory_sqlite_is_shared_across_threads(self):
+        engine = build_engine(DatabaseConfig('sqlite:///:memory:'))
+        with engine.begin() as connection:
+            connection.execute(text('CREATE TABLE t (x INTEGER)'))
+            connection.execute(text('INSERT INTO t VALUES (1)'))
+
+        seen = []
+        def read():
+            with engine.connect() as connection:
+                seen.append(connection.execute(text('SELECT count(*) FROM t')).scalar())
+        worker = threading.Thread(target=read)
+        worker.start()
+        worker.join()
+        self.assertEqual(seen, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
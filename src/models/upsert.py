@@ -0,0 +1,23 @@
+"""
+INSERT ... ON CONFLICT statements for the dialects the app runs on (see engine_factory).
+
+Postgres and SQLite share the ON CONFLICT syntax, but SQLAlchemy only offers it on each
+dialect's own insert(), so the statement is built for the session's dialect.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def insert(db_session: Session, table):
+    """An INSERT into `table` supporting on_conflict_do_update / on_conflict_do_nothing."""
+    dialect = db_session.get_bind().dialect.name
+    if dialect not in _INSERTS:
+        raise NotImplementedError(f"No ON CONFLICT insert for dialect '{dialect}'")
+    return _INSERTS[dialect](table)
+
+
+def insert_ignoring_conflicts(db_session: Session, table):
+    """An INSERT that skips rows violating a unique constraint (ON CONFLICT DO NOTHING)."""
+    return insert(db_session, table).on_conflict_do_nothing()
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String
+
+from src.models.database import Base
+
+
+class DataVersion(Base):
+    """A counter bumped whenever the data in `scope` changes; see src.data_versions."""
+    __tablename__ = 'data_versions'
+
+    scope = Column(String(64), primary_key=True)  # 'enterprise:<id>' or 'watchdog'
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DataVersion(scope='{self.scope}', version={self.version})>"
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Text, Date, ForeignKey, DateTime, func
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, Date, ForeignKey, DateTime, UniqueConstraint, func
+from sqlalchemy.orm import relationship, validates
 
 from src.models.database import Base
+from src.persian_text import normalize, token_key
 
 class GazetteAnnouncement(Base):
     """Data model for an announcement scraped from the Official Gazette."""
@@ -9,10 +10,11 @@ class GazetteAnnouncement(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
-    date = Column(Date)
+    date = Column(Date, index=True)
     announcement_type = Column(String)
     content = Column(Text)
     source_url = Column(String, unique=True)
+    content_hash = Column(String(64))  # sha256 of the crawled item, see watchdog_ingest
 
     def __repr__(self):
         return f"<GazetteAnnouncement(title='{self.title}', date='{self.date}')>"
@@ -23,11 +25,24 @@ class TrademarkRegistration(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False, index=True)
+    # Precomputed matching keys for `name`, kept in sync by the validator below
+    name_normalized = Column(String)
+    name_tokens = Column(String)
     registration_number = Column(String, unique=True, nullable=False)
     owner_name = Column(String, index=True)
     status = Column(String)
-    date = Column(Date)
+    date = Column(Date, index=True)
     source_url = Column(String)
+    content_hash = Column(String(64))  # sha256 of the crawled item, see watchdog_ingest
+    # Watchdog data version (see data_versions) of the last write to the row, so the brand
+    # index and the matching job can pick up rows changed in place
+    changed_version = Column(Integer, index=True)
+
+    @validates('name')
+    def _set_name_keys(self, key, value):
+        self.name_normalized = normalize(value)
+        self.name_tokens = token_key(value)
+        return value
 
     def __repr__(self):
         return f"<TrademarkRegistration(name='{self.name}', owner='{self.owner_name}')>"
@@ -40,3 +55,31 @@ class CrawlerRunLog(Base):
     status = Column(String) # e.g., 'running', 'success', 'failed'
     items_added = Column(Integer, default=0)
     details = Column(String, nullable=True)
+    last_item_id = Column(Integer, nullable=True) # Watermark for batch jobs that consume new rows
+    last_version = Column(Integer, nullable=True) # Data version watermark for batch jobs that consume changed rows
+
+class CrawlPage(Base):
+    """The validators of a crawled page as last fetched, for conditional requests on the next run."""
+    __tablename__ = 'crawl_pages'
+    url = Column(String, primary_key=True)
+    crawler_name = Column(String, nullable=False, index=True)
+    etag = Column(String)
+    last_modified = Column(String)  # As sent by the server, for If-Modified-Since
+    content_hash = Column(String(64))  # sha256 of the body
+    fetched_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class BrandMatch(Base):
+    """A trademark found similar to an enterprise's brand by the batch matching job."""
+    __tablename__ = 'brand_matches'
+    __table_args__ = (UniqueConstraint('enterprise_id', 'trademark_id', name='uq_brand_match'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    enterprise_id = Column(Integer, ForeignKey('enterprise_profile.id'), nullable=False, index=True)
+    trademark_id = Column(Integer, ForeignKey('trademark_registrations.id'), nullable=False)
+    similarity = Column(Integer, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+    trademark = relationship("TrademarkRegistration")
+
+    def __repr__(self):
+        return f"<BrandMatch(enterprise_id={self.enterprise_id}, trademark_id={self.trademark_id}, similarity={self.similarity})>"
@@ -0,0 +1,101 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+Pages are selected with `WHERE (sort_key, id) < (last_sort_key, last_id)` on the same
+columns the query is ordered by, so every page costs one index range scan no matter how
+deep it is. The cursor handed to clients is an opaque, URL-safe encoding of the last
+row's key values.
+"""
+import base64
+import datetime
+import json
+from typing import Optional
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    """Query parameters shared by paginated endpoints: `?cursor=...&limit=...`."""
+
+    def __init__(self, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+        self.cursor = cursor
+        self.limit = limit
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return datetime.date.fromisoformat(value["d"])
+        raise ValueError("unknown cursor value")
+    return value
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = [_decode_value(value) for value in json.loads(raw)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    if len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    return values
+
+
+def _page_statement(query, key_columns: list, page: PageParams):
+    """Adds the keyset filter, descending order and limit (plus one row to detect a next page)."""
+    if page.cursor:
+        values = decode_cursor(page.cursor, len(key_columns))
+        query = query.filter(tuple_(*key_columns) < tuple_(*values))
+    return query.order_by(*[column.desc() for column in key_columns]).limit(page.limit + 1)
+
+
+def _finish_page(rows: list, key_columns: list, page: PageParams, response: Response = None):
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in key_columns])
+        if response is not None:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return rows, next_cursor
+
+
+def paginate(query, key_columns: list, page: PageParams, response: Response = None):
+    """
+    Returns one page of `query`, ordered by `key_columns` descending.
+
+    The last key column must be unique (normally the primary key) so the order is total.
+    When there are more rows, the cursor of the next page is set in the X-Next-Cursor
+    response header.
+
+    :return: (rows, next_cursor or None)
+    """
+    rows = _page_statement(query, key_columns, page).all()
+    return _finish_page(rows, key_columns, page, response)
+
+
+async def paginate_async(db: AsyncSession, statement, key_columns: list, page: PageParams, response: Response = None):
+    """paginate() for a select() of one entity on an AsyncSession."""
+    rows = (await db.scalars(_page_statement(statement, key_columns, page))).all()
+    return _finish_page(list(rows), key_columns, page, response)
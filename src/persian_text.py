@@ -0,0 +1,48 @@
+"""
+Persian text normalization for name matching.
+
+Names reach us typed on Arabic and Persian keyboards, with or without diacritics and
+ZWNJ, and with Persian, Arabic-Indic or Latin digits. `normalize` folds all of those to
+one spelling, and `token_key` turns a name into the sorted set of its tokens, which is
+what token_set_ratio compares. Both are computed once when a name is stored.
+"""
+import re
+
+from thefuzz import fuzz
+
+_CHAR_MAP = str.maketrans({
+    'ي': 'ی',  # Arabic yeh
+    'ى': 'ی',  # Alef maksura
+    'ك': 'ک',  # Arabic kaf
+    'ة': 'ه',  # Teh marbuta
+    'ۀ': 'ه',  # Heh with yeh above
+    '\u200c': ' ',  # ZWNJ: "کالا‌ها" and "کالا ها" are the same name
+    '\u200d': '',   # ZWJ
+    'ـ': '',   # Tatweel
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+})
+
+# Harakat, tanwin, shadda, sukun and superscript alef
+_DIACRITICS = re.compile('[\u064b-\u0652\u0670]')
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text: str) -> str:
+    """Returns the lower-cased, single-spaced canonical spelling of a name."""
+    if not text:
+        return ''
+    text = _DIACRITICS.sub('', text.translate(_CHAR_MAP))
+    return _NON_WORD.sub(' ', text).strip().lower()
+
+
+def token_key(text: str) -> str:
+    """Returns the sorted, de-duplicated tokens of the normalized name, joined by spaces."""
+    return ' '.join(sorted(set(normalize(text).split())))
+
+
+def similarity(key_a: str, key_b: str) -> int:
+    """token_set_ratio between two precomputed token keys, without re-processing them."""
+    if not key_a or not key_b:
+        return 0
+    return fuzz.token_set_ratio(key_a, key_b, full_process=False)
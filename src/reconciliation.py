@@ -0,0 +1,118 @@
+"""
+Line-item reconciliation: pairs individual bank deposits with tax invoices.
+
+Invoices are grouped by amount, and each group is sorted by date once. A deposit looks
+only at the amount groups within tolerance, and in each group it bisects to its own date:
+the closest unmatched invoice is the nearest free one on either side. Matched invoices
+are skipped with path-compressed "next/previous unmatched" pointers. The pass is
+O(n log n), however many payments share an amount, times the number of distinct
+amounts within the tolerance.
+"""
+import bisect
+import datetime
+
+
+class LedgerItem:
+    """A deposit or an invoice reduced to what the matcher needs."""
+    __slots__ = ('key', 'amount', 'date', 'source')
+
+    def __init__(self, key, amount: int, date, source=None):
+        self.key = key
+        self.amount = amount
+        self.date = date.date() if isinstance(date, datetime.datetime) else date
+        self.source = source
+
+
+def _find(pointers: list, i: int) -> int:
+    """Follows `pointers` from i to a position that points at itself, compressing the path."""
+    root = i
+    while pointers[root] != root:
+        root = pointers[root]
+    while pointers[i] != root:
+        pointers[i], i = root, pointers[i]
+    return root
+
+
+class _FreeSlots:
+    """The unmatched positions of a sorted list, found on either side of a position in near-constant time."""
+
+    def __init__(self, size: int):
+        self._next = list(range(size + 1))  # -> first free position >= i; size = none
+        self._prev = list(range(size + 1))  # -> 1 + last free position < i; 0 = none
+
+    def next(self, i: int) -> int:
+        return _find(self._next, i)
+
+    def prev(self, i: int) -> int:
+        """The last free position before i, or -1."""
+        return _find(self._prev, i) - 1
+
+    def take(self, i: int):
+        self._next[i] = i + 1
+        self._prev[i + 1] = i
+
+
+class _AmountGroup:
+    """The invoices of one amount, in date order."""
+
+    def __init__(self, invoices: list):
+        self.invoices = sorted(invoices, key=lambda item: item.date)
+        self.dates = [invoice.date for invoice in self.invoices]
+        self.free = _FreeSlots(len(self.invoices))
+
+    def closest(self, day, window):
+        """Position of the free invoice closest to `day` within `window` (the earlier one on a tie), or None."""
+        at = bisect.bisect_left(self.dates, day)
+        candidates = []
+        before = self.free.prev(at)
+        if before >= 0 and day - self.dates[before] <= window:
+            # The first free invoice of that date, as a scan in date order would pick
+            candidates.append(self.free.next(bisect.bisect_left(self.dates, self.dates[before])))
+        after = self.free.next(at)
+        if after < len(self.invoices) and self.dates[after] - day <= window:
+            candidates.append(after)
+        return min(candidates, key=lambda i: abs(day - self.dates[i]), default=None)
+
+
+def match_deposits_to_invoices(deposits: list, invoices: list, amount_tolerance: int = 0, date_window_days: int = 30):
+    """
+    Greedily pairs each deposit with an unmatched invoice whose amount is within
+    `amount_tolerance` rials and whose date is within `date_window_days` days of it.
+    Among the eligible invoices the one closest in date wins, then the one closest in amount.
+
+    :param deposits: List of LedgerItem.
+    :param invoices: List of LedgerItem.
+    :return: (matched pairs as (deposit, invoice) tuples, unmatched deposits, unmatched invoices)
+    """
+    deposits = sorted(deposits, key=lambda item: (item.amount, item.date))
+    by_amount = {}
+    for invoice in invoices:
+        by_amount.setdefault(invoice.amount, []).append(invoice)
+    amounts = sorted(by_amount)
+    groups = [_AmountGroup(by_amount[amount]) for amount in amounts]
+    window = datetime.timedelta(days=date_window_days)
+
+    matched, unmatched_deposits = [], []
+    for deposit in deposits:
+        lo = bisect.bisect_left(amounts, deposit.amount - amount_tolerance)
+        hi = bisect.bisect_right(amounts, deposit.amount + amount_tolerance, lo)
+
+        best, best_rank = None, None
+        for group in groups[lo:hi]:
+            i = group.closest(deposit.date, window)
+            if i is not None:
+                invoice = group.invoices[i]
+                rank = (abs(deposit.date - invoice.date), abs(deposit.amount - invoice.amount))
+                if best_rank is None or rank < best_rank:
+                    best, best_rank = (group, i), rank
+
+        if best is None:
+            unmatched_deposits.append(deposit)
+        else:
+            group, i = best
+            matched.append((deposit, group.invoices[i]))
+            group.free.take(i)
+
+    matched_invoices = {id(invoice) for _, invoice in matched}
+    unmatched_invoices = [invoice for group in groups for invoice in group.invoices if id(invoice) not in matched_invoices]
+    return matched, unmatched_deposits, unmatched_invoices
@@ -0,0 +1,172 @@
+"""
+Incrementally maintained per-enterprise, per-month ledger totals (FinancialRollup).
+Months are Jalali months, the calendar tax periods follow (see src/deadlines.py).
+
+Every write to bank_transactions or tax_invoices must call `record_transaction` or
+`record_invoice` in the same session before committing, with sign=+1 for the row as
+inserted and sign=-1 for the row as it was before an update or delete. `rebuild_rollups`
+recomputes everything from the raw tables and `check_rollups` reports any drift.
+"""
+from sqlalchemy import Date, func, select
+from sqlalchemy.orm import Session
+
+from src import data_versions, jalali
+from src.models import finance, identity, upsert
+from src.models.finance import FinancialRollup, TransactionType
+
+ROLLUP_FIELDS = ('deposits_total', 'withdrawals_total', 'invoiced_total', 'deposit_count', 'withdrawal_count', 'invoice_count')
+
+
+def period_of(date) -> str:
+    """The Jalali month of a date, 'YYYY-MM' (e.g. '1401-10')."""
+    year, month, _ = jalali.from_gregorian(date)
+    return f"{year:04d}-{month:02d}"
+
+
+def day_of(column):
+    """The calendar day of a DateTime column in SQL, read back as a date on both dialects."""
+    return func.date(column, type_=Date)
+
+
+def _apply(db: Session, enterprise_id: int, period: str, deltas: dict):
+    """Adds `deltas` to the rollup row, creating it if this is the period's first row."""
+    # One statement, so concurrent first writes to a period add up instead of colliding
+    table = FinancialRollup.__table__
+    stmt = upsert.insert(db, table).values(enterprise_id=enterprise_id, period=period, **{field: deltas.get(field, 0) for field in ROLLUP_FIELDS})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['enterprise_id', 'period'],
+        set_={field: table.c[field] + stmt.excluded[field] for field in deltas},
+    )
+    db.execute(stmt)
+
+
+def _transaction_deltas(kind, amount, sign):
+    if kind == TransactionType.WITHDRAWAL:
+        return {'withdrawals_total': sign * amount, 'withdrawal_count': sign}
+    return {'deposits_total': sign * amount, 'deposit_count': sign}
+
+
+def _invoice_deltas(amount, sign):
+    return {'invoiced_total': sign * amount, 'invoice_count': sign}
+
+
+def record_transaction(db: Session, transaction: finance.BankTransaction, sign: int = 1):
+    """Adds (sign=+1) or removes (sign=-1) one bank transaction from its month's rollup."""
+    deltas = _transaction_deltas(transaction.type, transaction.amount, sign)
+    _apply(db, transaction.enterprise_id, period_of(transaction.transaction_date), deltas)
+
+
+def record_invoice(db: Session, invoice: finance.TaxInvoice, sign: int = 1):
+    """Adds (sign=+1) or removes (sign=-1) one tax invoice from its month's rollup."""
+    deltas = _invoice_deltas(invoice.amount, sign)
+    _apply(db, invoice.enterprise_id, period_of(invoice.issue_date), deltas)
+
+
+def _apply_many(db: Session, keyed_deltas):
+    """Sums (enterprise_id, period, deltas) entries and applies one update per rollup row."""
+    merged = {}
+    for enterprise_id, period, deltas in keyed_deltas:
+        bucket = merged.setdefault((enterprise_id, period), {})
+        for field, delta in deltas.items():
+            bucket[field] = bucket.get(field, 0) + delta
+    for (enterprise_id, period), deltas in merged.items():
+        _apply(db, enterprise_id, period, deltas)
+
+
+def record_transactions(db: Session, rows, sign: int = 1):
+    """
+    record_transaction for many rows at once, e.g. a bulk import batch. `rows` are mappings
+    with enterprise_id, amount, transaction_date and type; each touched month is updated once.
+    """
+    _apply_many(db, (
+        (row['enterprise_id'], period_of(row['transaction_date']), _transaction_deltas(row['type'], row['amount'], sign))
+        for row in rows
+    ))
+
+
+def record_invoices(db: Session, rows, sign: int = 1):
+    """record_invoice for many rows (mappings with enterprise_id, amount and issue_date)."""
+    _apply_many(db, (
+        (row['enterprise_id'], period_of(row['issue_date']), _invoice_deltas(row['amount'], sign))
+        for row in rows
+    ))
+
+
+def _aggregate_ledgers(db: Session, enterprise_id: int = None):
+    """Recomputes the rollup values from the raw tables: {(enterprise_id, period): {field: value}}."""
+    result = {}
+
+    def bucket(ent_id, day):
+        # Jalali months don't start on Gregorian ones, so SQL groups by day and days fold into months here
+        key = (ent_id, period_of(day))
+        return result.setdefault(key, {field: 0 for field in ROLLUP_FIELDS})
+
+    tx = finance.BankTransaction
+    day = day_of(tx.transaction_date)
+    query = db.query(tx.enterprise_id, day, tx.type, func.sum(tx.amount), func.count(tx.id))
+    if enterprise_id is not None:
+        query = query.filter(tx.enterprise_id == enterprise_id)
+    for ent_id, d, kind, total, count in query.group_by(tx.enterprise_id, day, tx.type):
+        values = bucket(ent_id, d)
+        if kind == TransactionType.WITHDRAWAL:
+            values['withdrawals_total'] += int(total)
+            values['withdrawal_count'] += count
+        else:
+            values['deposits_total'] += int(total)
+            values['deposit_count'] += count
+
+    inv = finance.TaxInvoice
+    day = day_of(inv.issue_date)
+    query = db.query(inv.enterprise_id, day, func.sum(inv.amount), func.count(inv.id))
+    if enterprise_id is not None:
+        query = query.filter(inv.enterprise_id == enterprise_id)
+    for ent_id, d, total, count in query.group_by(inv.enterprise_id, day):
+        values = bucket(ent_id, d)
+        values['invoiced_total'] += int(total)
+        values['invoice_count'] += count
+
+    return result
+
+
+def rebuild_rollups(db: Session, enterprise_id: int = None) -> int:
+    """Recomputes the rollups (of one enterprise, or all) from scratch. Returns the row count."""
+    query = db.query(FinancialRollup)
+    if enterprise_id is not None:
+        query = query.filter(FinancialRollup.enterprise_id == enterprise_id)
+    query.delete(synchronize_session=False)
+
+    aggregates = _aggregate_ledgers(db, enterprise_id)
+    db.bulk_insert_mappings(FinancialRollup, [
+        {"enterprise_id": ent_id, "period": period, **values}
+        for (ent_id, period), values in aggregates.items()
+    ])
+    # Rollups that had drifted may now give different answers
+    if enterprise_id is not None:
+        data_versions.bump_enterprise(db, enterprise_id)
+    else:
+        data_versions.bump_enterprises(db, db.scalars(select(identity.EnterpriseProfile.id)))
+    db.commit()
+    return len(aggregates)
+
+
+def check_rollups(db: Session, enterprise_id: int = None) -> list:
+    """
+    Compares the rollups with the raw tables.
+    Returns a list of (enterprise_id, period, expected values, stored values) for every mismatch.
+    """
+    expected = _aggregate_ledgers(db, enterprise_id)
+    query = db.query(FinancialRollup)
+    if enterprise_id is not None:
+        query = query.filter(FinancialRollup.enterprise_id == enterprise_id)
+
+    empty = {field: 0 for field in ROLLUP_FIELDS}
+    stored = {
+        (row.enterprise_id, row.period): {field: getattr(row, field) for field in ROLLUP_FIELDS}
+        for row in query
+    }
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        # A rollup row that was decremented back to all zeros is equivalent to no row
+        if expected.get(key, empty) != stored.get(key, empty):
+            mismatches.append((key[0], key[1], expected.get(key, empty), stored.get(key, empty)))
+    return mismatches
@@ -1,6 +1,8 @@
 from pydantic import BaseModel, EmailStr
+from typing import List, Optional
 import datetime
 from src.models.finance import TransactionType
+from src.models.gantt import TaskStatus
 
 # --- User & Auth Schemas ---
 
@@ -63,48 +65,95 @@ class GanttTask(BaseModel):
     due_date: datetime.date
     status: str
 
+class LegalTask(BaseModel):
+    id: int
+    task_id: str
+    title: str
+    responsible_body: str
+    due_date: datetime.date
+    status: TaskStatus
+
+    class Config:
+        orm_mode = True
+
 # --- Finance Schemas ---
 
 class BankTransactionCreate(BaseModel):
-    enterprise_id: int
     amount: int
-    date: datetime.date
-    ref_id: str
-    description: str
-    type: TransactionType
+    transaction_date: datetime.datetime
+    description: Optional[str] = None
+    reference_id: Optional[str] = None
+    type: TransactionType = TransactionType.DEPOSIT
 
 class BankTransaction(BankTransactionCreate):
     id: int
+    enterprise_id: int
     class Config:
         orm_mode = True
 
 class TaxInvoiceCreate(BaseModel):
-    enterprise_id: int
     amount: int
+    issue_date: datetime.datetime
     tax_id: str
-    date: datetime.date
-    description: str
+    buyer_national_id: Optional[str] = None
 
 class TaxInvoice(TaxInvoiceCreate):
     id: int
+    enterprise_id: int
     class Config:
         orm_mode = True
 
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    received: int
+    inserted: int
+    updated: int
+    duplicates: int
+    errors: List[ImportRowError]
+
+class FinancialSummary(BaseModel):
+    period: Optional[str] = None
+    deposits_total: int
+    withdrawals_total: int
+    invoiced_total: int
+    deposit_count: int
+    withdrawal_count: int
+    invoice_count: int
+
+class ReconciliationMatch(BaseModel):
+    transaction_id: int
+    invoice_id: int
+    amount_difference: int
+    days_apart: int
+
+class ReconciliationResult(BaseModel):
+    matched: List[ReconciliationMatch]
+    unmatched_transaction_ids: List[int]
+    unmatched_invoice_ids: List[int]
+    unmatched_deposits_total: int
+
 class GazetteAnnouncement(BaseModel):
     id: int
     title: str
-    date: str
-    source_url: str
-    content_hash: str
+    date: Optional[datetime.date] = None
+    announcement_type: Optional[str] = None
+    source_url: Optional[str] = None
+    content_hash: Optional[str] = None
 
     class Config:
         orm_mode = True
 
-class class TrademarkRegistration(BaseModel):
+class TrademarkRegistration(BaseModel):
     id: int
     name: str
-    owner_name: str
-    source_url: str
+    registration_number: str
+    owner_name: Optional[str] = None
+    status: Optional[str] = None
+    date: Optional[datetime.date] = None
+    source_url: Optional[str] = None
 
     class Config:
         orm_mode = True
@@ -119,3 +168,15 @@ class CrawlerRunLog(BaseModel):
 
     class Config:
         orm_mode = True
+
+class CrawlerStatus(CrawlerRunLog):
+    """A crawler's last run, and its place in the run queue of the worker that answered."""
+    scheduler_state: Optional[str] = None # 'idle', 'queued', 'running' or 'running, queued'
+    queued_seconds: Optional[float] = None
+    last_wait_seconds: Optional[float] = None
+    next_scheduled_run: Optional[datetime.datetime] = None
+    # Across crawlers
+    queue_depth: Optional[int] = None
+    active_runs: Optional[int] = None
+    max_concurrent_runs: Optional[int] = None
+    mean_wait_seconds: Optional[float] = None
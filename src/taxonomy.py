@@ -0,0 +1,155 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+from src.deadlines import DEFAULT_CALENDAR, DEFAULT_HORIZON_MONTHS, DeadlineTable, compile_deadline_rule
+
+DEFAULT_TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content_taxonomy.json')
+
+
+class CompiledTaxonomy:
+    """
+    Indexed views over the raw taxonomy, built once per load so lookups don't scan lists.
+
+    - scale_rules: scale name -> scale_logic rule
+    - gantt_rules_by_scale: scale name -> gantt_chart_tasks rules that apply to it (taxonomy order)
+    - activity_tasks: cluster id or sub-activity id -> tasks from activity_tree
+    - deadline_rules: Gantt task id -> compiled Recurrence of its deadline_rule
+    """
+
+    def __init__(self, taxonomy: dict):
+        self.scale_rules = {}
+        for rule in taxonomy.get('scale_logic', []):
+            # First rule wins, matching the old linear `next(...)` lookup
+            self.scale_rules.setdefault(rule.get('name'), rule)
+
+        self.gantt_rules_by_scale = {}
+        for rule in taxonomy.get('gantt_chart_tasks', []):
+            for scale in dict.fromkeys(rule.get('applies_to_scale', [])):
+                self.gantt_rules_by_scale.setdefault(scale, []).append(rule)
+
+        self.activity_tasks = {}
+        for cluster_id, cluster in taxonomy.get('activity_tree', {}).items():
+            cluster_tasks = []
+            for sub_activity in cluster.get('sub_activities', []):
+                tasks = sub_activity.get('tasks', [])
+                self.activity_tasks[sub_activity.get('id')] = tasks
+                cluster_tasks.extend(tasks)
+            self.activity_tasks[cluster_id] = cluster_tasks
+
+        # A rule can override the taxonomy-wide calendar with its own "calendar" key
+        calendar = taxonomy.get('calendar', DEFAULT_CALENDAR)
+        self.deadline_rules = {
+            rule['task_id']: compile_deadline_rule(rule.get('deadline_rule'), rule.get('calendar', calendar))
+            for rule in taxonomy.get('gantt_chart_tasks', [])
+        }
+        self._deadline_table = None
+
+    def deadline_table(self, day: datetime.date, months: int = 0) -> DeadlineTable:
+        """
+        Returns the precomputed deadline table covering `day` and the `months` after it.
+        The cached table is reused until a request falls outside it; then a new horizon of
+        at least DEFAULT_HORIZON_MONTHS is laid out starting at `day`.
+        """
+        table = self._deadline_table
+        if table is None or not table.covers(day, months):
+            table = DeadlineTable(self.deadline_rules, day, max(months, DEFAULT_HORIZON_MONTHS))
+            self._deadline_table = table
+        return table
+
+
+class TaxonomySnapshot:
+    """An immutable, fully parsed and compiled version of the content taxonomy."""
+
+    def __init__(self, taxonomy: dict, version: str, mtime: float):
+        self.taxonomy = taxonomy
+        self.compiled = CompiledTaxonomy(taxonomy)
+        self.version = version
+        self.mtime = mtime
+        self.loaded_at = datetime.datetime.utcnow()
+
+
+class TaxonomyStore:
+    """
+    Holds the current taxonomy snapshot and swaps in a new one when the file on disk changes.
+
+    Readers take `store.snapshot` once and work against it, so a reload never changes the
+    data underneath an in-flight request. Only one thread re-parses the file at a time;
+    everyone else keeps using the previous snapshot until the new one is ready.
+    """
+
+    def __init__(self, path: str = DEFAULT_TAXONOMY_PATH, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._snapshot = self._load()
+        if self._snapshot is None:
+            raise ValueError("Failed to load or parse the content taxonomy.")
+
+    @property
+    def snapshot(self) -> TaxonomySnapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> str:
+        return self._snapshot.version
+
+    def _load(self, current: TaxonomySnapshot = None):
+        """Reads the taxonomy file and returns a new snapshot, or None if it cannot be parsed."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            print(f"Error: Taxonomy file not found at {self.path}")
+            return None
+
+        version = hashlib.sha256(raw).hexdigest()[:16]
+        if current is not None and current.version == version:
+            # Touched but not changed: keep the parsed data, remember the new mtime.
+            current.mtime = mtime
+            return current
+
+        try:
+            taxonomy = json.loads(raw.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            print(f"Error: Could not decode JSON from {self.path}")
+            return None
+        try:
+            return TaxonomySnapshot(taxonomy, version, mtime)
+        # Malformed structure, a rule without task_id, or a deadline rule that doesn't compile
+        except (AttributeError, TypeError, KeyError, ValueError) as e:
+            print(f"Error: Could not compile taxonomy from {self.path}: {e!r}")
+            return None
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """
+        Checks the file's mtime (at most once per `check_interval`) and reloads it if it changed.
+        Returns True if a new snapshot was swapped in.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        if not self._reload_lock.acquire(blocking=False):
+            return False  # Another thread is already reloading
+        try:
+            self._last_check = now
+            current = self._snapshot
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                return False
+            if not force and mtime == current.mtime:
+                return False
+
+            new_snapshot = self._load(current)
+            if new_snapshot is None or new_snapshot is current:
+                return False  # Keep serving the last good version
+            self._snapshot = new_snapshot
+            return True
+        finally:
+            self._reload_lock.release()
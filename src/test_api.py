@@ -0,0 +1,258 @@
+import datetime
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from passlib.context import CryptContext
+
+from src import auth, data_versions, main
+from src.cache import shared_cache
+from src.crawl_scheduler import CrawlScheduler
+from src.main import app, get_db
+from src.models.database import Base, SessionLocal, get_async_db
+from src.models.gantt import LegalTask
+from src.models.identity import EnterpriseProfile, User
+from src.models.watchdog import CrawlerRunLog
+from src.pagination import NEXT_CURSOR_HEADER
+
+
+class TestAsyncApi(unittest.TestCase):
+    """End-to-end requests through the async session dependencies, against a SQLite file."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine(f'sqlite:///{self.path}')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        with self.Session() as session:
+            enterprise = EnterpriseProfile(name='شرکت آزمون', national_id='10300000000', economic_code='413000000000', scale_name='Medium')
+            session.add(enterprise)
+            session.flush()
+            # Stored with fewer rounds than PASSWORD_HASH_ROUNDS, as if the setting was raised since
+            self.old_hash = CryptContext(schemes=['bcrypt'], bcrypt__rounds=4).hash('secret')
+            session.add(User(email='owner@example.com', hashed_password=self.old_hash, enterprise_id=enterprise.id))
+            session.commit()
+
+        # TestClient runs each request on its own event loop, so don't pool async connections
+        self.async_engine = create_async_engine(f'sqlite+aiosqlite:///{self.path}', poolclass=NullPool)
+        AsyncSession = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+
+        async def override_get_async_db():
+            async with AsyncSession() as db:
+                yield db
+
+        def override_get_db():
+            with self.Session() as db:
+                yield db
+
+        auth.principal_cache.clear()
+        shared_cache.clear_local()
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        app.dependency_overrides[get_db] = override_get_db
+        self.client = TestClient(app)
+        token = self.client.post('/token', data={'username': 'owner@example.com', 'password': 'secret'}).json()['access_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_rejects_bad_credentials(self):
+        response = self.client.post('/token', data={'username': 'owner@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get('/users/me', headers={'Authorization': 'Bearer nope'}).status_code, 401)
+
+    def test_login_upgrades_outdated_hashes(self):
+        with self.Session() as session:
+            stored = session.query(User).filter_by(email='owner@example.com').one().hashed_password
+        self.assertNotEqual(stored, self.old_hash)
+        self.assertTrue(stored.startswith(f'$2b${auth.PASSWORD_HASH_ROUNDS:02d}$'))
+        self.assertEqual(self.client.post('/token', data={'username': 'owner@example.com', 'password': 'secret'}).status_code, 200)
+
+    def test_login_is_turned_away_when_hashing_is_saturated(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(auth, '_hash_slots', slots):
+            response = self.client.post('/token', data={'username': 'owner@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.client.post('/token', data={'username': 'nobody@example.com', 'password': 'secret'}).status_code, 401)
+
+    def _count_user_queries(self, request):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(self.async_engine.sync_engine, 'before_cursor_execute', listener)
+        try:
+            request()
+        finally:
+            event.remove(self.async_engine.sync_engine, 'before_cursor_execute', listener)
+        return len([statement for statement in statements if 'FROM users' in statement])
+
+    def test_principal_is_cached_until_the_user_changes(self):
+        me = lambda: self.assertEqual(self.client.get('/users/me', headers=self.headers).status_code, 200)
+        self.assertEqual(self._count_user_queries(me), 1)
+        self.assertEqual(self._count_user_queries(me), 0)
+
+        with self.Session() as session:
+            user = session.query(User).filter_by(email='owner@example.com').one()
+            user.hashed_password = auth.get_password_hash('changed')
+            session.commit()
+        self.assertEqual(self._count_user_queries(me), 1)
+
+        # A deleted user is rejected once the cached principal is dropped
+        with self.Session() as session:
+            session.delete(session.query(User).filter_by(email='owner@example.com').one())
+            session.commit()
+        self.assertEqual(self.client.get('/users/me', headers=self.headers).status_code, 401)
+
+    def test_ledger_crud_pagination_and_rollups(self):
+        ids = []
+        for i, day in enumerate(['2023-01-10', '2023-01-20', '2023-02-05']):
+            response = self.client.post('/enterprises/my/transactions/', headers=self.headers, json={
+                'amount': 1000 * (i + 1), 'transaction_date': f'{day}T10:00:00', 'reference_id': f'TX{i}',
+            })
+            self.assertEqual(response.status_code, 200, response.text)
+            ids.append(response.json()['id'])
+
+        first = self.client.get('/enterprises/my/transactions/?limit=2', headers=self.headers)
+        self.assertEqual([tx['reference_id'] for tx in first.json()], ['TX2', 'TX1'])
+        cursor = first.headers[NEXT_CURSOR_HEADER]
+        second = self.client.get(f'/enterprises/my/transactions/?limit=2&cursor={cursor}', headers=self.headers)
+        self.assertEqual([tx['reference_id'] for tx in second.json()], ['TX0'])
+        self.assertNotIn(NEXT_CURSOR_HEADER, second.headers)
+
+        response = self.client.put(f'/enterprises/my/transactions/{ids[0]}', headers=self.headers, json={
+            'amount': 500, 'transaction_date': '2023-02-01T10:00:00', 'reference_id': 'TX0', 'type': 'withdrawal',
+        })
+        self.assertEqual(response.json()['type'], 'withdrawal')
+        self.assertEqual(self.client.delete(f'/enterprises/my/transactions/{ids[1]}', headers=self.headers).status_code, 204)
+        self.assertEqual(self.client.delete(f'/enterprises/my/transactions/{ids[1]}', headers=self.headers).status_code, 404)
+
+        summary = self.client.get('/enterprises/my/financial-summary/?period=month', headers=self.headers).json()
+        self.assertEqual([(row['period'], row['deposits_total'], row['withdrawals_total']) for row in summary], [
+            ('1401-10', 0, 0), ('1401-11', 3000, 500),
+        ])
+
+    def test_gantt_materializes_tasks_for_a_new_tenant(self):
+        tasks = self.client.get('/enterprises/my/gantt-chart/', headers=self.headers)
+        self.assertEqual(tasks.status_code, 200, tasks.text)
+        self.assertTrue(tasks.json())
+        due_dates = [task['due_date'] for task in tasks.json()]
+        self.assertEqual(due_dates, sorted(due_dates))
+
+    def test_scheduled_job_materializes_tasks_once(self):
+        requested_at = datetime.datetime.utcnow()
+        job = mock.Mock(wraps=main.SCHEDULED_JOBS['legal-tasks'])
+        with mock.patch.object(main, 'SessionLocal', self.Session), mock.patch.dict(main.SCHEDULED_JOBS, {'legal-tasks': job}):
+            main.run_scheduled_crawler('legal-tasks', requested_at)
+            # Another worker's scheduler, for the same scheduled moment
+            main.run_scheduled_crawler('legal-tasks', requested_at)
+        self.assertEqual(job.call_count, 1)
+        with self.Session() as session:
+            self.assertEqual(session.get(CrawlerRunLog, 'legal-tasks').status, 'success')
+            self.assertTrue(session.query(LegalTask).count())
+            self.assertIsNotNone(session.query(EnterpriseProfile).one().tasks_materialized_on)
+
+    def test_computed_endpoints_revalidate_with_etags(self):
+        first = self.client.get('/enterprises/my/financial-summary/', headers=self.headers)
+        etag = first.headers['ETag']
+        self.assertEqual(first.headers['Cache-Control'], data_versions.CACHE_CONTROL)
+
+        revalidate = {**self.headers, 'If-None-Match': etag}
+        not_modified = self.client.get('/enterprises/my/financial-summary/', headers=revalidate)
+        self.assertEqual((not_modified.status_code, not_modified.headers['ETag'], not_modified.content), (304, etag, b''))
+        # Parameters are part of the ETag
+        self.assertEqual(self.client.get('/enterprises/my/financial-summary/?period=month', headers=revalidate).status_code, 200)
+
+        self.client.post('/enterprises/my/transactions/', headers=self.headers, json={
+            'amount': 1000, 'transaction_date': '2023-01-10T10:00:00', 'reference_id': 'TX0',
+        })
+        changed = self.client.get('/enterprises/my/financial-summary/', headers=revalidate)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+        self.assertEqual(changed.json()[0]['deposits_total'], 1000)
+
+        # The profile is part of the brand alerts' version, and so are the trademarks
+        brand_etag = self.client.get('/enterprises/my/brand-alerts/', headers=self.headers).headers['ETag']
+        self.client.put('/enterprises/my', headers=self.headers, json={
+            'name': 'شرکت نو', 'national_id': '10300000000', 'registration_id': '1234', 'scale_name': 'Medium',
+            'ceo_name': 'مدیر', 'ceo_national_id': '0012345678', 'address': 'تهران',
+        }).raise_for_status()
+        renamed_etag = self.client.get('/enterprises/my/brand-alerts/', headers=self.headers).headers['ETag']
+        self.assertNotEqual(renamed_etag, brand_etag)
+        with self.Session() as session:
+            data_versions.bump_watchdog(session)
+            session.commit()
+        self.assertNotEqual(self.client.get('/enterprises/my/brand-alerts/', headers=self.headers).headers['ETag'], renamed_etag)
+
+    def test_unchanged_versions_serve_the_cached_result(self):
+        alerts = lambda: self.assertEqual(self.client.get('/enterprises/my/financial-alerts/', headers=self.headers).status_code, 200)
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(self.async_engine.sync_engine, 'before_cursor_execute', listener)
+        try:
+            alerts()
+            self.assertTrue([statement for statement in statements if 'FROM financial_rollups' in statement])
+            statements.clear()
+            alerts()
+        finally:
+            event.remove(self.async_engine.sync_engine, 'before_cursor_execute', listener)
+        self.assertFalse([statement for statement in statements if 'FROM financial_rollups' in statement])
+
+    def test_crawler_triggers_are_queued_once(self):
+        release = threading.Event()
+        scheduler = CrawlScheduler(lambda crawler_name, requested_at: release.wait(10), max_concurrent=1)
+        with mock.patch.object(main, 'crawl_runs', scheduler):
+            trigger = lambda: self.client.post('/watchdog/run-brand-crawler/', headers=self.headers).json()['state']
+            self.assertEqual([trigger(), trigger(), trigger()], ['queued', 'queued', 'coalesced'])
+            self.assertEqual(self.client.post('/watchdog/run-gazette-crawler/', headers=self.headers).json()['state'], 'queued')
+
+            statuses = {entry['crawler_name']: entry for entry in self.client.get('/watchdog/status/', headers=self.headers).json()}
+            release.set()
+        self.assertEqual(statuses['brand']['scheduler_state'], 'running, queued')
+        self.assertEqual(statuses['gazette']['scheduler_state'], 'queued')
+        self.assertEqual((statuses['gazette']['queue_depth'], statuses['gazette']['active_runs']), (2, 1))
+        self.assertIsNone(statuses['gazette']['last_run_start'])
+
+
+class TestDefaultDatabase(unittest.TestCase):
+    """The app's own engines, unconfigured: the sync and async sessions share one in-memory database."""
+
+    def setUp(self):
+        auth.principal_cache.clear()
+        shared_cache.clear_local()
+        with SessionLocal() as session:
+            enterprise = EnterpriseProfile(name='شرکت پیش‌فرض', national_id='10300000009', economic_code='413000000009')
+            session.add(enterprise)
+            session.flush()
+            session.add(User(email='default@example.com', hashed_password=auth.get_password_hash('secret'), enterprise_id=enterprise.id))
+            session.commit()
+            self.enterprise_id = enterprise.id
+        self.client = TestClient(app)
+        token = self.client.post('/token', data={'username': 'default@example.com', 'password': 'secret'}).json()['access_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        with SessionLocal() as session:
+            session.query(User).filter_by(email='default@example.com').delete()
+            session.commit()
+
+    def test_imports_are_read_back_through_the_async_endpoints(self):
+        upload = 'amount,transaction_date,reference_id\n1000,2023-01-10T10:00:00,DEFAULT-TX1\n'
+        report = self.client.post('/enterprises/my/transactions/import', headers=self.headers, files={'file': ('ledger.csv', upload, 'text/csv')})
+        self.assertEqual(report.json()['inserted'], 1, report.text)
+        listed = self.client.get('/enterprises/my/transactions/', headers=self.headers).json()
+        self.assertEqual([tx['reference_id'] for tx in listed], ['DEFAULT-TX1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import random
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from thefuzz import fuzz
+
+from src import watchdog_ingest
+from src.brand_index import TrademarkIndex, sync_trademark_index
+from src.models.database import Base
+from src.models.watchdog import TrademarkRegistration
+
+
+class TestTrademarkIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ['کالای اصلی من', 'کالای تقلبی', 'محصول بی ربط', 'پارس الکتریک', 'پارس خزر', 'پارس شکلات']
+        self.index = TrademarkIndex()
+        for i, name in enumerate(self.names, start=1):
+            self.index.add(i, {'name': name, 'owner_name': 'owner', 'source_url': f'http://example.com/{i}'})
+
+    def _full_scan(self, query, threshold):
+        return sorted(name for name in self.names if fuzz.token_set_ratio(query, name) >= threshold)
+
+    def test_search_matches_full_scan(self):
+        for query in ['کالای اصلی', 'پارس', 'پارس الکتریکی', 'شکلات', 'بی ربط']:
+            for threshold in (50, 80, 95):
+                found = sorted(tm['name'] for tm, _ in self.index.search(query, threshold))
+                self.assertEqual(found, self._full_scan(query, threshold), (query, threshold))
+
+    def test_candidates_prune_unrelated_marks(self):
+        candidates = self.index.candidates('پارس الکتریک', 80)
+        self.assertIn(4, candidates)
+        self.assertNotIn(3, candidates)
+
+    def test_random_names_match_full_scan(self):
+        rng = random.Random(7)
+        letters = 'کالایصلیمنپرست'
+        word = lambda: ''.join(rng.choice(letters) for _ in range(rng.randint(1, 6)))
+        self.names = [' '.join(word() for _ in range(rng.randint(1, 3))) for _ in range(300)]
+        self.index = TrademarkIndex()
+        for i, name in enumerate(self.names, start=1):
+            self.index.add(i, {'name': name})
+        for _ in range(30):
+            query = ' '.join(word() for _ in range(rng.randint(1, 3)))
+            found = sorted(tm['name'] for tm, _ in self.index.search(query, 80))
+            self.assertEqual(found, self._full_scan(query, 80), query)
+
+    def test_remove_and_replace(self):
+        self.index.remove(4)
+        self.assertNotIn('پارس الکتریک', [tm['name'] for tm, _ in self.index.search('پارس الکتریک')])
+        self.index.add(5, {'name': 'پارس الکتریک'})
+        self.assertEqual([tm['name'] for tm, _ in self.index.search('پارس خزر')], [])
+
+
+class TestSyncTrademarkIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_sync_only_reads_new_rows(self):
+        self.session.add(TrademarkRegistration(name='پارس خزر', registration_number='24100'))
+        self.session.commit()
+        index = TrademarkIndex()
+        self.assertEqual(sync_trademark_index(index, self.session), 1)
+        self.assertEqual(sync_trademark_index(index, self.session), 0)
+
+        self.session.add(TrademarkRegistration(name='پارس الکتریک', registration_number='18544'))
+        self.session.commit()
+        self.assertEqual(sync_trademark_index(index, self.session, batch_size=1), 1)
+        self.assertEqual(len(index), 2)
+
+    def test_sync_reindexes_renamed_trademarks(self):
+        crawl = [{'name': 'پارس خزر', 'registration_number': '24100'}, {'name': 'محصول بی ربط', 'registration_number': '55931'}]
+        watchdog_ingest.ingest_items(self.session, watchdog_ingest.TRADEMARKS, crawl)
+        index = TrademarkIndex()
+        sync_trademark_index(index, self.session)
+        self.assertEqual([trademark['name'] for trademark, _ in index.search('پارس خزر')], ['پارس خزر'])
+
+        crawl[0] = {**crawl[0], 'name': 'پارس الکتریک'}
+        watchdog_ingest.ingest_items(self.session, watchdog_ingest.TRADEMARKS, crawl)
+        self.assertEqual(sync_trademark_index(index, self.session), 1)
+        self.assertEqual(index.search('پارس خزر'), [])
+        self.assertEqual([trademark['name'] for trademark, _ in index.search('پارس الکتریک')], ['پارس الکتریک'])
+        self.assertEqual(sync_trademark_index(index, self.session), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from src.cache import SharedCache, TTLCache
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=10, ttl=60, clock=clock)
+        cache.set('a', 1)
+        clock.now = 59
+        self.assertEqual(cache.get('a'), 1)
+        clock.now = 60
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_pop_and_remove_where(self):
+        cache = TTLCache()
+        for key, value in (('a', 1), ('b', 2), ('c', 2)):
+            cache.set(key, value)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        self.assertEqual(cache.remove_where(lambda value: value == 2), 2)
+        self.assertEqual(len(cache), 0)
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def test_concurrent_misses_compute_once(self):
+        namespace = SharedCache().namespace('results', ttl=60)
+        calls = []
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'total': 1}
+
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(namespace.get_or_compute('k', compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), seen), (1, [{'total': 1}] * 5))
+
+    def test_concurrent_async_misses_compute_once(self):
+        namespace = SharedCache().namespace('results', ttl=60)
+        calls = []
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [1, 2]
+
+        async def run():
+            return await asyncio.gather(*[namespace.aget_or_compute('k', compute) for _ in range(5)])
+        self.assertEqual(asyncio.run(run()), [[1, 2]] * 5)
+        self.assertEqual(len(calls), 1)
+
+        async def failing():
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            asyncio.run(namespace.aget_or_compute('other', failing))
+        self.assertIsNone(namespace.get('other'))
+
+    def test_namespaces_have_their_own_ttl(self):
+        clock = FakeClock()
+        cache = SharedCache()
+        short, long = cache.namespace('short', ttl=10), cache.namespace('long', ttl=100)
+        for namespace in (short, long):
+            namespace.local._clock = clock
+            namespace.set('k', 1)
+        clock.now = 50
+        self.assertEqual((short.get('k'), long.get('k')), (None, 1))
+        self.assertIs(cache.namespace('short', ttl=999), short)
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+class TestSharedCacheWithRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+
+    def worker(self, **kwargs):
+        return SharedCache(fakeredis.FakeRedis(server=self.server), **kwargs)
+
+    def test_workers_share_results(self):
+        first, second = self.worker().namespace('hits', ttl=60), self.worker().namespace('hits', ttl=60)
+        self.assertEqual(first.get_or_compute('k', lambda: {'score': 91}), {'score': 91})
+        self.assertEqual(second.get_or_compute('k', lambda: self.fail('computed twice')), {'score': 91})
+        self.assertEqual(asyncio.run(second.aget_or_compute('k', self.fail)), {'score': 91})
+
+        stored = fakeredis.FakeRedis(server=self.server)
+        self.assertEqual(stored.get('dastyar:hits:k'), b'{"score":91}')
+        self.assertLessEqual(stored.pttl('dastyar:hits:k'), 60000)
+
+    def test_waits_for_the_worker_holding_the_lock(self):
+        first = self.worker(poll_interval=0.01).namespace('hits', ttl=60)
+        second = self.worker(poll_interval=0.01).namespace('hits', ttl=60)
+        self.assertTrue(first._remote_lock('k'))
+
+        def finish():
+            time.sleep(0.05)
+            first.set('k', 'from first')
+            first._remote_unlock('k')
+        threading.Thread(target=finish).start()
+        self.assertEqual(second.get_or_compute('k', lambda: 'from second'), 'from first')
+
+    def test_pickle_serializer(self):
+        namespace = self.worker().namespace('objects', ttl=60, serializer='pickle')
+        namespace.set('k', {1, 2})
+        namespace.local.clear()
+        self.assertEqual(namespace.get('k'), {1, 2})
+
+    def test_falls_back_to_the_local_tier_when_redis_fails(self):
+        clock = FakeClock()
+        self.server.connected = False
+        cache = self.worker(clock=clock, retry_after=30)
+        namespace = cache.namespace('hits', ttl=60)
+        self.assertEqual(namespace.get_or_compute('k', lambda: 1), 1)
+        self.assertEqual(namespace.get('k'), 1)
+        self.assertEqual(cache._down_until, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import datetime
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.crawl_runner import CrawlError, CrawlProcess
+
+try:
+    import scrapy
+except ImportError:
+    scrapy = None
+
+
+def run_crawl(process, crawler_name, **spider_kwargs):
+    """Returns (items, crawl) of a finished crawl."""
+    crawl = process.crawl(crawler_name, **spider_kwargs)
+    return list(crawl), crawl
+
+
+@unittest.skipIf(scrapy is None, 'scrapy is not installed')
+class TestCrawlProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.process = CrawlProcess({'LOG_LEVEL': 'WARNING'}, idle_timeout=60)
+
+    def tearDown(self):
+        self.process.stop()
+
+    def test_items_stream_back_from_the_crawl_process(self):
+        items, crawl = run_crawl(self.process, 'brand')
+        self.assertEqual(crawl.stats['items'], 3)
+        self.assertEqual([item['registration_number'] for item in items], ['18544', '24100', '55931'])
+        self.assertEqual(set(items[0]), {'name', 'registration_number', 'status', 'owner_name', 'source_url'})
+
+        # The same process serves the next crawl
+        started = self.process._process
+        items, _ = run_crawl(self.process, 'gazette')
+        self.assertIs(self.process._process, started)
+        self.assertEqual(items[0]['date'], datetime.date(2022, 1, 18))
+
+    def test_unchanged_pages_are_not_parsed_again(self):
+        _, first = run_crawl(self.process, 'gazette')
+        [(url, validators)] = first.pages.items()
+        self.assertEqual(len(validators['content_hash']), 64)
+
+        items, second = run_crawl(self.process, 'gazette', page_validators=first.pages)
+        self.assertEqual((items, second.pages, second.stats['unchanged']), ([], {}, 1))
+
+        changed = {url: {**validators, 'content_hash': '0' * 64}}
+        items, third = run_crawl(self.process, 'gazette', page_validators=changed)
+        self.assertEqual((len(items), third.pages), (1, first.pages))
+
+    def test_items_wait_in_the_crawl_process_until_taken(self):
+        process = CrawlProcess({'LOG_LEVEL': 'WARNING'}, idle_timeout=60, max_buffered_items=1)
+        self.addCleanup(process.stop)
+        crawl = process.crawl('brand')
+        items = iter(crawl)
+        self.assertEqual(next(items)['registration_number'], '18544')
+        time.sleep(0.5)
+        # The other two items are held back until the first one is released
+        [(_, run)] = process._runs.values()
+        self.assertEqual(run.qsize(), 0)
+        self.assertEqual([item['registration_number'] for item in items], ['24100', '55931'])
+        self.assertEqual(crawl.stats['items'], 3)
+
+        # A caller that stops reading doesn't leave the spider stuck
+        abandoned = iter(process.crawl('brand'))
+        next(abandoned)
+        abandoned.close()
+        items, _ = run_crawl(process, 'gazette')
+        self.assertEqual(len(items), 1)
+
+    def test_failures_surface_as_crawl_errors(self):
+        with self.assertRaises(CrawlError):
+            run_crawl(self.process, 'unknown')
+        with mock.patch.dict('src.crawl_runner.SPIDERS', {'broken': 'src.crawlers.nowhere.Spider'}):
+            with self.assertRaisesRegex(CrawlError, 'Could not load spider'):
+                run_crawl(self.process, 'broken')
+
+        # A stopped process is replaced on the next crawl
+        self.process.stop()
+        items, _ = run_crawl(self.process, 'gazette')
+        self.assertEqual(len(items), 1)
+
+
+@unittest.skipIf(scrapy is None, 'scrapy is not installed')
+class TestConditionalFetchMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        from scrapy.utils.test import get_crawler
+        from src.crawlers.dastyar_crawlers.middlewares import ConditionalFetchMiddleware
+
+        self.crawler = get_crawler(scrapy.Spider)
+        self.crawler.spider = scrapy.Spider('watchdog', page_validators={
+            'https://rrk.ir/1': {'etag': '"v1"', 'last_modified': 'Tue, 18 Jan 2022 00:00:00 GMT', 'content_hash': None},
+        })
+        self.crawler.stats.open_spider()
+        self.middleware = ConditionalFetchMiddleware.from_crawler(self.crawler)
+
+    def test_known_pages_are_requested_conditionally(self):
+        request = scrapy.Request('https://rrk.ir/1')
+        self.middleware.process_request(request)
+        self.assertEqual(request.headers['If-None-Match'], b'"v1"')
+        self.assertEqual(request.headers['If-Modified-Since'], b'Tue, 18 Jan 2022 00:00:00 GMT')
+
+        with self.assertRaises(scrapy.exceptions.IgnoreRequest):
+            self.middleware.process_response(request, scrapy.http.Response(request.url, status=304), None)
+        self.assertEqual(self.crawler.stats.get_value('conditional/not_modified'), 1)
+
+    def test_changed_pages_record_their_new_validators(self):
+        request = scrapy.Request('https://rrk.ir/2')
+        self.middleware.process_request(request)
+        self.assertNotIn('If-None-Match', request.headers)
+
+        response = scrapy.http.Response(request.url, status=200, headers={'ETag': '"v2"'}, body=b'<html></html>')
+        self.assertIs(self.middleware.process_response(request, response), response)
+        self.assertEqual(self.crawler.spider.fetched_pages[request.url]['etag'], '"v2"')
+
+
+@unittest.skipIf(scrapy is None, 'scrapy is not installed')
+class TestRunAndProcessCrawler(unittest.TestCase):
+
+    def test_crawled_items_are_stored(self):
+        from src import main
+        from src.models.database import Base
+        from src.models.watchdog import CrawlerRunLog, CrawlPage, GazetteAnnouncement
+
+        engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        process = CrawlProcess({'LOG_LEVEL': 'WARNING'}, idle_timeout=60)
+        try:
+            with mock.patch.object(main, 'crawl_process', process):
+                main.run_and_process_crawler('gazette', Session())
+                with Session() as session:
+                    log = session.get(CrawlerRunLog, 'gazette')
+                    self.assertEqual((log.status, log.items_added), ('success', 1))
+                    self.assertEqual(session.query(GazetteAnnouncement).one().date, datetime.date(2022, 1, 18))
+                    self.assertEqual(session.query(CrawlPage).one().crawler_name, 'gazette')
+
+                # The stored page is unchanged, so the next run skips it
+                main.run_and_process_crawler('gazette', Session())
+                with Session() as session:
+                    log = session.get(CrawlerRunLog, 'gazette')
+                    self.assertEqual((log.status, log.items_added), ('success', 0))
+                    self.assertIn('1 pages were unchanged', log.details)
+        finally:
+            process.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
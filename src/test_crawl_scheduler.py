@@ -0,0 +1,130 @@
+import datetime
+import threading
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.crawl_scheduler import CronSchedule, CrawlScheduler, claim_run, parse_schedules
+from src.models.database import Base
+from src.models.watchdog import CrawlerRunLog
+
+
+class TestCronSchedule(unittest.TestCase):
+
+    def test_next_after(self):
+        moment = datetime.datetime(2022, 1, 18, 2, 0, 30)  # a Tuesday
+        self.assertEqual(CronSchedule('0 2 * * *').next_after(moment), datetime.datetime(2022, 1, 19, 2, 0))
+        self.assertEqual(CronSchedule('*/15 * * * *').next_after(moment), datetime.datetime(2022, 1, 18, 2, 15))
+        self.assertEqual(CronSchedule('30 6 * * 6').next_after(moment), datetime.datetime(2022, 1, 22, 6, 30))
+        self.assertEqual(CronSchedule('0 0 29 2 *').next_after(moment), datetime.datetime(2024, 2, 29, 0, 0))
+        # Both day fields restricted: either one matches
+        self.assertEqual(CronSchedule('0 9 1 * 5').next_after(moment), datetime.datetime(2022, 1, 21, 9, 0))
+
+    def test_invalid_expressions(self):
+        for expression in ['0 2 * *', '60 * * * *', '0 0 31 2 *']:
+            with self.assertRaises(ValueError):
+                CronSchedule(expression).next_after(datetime.datetime(2022, 1, 18))
+
+    def test_parse_schedules(self):
+        self.assertEqual(parse_schedules('gazette=0 2 * * *; brand=30 2 * * *;'), {'gazette': '0 2 * * *', 'brand': '30 2 * * *'})
+        self.assertEqual(parse_schedules(''), {})
+
+
+def wait_for_state(scheduler, crawler_name, state):
+    # A run's slot is released just after it returns
+    deadline = time.monotonic() + 10
+    while scheduler.status(crawler_name)['scheduler_state'] != state:
+        if time.monotonic() > deadline:
+            raise AssertionError(f"'{crawler_name}' never became {state}")
+        time.sleep(0.01)
+
+
+class TestCrawlScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.started = []
+        # One permit lets one run of the crawler finish
+        self.permits = {'gazette': threading.Semaphore(0), 'brand': threading.Semaphore(0)}
+
+    def run_crawl(self, crawler_name, requested_at):
+        self.started.append((crawler_name, requested_at))
+        self.permits[crawler_name].acquire(timeout=10)
+
+    def finish(self, crawler_name):
+        self.permits[crawler_name].release()
+
+    def test_one_run_per_crawler_and_triggers_coalesce(self):
+        scheduler = CrawlScheduler(self.run_crawl, max_concurrent=2)
+        first = datetime.datetime(2022, 1, 18, 2, 0)
+        self.assertEqual(scheduler.trigger('gazette', first), 'queued')
+        # Triggers while it runs add up to one follow-up run
+        self.assertEqual(scheduler.trigger('gazette', first + datetime.timedelta(minutes=2)), 'queued')
+        self.assertEqual(scheduler.trigger('gazette', first + datetime.timedelta(minutes=1)), 'coalesced')
+        self.assertEqual(scheduler.status('gazette')['scheduler_state'], 'running, queued')
+        self.assertEqual(len(self.started), 1)
+
+        self.finish('gazette')
+        wait_for_state(scheduler, 'gazette', 'running')
+        self.finish('gazette')
+        wait_for_state(scheduler, 'gazette', 'idle')
+        self.assertEqual(self.started, [('gazette', first), ('gazette', first + datetime.timedelta(minutes=1))])
+
+    def test_runs_wait_for_a_free_slot(self):
+        now = [100.0]
+        scheduler = CrawlScheduler(self.run_crawl, max_concurrent=1, clock=lambda: now[0])
+        scheduler.trigger('gazette')
+        scheduler.trigger('brand')
+        now[0] += 30
+        status = scheduler.status('brand')
+        self.assertEqual((status['scheduler_state'], status['queued_seconds'], status['queue_depth'], status['active_runs']), ('queued', 30, 1, 1))
+
+        self.finish('gazette')
+        wait_for_state(scheduler, 'brand', 'running')
+        self.assertEqual(scheduler.status('brand')['last_wait_seconds'], 30)
+        self.assertEqual(scheduler.status('brand')['mean_wait_seconds'], 15)
+        self.finish('brand')
+        self.assertEqual([crawler_name for crawler_name, _ in self.started], ['gazette', 'brand'])
+
+    def test_schedules_trigger_when_due(self):
+        scheduler = CrawlScheduler(self.run_crawl, schedules={'gazette': '0 2 * * *'})
+        self.assertEqual(scheduler.run_due(datetime.datetime(2022, 1, 18, 1, 0)), [])
+        self.assertEqual(scheduler.status('gazette')['next_scheduled_run'], datetime.datetime(2022, 1, 18, 2, 0))
+        self.assertEqual(scheduler.run_due(datetime.datetime(2022, 1, 18, 2, 0, 5)), ['gazette'])
+        self.assertEqual(scheduler.status('gazette')['next_scheduled_run'], datetime.datetime(2022, 1, 19, 2, 0))
+        self.finish('gazette')
+
+
+class TestClaimRun(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_a_crawler_is_claimed_once(self):
+        requested_at = datetime.datetime.utcnow()
+        self.assertTrue(claim_run(self.db, 'gazette', requested_at))
+        # Another worker, for the same trigger or while the run is active
+        self.assertFalse(claim_run(self.db, 'gazette', requested_at))
+        self.assertFalse(claim_run(self.db, 'gazette', datetime.datetime.utcnow()))
+
+        log = self.db.get(CrawlerRunLog, 'gazette')
+        log.status = 'success'
+        self.db.commit()
+        # The finished run started after this trigger, so it covered it
+        self.assertFalse(claim_run(self.db, 'gazette', requested_at))
+        self.assertTrue(claim_run(self.db, 'gazette', datetime.datetime.utcnow()))
+
+    def test_a_stale_run_is_taken_over(self):
+        self.db.add(CrawlerRunLog(crawler_name='brand', status='running', last_run_start=datetime.datetime(2022, 1, 18)))
+        self.db.commit()
+        self.assertTrue(claim_run(self.db, 'brand', datetime.datetime.utcnow()))
+
+
+if __name__ == '__main__':
+    unittest.main()
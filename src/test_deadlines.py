@@ -0,0 +1,80 @@
+import datetime
+import unittest
+
+from dateutil.relativedelta import relativedelta
+
+from src import jalali
+from src.deadlines import DeadlineTable, compile_deadline_rule
+
+D = datetime.date
+
+
+class TestJalali(unittest.TestCase):
+
+    def test_known_dates(self):
+        self.assertEqual(jalali.to_gregorian(1400, 1, 1), D(2021, 3, 21))
+        self.assertEqual(jalali.to_gregorian(1403, 1, 1), D(2024, 3, 20))
+        self.assertEqual(jalali.from_gregorian(D(2021, 3, 20)), (1399, 12, 30))
+        self.assertTrue(jalali.is_leap(1399))
+        self.assertFalse(jalali.is_leap(1400))
+        self.assertEqual(jalali.month_length(1400, 12), 29)
+
+    def test_round_trip(self):
+        day = D(2015, 1, 1)
+        while day < D(2035, 1, 1):
+            self.assertEqual(jalali.to_gregorian(*jalali.from_gregorian(day)), day)
+            day += datetime.timedelta(days=1)
+
+    def test_parse(self):
+        self.assertEqual(jalali.parse('1400/10/28'), D(2022, 1, 18))
+        self.assertEqual(jalali.parse('۱۴۰۰/۱۰/۲۸'), D(2022, 1, 18))
+        for text in (None, '', '1400/13/01', '1400/12/30', 'نامعلوم'):
+            self.assertIsNone(jalali.parse(text))
+
+
+class TestDeadlineTable(unittest.TestCase):
+
+    def test_rule_compilation(self):
+        self.assertEqual(compile_deadline_rule('end_of_month').period, 'month')
+        rule = compile_deadline_rule('45_days_after_season_end', 'gregorian')
+        self.assertEqual((rule.period, rule.offset_days, rule.calendar), ('season', 45, 'gregorian'))
+        self.assertIsNone(compile_deadline_rule('every_full_moon'))
+        with self.assertRaises(ValueError):
+            compile_deadline_rule('end_of_month', 'lunar')
+
+    def test_gregorian_matches_month_arithmetic(self):
+        rules = {
+            'EOM': compile_deadline_rule('end_of_month', 'gregorian'),
+            'Q15': compile_deadline_rule('15_days_after_season_end', 'gregorian'),
+        }
+        start = D(2024, 1, 1)
+        table = DeadlineTable(rules, start)
+        for offset in range(0, 700, 3):
+            day = start + datetime.timedelta(days=offset)
+            quarter_end = D(day.year, (day.month - 1) // 3 * 3 + 3, 1) + relativedelta(day=31)
+            self.assertEqual(table.due_date('EOM', day), day + relativedelta(day=31))
+            self.assertEqual(table.due_date('Q15', day), quarter_end + datetime.timedelta(days=15))
+
+    def test_jalali_periods(self):
+        rules = {
+            'EOM': compile_deadline_rule('end_of_month'),
+            'Q15': compile_deadline_rule('15_days_after_season_end'),
+        }
+        table = DeadlineTable(rules, D(2024, 3, 1))
+        # Esfand 1402 ends on 29 Esfand (1402 is not a leap year)
+        self.assertEqual(table.due_date('EOM', D(2024, 3, 10)), jalali.to_gregorian(1402, 12, 29))
+        # Mehr-Azar season ends on 30 Azar
+        self.assertEqual(table.due_date('Q15', D(2024, 10, 1)), jalali.to_gregorian(1403, 9, 30) + datetime.timedelta(days=15))
+
+    def test_horizon_includes_late_deadlines_of_earlier_periods(self):
+        rules = {'Q45': compile_deadline_rule('45_days_after_season_end', 'gregorian')}
+        table = DeadlineTable(rules, D(2024, 1, 10), horizon_months=12)
+        self.assertEqual(table.due_dates('Q45', D(2024, 1, 10), D(2024, 12, 31)), [
+            D(2024, 2, 14), D(2024, 5, 15), D(2024, 8, 14), D(2024, 11, 14),
+        ])
+        self.assertTrue(table.covers(D(2024, 6, 1), 6))
+        self.assertFalse(table.covers(D(2024, 6, 1), 12))
+
+
+if __name__ == '__main__':
+    unittest.main()
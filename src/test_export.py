@@ -0,0 +1,70 @@
+import asyncio
+import datetime
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from src import export, ledger_import, schemas
+from src.models.database import Base
+from src.models.finance import BankTransaction, TransactionType
+from src.models.identity import EnterpriseProfile
+
+
+class TestStreamingExport(unittest.TestCase):
+
+    def setUp(self):
+        # A file database, seeded through a sync session and exported through an async one
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine(f'sqlite:///{self.path}')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.enterprise = EnterpriseProfile(name='شرکت آزمون', national_id='10300000000', economic_code='413000000000')
+        self.session.add(self.enterprise)
+        self.session.flush()
+        for i in range(5):
+            self.session.add(BankTransaction(
+                enterprise_id=self.enterprise.id, amount=100 * (i + 1), reference_id=f'TX{i}', description='واریز',
+                transaction_date=datetime.datetime(2023, 1, 1 + i), type=TransactionType.WITHDRAWAL if i == 4 else TransactionType.DEPOSIT,
+            ))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def _export(self, fmt, chunk_size=2):
+        async def collect():
+            async_engine = create_async_engine(f'sqlite+aiosqlite:///{self.path}')
+            statement = select(BankTransaction).order_by(BankTransaction.id)
+            chunks = [chunk async for chunk in export.iter_export(
+                statement, schemas.BankTransaction, fmt, chunk_size=chunk_size, session_factory=async_sessionmaker(async_engine)
+            )]
+            await async_engine.dispose()
+            return chunks
+        return asyncio.run(collect())
+
+    def test_ndjson_is_streamed_in_chunks(self):
+        chunks = self._export('ndjson')
+        self.assertEqual(len(chunks), 3)
+        rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+        self.assertEqual([row['reference_id'] for row in rows], ['TX0', 'TX1', 'TX2', 'TX3', 'TX4'])
+        self.assertEqual((rows[4]['type'], rows[4]['transaction_date']), ('withdrawal', '2023-01-05T00:00:00'))
+
+    def test_csv_export_can_be_imported_back(self):
+        body = ''.join(self._export('csv'))
+        self.assertTrue(body.startswith('\ufeffamount,transaction_date,description,reference_id,type,id,enterprise_id'))
+
+        report = ledger_import.import_ledger(self.session, self.enterprise.id, ledger_import.TRANSACTIONS, io.BytesIO(body.encode('utf-8')), 'csv')
+        self.assertEqual((report['received'], report['inserted'], report['updated'], report['errors']), (5, 0, 5, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src import jobs, watchdog_ingest
+from src.logic_engine import LogicEngine, get_shared_engine
+from src.models.database import Base
+from src.models.identity import EnterpriseProfile
+from src.models.gantt import LegalTask
+from src.models.watchdog import BrandMatch, CrawlerRunLog, TrademarkRegistration
+from src.taxonomy import DEFAULT_TAXONOMY_PATH, TaxonomyStore
+
+
+class TestBrandMatchingJob(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.session.add(EnterpriseProfile(name='پارس الکتریک', national_id='10300000000', economic_code='413000000000'))
+        self.session.add(TrademarkRegistration(name='پارس الکتریکی', registration_number='1'))
+        self.session.add(TrademarkRegistration(name='محصول بی ربط', registration_number='2'))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_only_new_trademarks_are_matched(self):
+        self.assertEqual(jobs.run_brand_matching(self.session), 1)
+        log_entry = self.session.query(CrawlerRunLog).filter_by(crawler_name=jobs.BRAND_MATCHING_JOB).one()
+        self.assertEqual(log_entry.status, 'success')
+        self.assertEqual(log_entry.last_item_id, 2)
+
+        # Nothing new: nothing matched, no duplicates
+        self.assertEqual(jobs.run_brand_matching(self.session), 0)
+
+        self.session.add(TrademarkRegistration(name='پارس الکتریک', registration_number='3'))
+        self.session.commit()
+        self.assertEqual(jobs.run_brand_matching(self.session), 1)
+        self.assertEqual(self.session.query(BrandMatch).count(), 2)
+
+    def test_trademarks_changed_in_place_are_matched_again(self):
+        jobs.run_brand_matching(self.session)
+        crawl = [
+            {'name': 'پارس الکتریکی', 'registration_number': '1', 'status': 'منقضی شده'},  # still matches
+            {'name': 'پارس الکتریک', 'registration_number': '2'},  # was 'محصول بی ربط'
+        ]
+        watchdog_ingest.ingest_items(self.session, watchdog_ingest.TRADEMARKS, crawl)
+
+        self.assertEqual(jobs.run_brand_matching(self.session), 1)
+        matched = {match.trademark.registration_number for match in self.session.query(BrandMatch)}
+        self.assertEqual(matched, {'1', '2'})
+        self.assertEqual(jobs.run_brand_matching(self.session), 0)
+
+        # Renamed away from the brand: the match goes
+        watchdog_ingest.ingest_items(self.session, watchdog_ingest.TRADEMARKS, [{**crawl[1], 'name': 'محصول بی ربط'}])
+        jobs.run_brand_matching(self.session)
+        self.assertEqual({match.trademark.registration_number for match in self.session.query(BrandMatch)}, {'1'})
+
+
+class TestNameKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_keys_are_set_on_write_and_backfilled(self):
+        trademark = TrademarkRegistration(name='پارس  الكتريك', registration_number='1')
+        self.assertEqual(trademark.name_normalized, 'پارس الکتریک')
+        self.assertEqual(trademark.name_tokens, 'الکتریک پارس')
+        self.session.add(trademark)
+        self.session.commit()
+
+        # Rows written before the columns existed
+        self.session.query(TrademarkRegistration).update({'name_tokens': None, 'name_normalized': None})
+        self.session.commit()
+        self.assertEqual(jobs.backfill_name_keys(self.session), 1)
+        self.assertEqual(self.session.query(TrademarkRegistration).one().name_tokens, 'الکتریک پارس')
+
+
+class TestMaterializeLegalTasks(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.medium = EnterpriseProfile(name='الف', national_id='1', economic_code='1', scale_name='Medium')
+        self.large = EnterpriseProfile(name='ب', national_id='2', economic_code='2', scale_name='Large')
+        self.session.add_all([self.medium, self.large])
+        self.session.commit()
+        self.today = datetime.date(2024, 4, 1)
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def _task_ids(self, enterprise):
+        return {row.task_id for row in self.session.query(LegalTask).filter_by(enterprise_id=enterprise.id)}
+
+    def test_materialization_is_idempotent_and_follows_scale_changes(self):
+        jobs.materialize_legal_tasks(self.session, today=self.today, batch_size=1)
+        count = self.session.query(LegalTask).count()
+        self.assertGreater(count, 0)
+        self.assertEqual(self._task_ids(self.medium), {'TAX-001', 'INS-001', 'VAT-001'})
+        self.assertIn('REP-001', self._task_ids(self.large))
+
+        # Nothing changed: only_changed skips everyone; a full run inserts no duplicates
+        self.assertEqual(jobs.materialize_legal_tasks(self.session, today=self.today), 0)
+        jobs.materialize_legal_tasks(self.session, only_changed=False, today=self.today)
+        self.assertEqual(self.session.query(LegalTask).count(), count)
+
+        self.large.scale_name = 'Medium'
+        self.session.commit()
+        jobs.materialize_legal_tasks(self.session, today=self.today)
+        self.assertEqual(self._task_ids(self.large), {'TAX-001', 'INS-001', 'VAT-001'})
+
+    def test_the_horizon_rolls_forward(self):
+        jobs.materialize_legal_tasks(self.session, today=self.today)
+        last_due = lambda: max(row.due_date for row in self.session.query(LegalTask).filter_by(enterprise_id=self.medium.id))
+        horizon_end = last_due()
+        version = get_shared_engine().taxonomy_version
+        self.assertFalse(jobs.needs_legal_tasks(self.medium, self.today + datetime.timedelta(days=jobs.TASK_REFRESH_DAYS), version))
+
+        # A year on, an unattended tenant would otherwise have no upcoming tasks
+        next_year = self.today + datetime.timedelta(days=365)
+        self.assertTrue(jobs.needs_legal_tasks(self.medium, next_year, version))
+        self.assertGreater(jobs.materialize_legal_tasks(self.session, today=next_year), 0)
+        self.assertGreater(last_due(), horizon_end)
+        self.assertEqual(self.medium.tasks_materialized_on, next_year)
+        self.assertFalse(jobs.needs_legal_tasks(self.medium, next_year, version))
+
+    def test_rule_edits_regenerate_the_tasks(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'content_taxonomy.json')
+        shutil.copy(DEFAULT_TAXONOMY_PATH, path)
+        engine = LogicEngine(store=TaxonomyStore(path, check_interval=0))
+        jobs.materialize_legal_tasks(self.session, today=self.today, logic_engine=engine)
+        vat_dates = lambda: {row.due_date: row.title for row in self.session.query(LegalTask).filter_by(enterprise_id=self.medium.id, task_id='VAT-001')}
+        before = vat_dates()
+
+        taxonomy = json.loads(open(path, encoding='utf-8').read())
+        for rule in taxonomy['gantt_chart_tasks']:
+            if rule['task_id'] == 'VAT-001':
+                rule['deadline_rule'] = 'end_of_season'
+                rule['title'] = 'اظهارنامه ارزش افزوده'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(taxonomy, f, ensure_ascii=False)
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertTrue(engine.reload_if_changed())
+        self.assertTrue(jobs.needs_legal_tasks(self.medium, self.today, engine.taxonomy_version))
+
+        jobs.materialize_legal_tasks(self.session, today=self.today, logic_engine=engine)
+        expected = {due_date for rule, due_date in engine.get_deadline_horizon({'scale_name': 'Medium'}, self.today, 12) if rule['task_id'] == 'VAT-001'}
+        after = vat_dates()
+        # The old due dates are gone, not kept next to the new ones
+        self.assertEqual(set(after), expected)
+        self.assertNotEqual(set(after), set(before))
+        self.assertEqual(set(after.values()), {'اظهارنامه ارزش افزوده'})
+        self.assertFalse(jobs.needs_legal_tasks(self.medium, self.today, engine.taxonomy_version))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import datetime
+import io
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src import ledger_import, rollups
+from src.models.database import Base
+from src.models.finance import BankTransaction, TaxInvoice, TransactionType
+from src.models.identity import EnterpriseProfile
+
+
+class TestLedgerImport(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.enterprise = EnterpriseProfile(name='شرکت آزمون', national_id='10300000000', economic_code='413000000000')
+        self.other = EnterpriseProfile(name='شرکت دیگر', national_id='10300000001', economic_code='413000000001')
+        self.session.add_all([self.enterprise, self.other])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def _import(self, kind, text, fmt, enterprise=None, batch_size=2):
+        stream = io.BytesIO(text.encode('utf-8'))
+        return ledger_import.import_ledger(self.session, (enterprise or self.enterprise).id, kind, stream, fmt, batch_size=batch_size)
+
+    def test_csv_import_upserts_on_reference_id_and_reports_bad_rows(self):
+        report = self._import(ledger_import.TRANSACTIONS, (
+            "amount,transaction_date,description,reference_id,type\n"
+            "1000,2023-01-10,واریز,TX1,deposit\n"
+            "abc,2023-01-11,,TX2,deposit\n"
+            "300,2023-01-12,,TX3,withdrawal\n"
+            "500,2023-02-01,,,deposit\n"
+        ), 'csv')
+        self.assertEqual((report['received'], report['inserted'], report['updated']), (4, 3, 0))
+        self.assertEqual([err['line'] for err in report['errors']], [3])
+
+        # Re-importing a statement updates rows instead of duplicating them
+        report = self._import(ledger_import.TRANSACTIONS, (
+            "amount,transaction_date,reference_id\n"
+            "1200,2023-02-10,TX1\n"
+            "50,2023-02-11,TX4\n"
+        ), 'csv')
+        self.assertEqual((report['inserted'], report['updated'], report['errors']), (1, 1, []))
+
+        tx1 = self.session.query(BankTransaction).filter_by(reference_id='TX1').one()
+        self.assertEqual((tx1.amount, tx1.transaction_date, tx1.type), (1200, datetime.datetime(2023, 2, 10), TransactionType.DEPOSIT))
+        self.assertEqual(self.session.query(BankTransaction).count(), 4)
+        self.assertEqual(rollups.check_rollups(self.session), [])
+
+    def test_ndjson_import_dedupes_tax_id_and_keeps_tenants_apart(self):
+        self._import(ledger_import.INVOICES, '{"amount": 900, "issue_date": "2023-03-01T00:00:00", "tax_id": "INV-OTHER"}\n', 'ndjson', enterprise=self.other)
+
+        report = self._import(ledger_import.INVOICES, "\n".join([
+            '{"amount": 100, "issue_date": "2023-03-01T10:00:00", "tax_id": "INV1"}',
+            '{"amount": 150, "issue_date": "2023-03-02T10:00:00", "tax_id": "INV1"}',
+            'not json',
+            '{"amount": 1, "issue_date": "2023-03-03T10:00:00", "tax_id": "INV-OTHER"}',
+            '{"amount": 200, "issue_date": "2023-03-04T10:00:00"}',
+        ]), 'ndjson', batch_size=10)
+
+        self.assertEqual((report['received'], report['inserted'], report['updated'], report['duplicates']), (5, 1, 0, 1))
+        self.assertEqual([err['line'] for err in report['errors']], [3, 4, 5])
+        # Every received row is accounted for
+        self.assertEqual(report['inserted'] + report['updated'] + report['duplicates'] + len(report['errors']), report['received'])
+        invoices = {inv.tax_id: (inv.enterprise_id, inv.amount) for inv in self.session.query(TaxInvoice)}
+        self.assertEqual(invoices, {'INV1': (self.enterprise.id, 150), 'INV-OTHER': (self.other.id, 900)})
+        self.assertEqual(rollups.check_rollups(self.session), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src import ledger_queries
+from src.logic_engine import LogicEngine
+from src.models.database import Base
+from src.models.finance import BankTransaction, TaxInvoice, TransactionType
+from src.models.identity import EnterpriseProfile
+
+
+class TestReconciliationTotals(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.enterprise = EnterpriseProfile(name='شرکت آزمون', national_id='10300000000', economic_code='413000000000')
+        other = EnterpriseProfile(name='شرکت دیگر', national_id='10300000001', economic_code='413000000001')
+        self.session.add_all([self.enterprise, other])
+        self.session.flush()
+
+        tx = lambda ref, amount, date, kind=TransactionType.DEPOSIT, enterprise=self.enterprise: BankTransaction(
+            enterprise_id=enterprise.id, amount=amount, transaction_date=date, reference_id=ref, type=kind)
+        inv = lambda tax_id, amount, date: TaxInvoice(
+            enterprise_id=self.enterprise.id, amount=amount, issue_date=date, tax_id=tax_id)
+        self.session.add_all([
+            tx('TX1', 1000, datetime.datetime(2023, 1, 10)),
+            tx('TX2', 2000, datetime.datetime(2023, 2, 10)),
+            tx('TX3', 4000, datetime.datetime(2023, 4, 10)),
+            tx('TX4', 9999, datetime.datetime(2023, 1, 11), TransactionType.WITHDRAWAL),
+            tx('TX5', 7777, datetime.datetime(2023, 1, 12), enterprise=other),
+            inv('INV1', 1000, datetime.datetime(2023, 1, 5)),
+            inv('INV2', 500, datetime.datetime(2023, 5, 5)),
+        ])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_overall_totals(self):
+        totals = ledger_queries.get_reconciliation_totals(self.session, self.enterprise.id)
+        self.assertEqual(totals, [{"period": None, "total_deposits": 7000, "total_invoiced": 1500}])
+
+    def test_monthly_and_seasonal_buckets(self):
+        # Jalali months: 2023-01-10 is 20 Dey 1401, 2023-04-10 is 21 Farvardin 1402
+        monthly = ledger_queries.get_reconciliation_totals(self.session, self.enterprise.id, 'month')
+        self.assertEqual([(b['period'], b['total_deposits'], b['total_invoiced']) for b in monthly], [
+            ('1401-10', 1000, 1000), ('1401-11', 2000, 0), ('1402-01', 4000, 0), ('1402-02', 0, 500),
+        ])
+        seasonal = ledger_queries.get_reconciliation_totals(self.session, self.enterprise.id, 'season')
+        self.assertEqual([(b['period'], b['total_deposits'], b['total_invoiced']) for b in seasonal], [
+            ('1401-Q4', 3000, 1000), ('1402-Q1', 4000, 500),
+        ])
+
+    def test_seasons_end_with_the_jalali_year(self):
+        # 29 Esfand 1401 and 1 Farvardin 1402: the same Gregorian month, but different seasons
+        self.session.add_all([
+            BankTransaction(enterprise_id=self.enterprise.id, amount=10, transaction_date=datetime.datetime(2023, 3, 20, 23), reference_id='TX6'),
+            BankTransaction(enterprise_id=self.enterprise.id, amount=20, transaction_date=datetime.datetime(2023, 3, 21, 1), reference_id='TX7'),
+        ])
+        self.session.commit()
+        seasonal = ledger_queries.get_reconciliation_totals(self.session, self.enterprise.id, 'season')
+        self.assertEqual([(b['period'], b['total_deposits']) for b in seasonal], [('1401-Q4', 3010), ('1402-Q1', 4020)])
+
+    def test_alerts_from_aggregates(self):
+        totals = ledger_queries.get_reconciliation_totals(self.session, self.enterprise.id, 'season')
+        alerts = LogicEngine().reconcile_totals(totals)
+        self.assertEqual([alert['details']['period'] for alert in alerts], ['1401-Q4', '1402-Q1'])
+
+    def test_unknown_period_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ledger_queries.get_reconciliation_totals(self.session, self.enterprise.id, 'week')
+
+
+if __name__ == '__main__':
+    unittest.main()
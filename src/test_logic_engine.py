@@ -0,0 +1,138 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from thefuzz import fuzz
+
+from src.logic_engine import LogicEngine
+from src.persian_text import token_key
+from src.taxonomy import DEFAULT_TAXONOMY_PATH, TaxonomyStore
+
+
+class TestTaxonomyReload(unittest.TestCase):
+
+    def setUp(self):
+        """Copy the real taxonomy to a temp file so it can be edited by the test."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'content_taxonomy.json')
+        shutil.copy(DEFAULT_TAXONOMY_PATH, self.path)
+        self.engine = LogicEngine(store=TaxonomyStore(self.path, check_interval=0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _rewrite(self, taxonomy):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(taxonomy, f, ensure_ascii=False)
+        # Make sure the mtime moves even on filesystems with coarse timestamps
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+
+    def test_unchanged_file_is_not_reloaded(self):
+        snapshot = self.engine.store.snapshot
+        self.assertFalse(self.engine.reload_if_changed())
+        self.assertIs(self.engine.store.snapshot, snapshot)
+
+    def test_changed_file_swaps_in_new_version(self):
+        old_version = self.engine.taxonomy_version
+        old_snapshot = self.engine.store.snapshot
+        taxonomy = dict(self.engine.taxonomy)
+        taxonomy['gantt_chart_tasks'] = []
+        self._rewrite(taxonomy)
+
+        self.assertTrue(self.engine.reload_if_changed())
+        self.assertNotEqual(self.engine.taxonomy_version, old_version)
+        self.assertEqual(self.engine.gantt_tasks, [])
+        # Requests that already hold the old snapshot keep seeing the old data
+        self.assertTrue(old_snapshot.taxonomy['gantt_chart_tasks'])
+
+    def test_broken_file_keeps_last_good_version(self):
+        old_version = self.engine.taxonomy_version
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{not json')
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+
+        self.assertFalse(self.engine.reload_if_changed())
+        self.assertEqual(self.engine.taxonomy_version, old_version)
+
+    def test_invalid_rules_keep_last_good_version(self):
+        old_snapshot = self.engine.store.snapshot
+        valid_rule = old_snapshot.taxonomy['gantt_chart_tasks'][0]
+        without_task_id = {key: value for key, value in valid_rule.items() if key != 'task_id'}
+        for rule in [{**valid_rule, 'calendar': 'hijri'}, without_task_id]:
+            with self.subTest(rule=rule):
+                self._rewrite({**old_snapshot.taxonomy, 'gantt_chart_tasks': [rule]})
+                self.assertFalse(self.engine.reload_if_changed())
+                self.assertIs(self.engine.store.snapshot, old_snapshot)
+
+
+class TestCompiledTaxonomy(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = LogicEngine()
+
+    def test_scale_rule_lookup(self):
+        self.assertEqual(self.engine.get_scale_rule('Large')['level'], 3)
+        self.assertIsNone(self.engine.get_scale_rule('Unknown'))
+
+    def test_gantt_rules_match_linear_scan(self):
+        for scale in ['Micro', 'Medium', 'Large', 'Mega']:
+            expected = [rule for rule in self.engine.gantt_tasks if scale in rule['applies_to_scale']]
+            self.assertEqual(self.engine.get_gantt_rules_for_scale(scale), expected)
+
+    def test_activity_tasks_by_cluster_and_sub_activity(self):
+        sub_tasks = self.engine.get_activity_tasks('J_Sub_1')
+        self.assertEqual([task['task_id'] for task in sub_tasks], ['J1-001'])
+        self.assertEqual(self.engine.get_activity_tasks('J-Cluster'), sub_tasks)
+        self.assertEqual(self.engine.get_activity_tasks('J_Sub_2'), [])
+
+
+class TestBrandSimilarity(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = LogicEngine()
+
+    def test_arabic_spelling_variants_match(self):
+        # Arabic kaf/yeh, ZWNJ and diacritics should not hide an identical brand
+        trademarks = [{'name': 'كالاي اصلي', 'owner_name': 'شرکت رقیب', 'source_url': 'http://example.com/2'}]
+        alerts = self.engine.check_brand_similarity('کالای اصلی', trademarks)
+        self.assertEqual(len(alerts), 1)
+        self.assertIn('100%', alerts[0]['summary'])
+
+
+class TestBatchBrandMatching(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = LogicEngine()
+        self.enterprises = [(1, 'کالای اصلی'), (2, 'پارس الکتریک'), (3, 'شرکت بی نام')]
+        self.trademarks = [
+            {'id': 10, 'name': 'کالای اصلی من'},
+            {'id': 11, 'name': 'پارس الکتریکی'},
+            {'id': 12, 'name': 'محصول بی ربط'},
+        ]
+
+    def _keys(self):
+        return [(enterprise_id, token_key(name)) for enterprise_id, name in self.enterprises]
+
+    def _expected(self):
+        return sorted(
+            (enterprise_id, tm['id'], fuzz.token_set_ratio(name, tm['name']))
+            for enterprise_id, name in self.enterprises
+            for tm in self.trademarks
+            if fuzz.token_set_ratio(name, tm['name']) >= 80
+        )
+
+    def test_inline_batch_matches_pairwise_scan(self):
+        hits = self.engine.batch_match_brands(self._keys(), self.trademarks)
+        self.assertEqual(sorted(hits), self._expected())
+
+    def test_process_pool_batch_matches_pairwise_scan(self):
+        hits = self.engine.batch_match_brands(self._keys(), self.trademarks, max_workers=2, min_pool_work=0)
+        self.assertEqual(sorted(hits), self._expected())
+
+
+if __name__ == '__main__':
+    unittest.main()
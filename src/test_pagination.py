@@ -0,0 +1,63 @@
+import datetime
+import unittest
+
+from fastapi import HTTPException, Response
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.models.database import Base
+from src.models.finance import BankTransaction
+from src.models.identity import EnterpriseProfile
+from src.pagination import NEXT_CURSOR_HEADER, PageParams, decode_cursor, encode_cursor, paginate
+
+
+class TestKeysetPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        enterprise = EnterpriseProfile(name='شرکت آزمون', national_id='10300000000', economic_code='413000000000')
+        self.session.add(enterprise)
+        self.session.flush()
+        # Pairs of transactions share a date so the id tie-breaker matters
+        for i in range(7):
+            self.session.add(BankTransaction(
+                enterprise_id=enterprise.id, amount=100 + i, reference_id=f'TX{i}',
+                transaction_date=datetime.datetime(2023, 1, 1 + i // 2, 9, 30),
+            ))
+        self.session.commit()
+        self.query = self.session.query(BankTransaction).filter(BankTransaction.enterprise_id == enterprise.id)
+        self.keys = [BankTransaction.transaction_date, BankTransaction.id]
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_pages_cover_every_row_once_in_order(self):
+        seen, cursor = [], None
+        while True:
+            response = Response()
+            rows, cursor = paginate(self.query, self.keys, PageParams(cursor=cursor, limit=3), response)
+            seen.extend(row.reference_id for row in rows)
+            self.assertEqual(response.headers.get(NEXT_CURSOR_HEADER), cursor)
+            if cursor is None:
+                break
+
+        expected = [tx.reference_id for tx in self.query.order_by(BankTransaction.transaction_date.desc(), BankTransaction.id.desc())]
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 7)
+
+    def test_cursor_round_trip_and_rejects_garbage(self):
+        values = [datetime.datetime(2023, 1, 2, 9, 30), 42]
+        self.assertEqual(decode_cursor(encode_cursor(values), 2), values)
+        self.assertEqual(decode_cursor(encode_cursor([datetime.date(2023, 1, 2)]), 1), [datetime.date(2023, 1, 2)])
+
+        for cursor in ('not-a-cursor', encode_cursor([1])):
+            with self.assertRaises(HTTPException) as ctx:
+                paginate(self.query, self.keys, PageParams(cursor=cursor, limit=3))
+            self.assertEqual(ctx.exception.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
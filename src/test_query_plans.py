@@ -0,0 +1,193 @@
+"""
+Query-plan regression tests for the hot tenant-scoped queries.
+
+Each query is run through the same code path as its endpoint, the SQL actually sent to
+the database is captured, and its EXPLAIN plan must be an index search with no separate
+sort step. Runs on SQLite always, and on Postgres too when TEST_POSTGRES_URL is set.
+"""
+import datetime
+import json
+import os
+import unittest
+
+from sqlalchemy import create_engine, event, inspect, or_, text
+from sqlalchemy.orm import sessionmaker
+
+from src import migrations
+from src.models import finance, gantt, watchdog
+from src.models.database import Base
+from src.models.finance import FinancialRollup
+from src.pagination import PageParams, encode_cursor, paginate
+
+ENTERPRISE_ID = 1
+
+
+def _transactions_page(db, cursor=None):
+    query = db.query(finance.BankTransaction).filter(finance.BankTransaction.enterprise_id == ENTERPRISE_ID)
+    paginate(query, [finance.BankTransaction.transaction_date, finance.BankTransaction.id], PageParams(cursor=cursor, limit=50))
+
+
+def _invoices_page(db, cursor=None):
+    query = db.query(finance.TaxInvoice).filter(finance.TaxInvoice.enterprise_id == ENTERPRISE_ID)
+    paginate(query, [finance.TaxInvoice.issue_date, finance.TaxInvoice.id], PageParams(cursor=cursor, limit=50))
+
+
+def _gazette_page(db, cursor=None):
+    paginate(db.query(watchdog.GazetteAnnouncement), [watchdog.GazetteAnnouncement.id], PageParams(cursor=cursor, limit=50))
+
+
+def _upcoming_tasks(db):
+    db.query(gantt.LegalTask).filter(
+        gantt.LegalTask.enterprise_id == ENTERPRISE_ID,
+        or_(gantt.LegalTask.due_date >= datetime.date(2024, 1, 1), gantt.LegalTask.status == gantt.TaskStatus.pending)
+    ).order_by(gantt.LegalTask.due_date, gantt.LegalTask.id).all()
+
+
+def _rollup_summary(db):
+    db.query(FinancialRollup).filter(FinancialRollup.enterprise_id == ENTERPRISE_ID).all()
+
+
+DATE_CURSOR = encode_cursor([datetime.datetime(2024, 1, 1), 100])
+
+# name -> (runs the query, tables whose access must be an index search)
+HOT_QUERIES = {
+    'transactions first page': (lambda db: _transactions_page(db), ['bank_transactions']),
+    'transactions next page': (lambda db: _transactions_page(db, DATE_CURSOR), ['bank_transactions']),
+    'invoices first page': (lambda db: _invoices_page(db), ['tax_invoices']),
+    'invoices next page': (lambda db: _invoices_page(db, DATE_CURSOR), ['tax_invoices']),
+    'gazette next page': (lambda db: _gazette_page(db, encode_cursor([100])), ['gazette_announcements']),
+    'upcoming legal tasks': (_upcoming_tasks, ['legal_tasks']),
+    'rollup summary': (_rollup_summary, ['financial_rollups']),
+}
+
+
+class _QueryPlanTests:
+    """Shared checks; subclasses provide the engine and the plan reader."""
+
+    def setUp(self):
+        self.engine = self.make_engine()
+        Base.metadata.create_all(self.engine)
+        migrations.upgrade(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+        migrations.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _capture(self, run):
+        """Runs the query and returns the (last) SELECT it sent with its parameters."""
+        captured = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                captured.append((statement, parameters))
+
+        event.listen(self.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            run(self.session)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', before_cursor_execute)
+        return captured[-1]
+
+    def test_hot_queries_use_indexes_without_sorting(self):
+        for name, (run, tables) in HOT_QUERIES.items():
+            with self.subTest(query=name):
+                statement, parameters = self._capture(run)
+                self.assert_indexed_plan(statement, parameters, tables)
+
+
+class TestSQLiteQueryPlans(_QueryPlanTests, unittest.TestCase):
+
+    def make_engine(self):
+        return create_engine('sqlite:///:memory:')
+
+    def assert_indexed_plan(self, statement, parameters, tables):
+        cursor = self.session.connection().connection.cursor()
+        plan = [row[-1] for row in cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], plan)
+        for table in tables:
+            steps = [step for step in plan if f' {table}' in step]
+            self.assertTrue(steps, plan)
+            self.assertTrue(all(step.startswith('SEARCH') for step in steps), plan)
+
+
+@unittest.skipUnless(os.environ.get('TEST_POSTGRES_URL'), 'TEST_POSTGRES_URL is not set')
+class TestPostgresQueryPlans(_QueryPlanTests, unittest.TestCase):
+
+    def make_engine(self):
+        return create_engine(os.environ['TEST_POSTGRES_URL'])
+
+    def _plan_nodes(self, node):
+        yield node
+        for child in node.get('Plans', []):
+            yield from self._plan_nodes(child)
+
+    def assert_indexed_plan(self, statement, parameters, tables):
+        cursor = self.session.connection().connection.cursor()
+        # Empty tables would make a sequential scan the cheapest plan; ask what the plan is otherwise
+        cursor.execute('SET enable_seqscan = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes = list(self._plan_nodes(plan[0]['Plan']))
+        self.assertFalse([node for node in nodes if node['Node Type'] in ('Sort', 'Incremental Sort')], plan)
+        for table in tables:
+            scans = [node for node in nodes if node.get('Relation Name') == table]
+            self.assertTrue(scans, plan)
+            self.assertTrue(all(node['Node Type'] in ('Index Scan', 'Index Only Scan') for node in scans), plan)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def test_upgrade_adds_indexes_to_an_existing_database_once(self):
+        engine = create_engine('sqlite:///:memory:')
+        with engine.begin() as connection:
+            # bank_transactions as created before the composite index existed
+            connection.execute(text(
+                "CREATE TABLE bank_transactions (id INTEGER PRIMARY KEY, enterprise_id INTEGER NOT NULL, amount BIGINT NOT NULL, "
+                "transaction_date DATETIME NOT NULL, description VARCHAR(512), reference_id VARCHAR(255) UNIQUE, type VARCHAR(10) NOT NULL)"
+            ))
+            connection.execute(text("CREATE INDEX ix_bank_transactions_enterprise_id ON bank_transactions (enterprise_id)"))
+        Base.metadata.create_all(engine)
+
+        self.assertEqual(migrations.upgrade(engine), ['0001_tenant_date_indexes', '0002_content_hashes', '0003_task_materialization_dates', '0004_change_versions', '0005_jalali_rollup_periods', '0006_task_taxonomy_versions'])
+        self.assertEqual(migrations.upgrade(engine), [])
+        with engine.connect() as connection:
+            indexes = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'bank_transactions'")).scalars())
+        self.assertIn('ix_bank_transactions_enterprise_date', indexes)
+        self.assertNotIn('ix_bank_transactions_enterprise_id', indexes)
+
+    def test_upgrade_adds_content_hash_columns(self):
+        engine = create_engine('sqlite:///:memory:')
+        with engine.begin() as connection:
+            # gazette_announcements as created before content hashes were stored
+            connection.execute(text(
+                "CREATE TABLE gazette_announcements (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, date DATE, "
+                "announcement_type VARCHAR, content TEXT, source_url VARCHAR UNIQUE)"
+            ))
+        Base.metadata.create_all(engine)
+
+        migrations.upgrade(engine)
+        with engine.connect() as connection:
+            columns = {column['name'] for column in inspect(connection).get_columns('gazette_announcements')}
+        self.assertIn('content_hash', columns)
+
+    def test_upgrade_rekeys_rollups_by_jalali_month(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        with sessionmaker(bind=engine)() as db:
+            db.add(finance.BankTransaction(enterprise_id=ENTERPRISE_ID, amount=100, transaction_date=datetime.datetime(2023, 1, 25), reference_id='TX1'))
+            # Keyed by Gregorian month, as rollups were before
+            db.add(FinancialRollup(enterprise_id=ENTERPRISE_ID, period='2023-01', deposits_total=100, deposit_count=1))
+            db.commit()
+
+        migrations.upgrade(engine)
+        with sessionmaker(bind=engine)() as db:
+            self.assertEqual([(row.period, row.deposits_total) for row in db.query(FinancialRollup)], [('1401-11', 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
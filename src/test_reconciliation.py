@@ -0,0 +1,104 @@
+import datetime
+import random
+import unittest
+
+from src.reconciliation import LedgerItem, match_deposits_to_invoices
+
+D = datetime.date
+
+
+def scan_match(deposits, invoices, amount_tolerance, date_window_days):
+    """The same greedy pairing by scanning every invoice, for comparison."""
+    invoices = sorted(invoices, key=lambda item: (item.amount, item.date))
+    free = [True] * len(invoices)
+    pairs = []
+    for deposit in sorted(deposits, key=lambda item: (item.amount, item.date)):
+        best, best_rank = None, None
+        for i, invoice in enumerate(invoices):
+            days_apart = abs((deposit.date - invoice.date).days)
+            if free[i] and abs(deposit.amount - invoice.amount) <= amount_tolerance and days_apart <= date_window_days:
+                rank = (days_apart, abs(deposit.amount - invoice.amount))
+                if best_rank is None or rank < best_rank:
+                    best, best_rank = i, rank
+        if best is not None:
+            free[best] = False
+            pairs.append((deposit.key, invoices[best].key))
+    return pairs
+
+
+class TestMatchDepositsToInvoices(unittest.TestCase):
+
+    def test_exact_amounts_within_window_are_paired(self):
+        deposits = [LedgerItem('TX1', 1000000, D(2023, 10, 1)), LedgerItem('TX2', 2500000, D(2023, 10, 2))]
+        invoices = [LedgerItem('INV1', 1000000, D(2023, 9, 28)), LedgerItem('INV2', 5000000, D(2023, 10, 1))]
+
+        matched, unmatched_deposits, unmatched_invoices = match_deposits_to_invoices(deposits, invoices)
+
+        self.assertEqual([(d.key, i.key) for d, i in matched], [('TX1', 'INV1')])
+        self.assertEqual([d.key for d in unmatched_deposits], ['TX2'])
+        self.assertEqual([i.key for i in unmatched_invoices], ['INV2'])
+
+    def test_tolerance_and_date_window(self):
+        deposits = [LedgerItem('TX1', 1000500, datetime.datetime(2023, 10, 1, 12, 30))]
+        invoices = [LedgerItem('FAR', 1000000, D(2023, 6, 1)), LedgerItem('NEAR', 1000000, D(2023, 9, 25))]
+
+        matched, _, _ = match_deposits_to_invoices(deposits, invoices, amount_tolerance=0)
+        self.assertEqual(matched, [])
+
+        matched, _, unmatched_invoices = match_deposits_to_invoices(deposits, invoices, amount_tolerance=1000, date_window_days=10)
+        self.assertEqual([(d.key, i.key) for d, i in matched], [('TX1', 'NEAR')])
+        self.assertEqual([i.key for i in unmatched_invoices], ['FAR'])
+
+    def test_repeated_amounts_pair_by_closest_date(self):
+        deposits = [LedgerItem('TX-OCT', 500, D(2023, 10, 3)), LedgerItem('TX-SEP', 500, D(2023, 9, 3))]
+        invoices = [LedgerItem('INV-SEP', 500, D(2023, 9, 1)), LedgerItem('INV-OCT', 500, D(2023, 10, 1))]
+
+        matched, _, _ = match_deposits_to_invoices(deposits, invoices, date_window_days=45)
+        self.assertEqual(sorted((d.key, i.key) for d, i in matched), [('TX-OCT', 'INV-OCT'), ('TX-SEP', 'INV-SEP')])
+
+    def test_random_ledgers_are_consistent_and_maximal(self):
+        rng = random.Random(3)
+        start = D(2023, 1, 1)
+        item = lambda key: LedgerItem(key, rng.randrange(1, 50) * 1000, start + datetime.timedelta(days=rng.randrange(365)))
+        deposits = [item(f'TX{i}') for i in range(500)]
+        invoices = [item(f'INV{i}') for i in range(400)]
+
+        matched, unmatched_deposits, unmatched_invoices = match_deposits_to_invoices(deposits, invoices, amount_tolerance=500, date_window_days=20)
+
+        self.assertEqual(len(matched) + len(unmatched_deposits), len(deposits))
+        self.assertEqual(len(matched) + len(unmatched_invoices), len(invoices))
+        self.assertEqual(len({i.key for _, i in matched}), len(matched))
+        for deposit, invoice in matched:
+            self.assertLessEqual(abs(deposit.amount - invoice.amount), 500)
+            self.assertLessEqual(abs((deposit.date - invoice.date).days), 20)
+        # No leftover deposit could still have been paired with a leftover invoice
+        for deposit in unmatched_deposits:
+            for invoice in unmatched_invoices:
+                self.assertFalse(
+                    abs(deposit.amount - invoice.amount) <= 500 and abs((deposit.date - invoice.date).days) <= 20
+                )
+
+    def test_matches_a_full_scan(self):
+        rng = random.Random(7)
+        start = D(2023, 1, 1)
+        item = lambda key: LedgerItem(key, rng.randrange(1, 8) * 1000, start + datetime.timedelta(days=rng.randrange(90)))
+        deposits = [item(f'TX{i}') for i in range(300)]
+        invoices = [item(f'INV{i}') for i in range(300)]
+
+        matched, _, _ = match_deposits_to_invoices(deposits, invoices, amount_tolerance=1000, date_window_days=10)
+        self.assertEqual([(d.key, i.key) for d, i in matched], scan_match(deposits, invoices, 1000, 10))
+
+    def test_recurring_equal_amounts(self):
+        # Monthly rent paid and invoiced over years: every item has the same amount
+        start = D(2000, 1, 1)
+        deposits = [LedgerItem(f'TX{i}', 5000000, start + datetime.timedelta(days=i)) for i in range(20000)]
+        invoices = [LedgerItem(f'INV{i}', 5000000, start + datetime.timedelta(days=i + 2)) for i in range(20000)]
+
+        matched, unmatched_deposits, unmatched_invoices = match_deposits_to_invoices(deposits, invoices, date_window_days=5)
+
+        self.assertEqual((len(matched), len(unmatched_deposits), len(unmatched_invoices)), (20000, 0, 0))
+        self.assertTrue(all(invoice.date - deposit.date == datetime.timedelta(days=2) for deposit, invoice in matched))
+
+
+if __name__ == '__main__':
+    unittest.main()
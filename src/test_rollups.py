@@ -0,0 +1,96 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from src import ledger_queries, rollups
+from src.models.database import Base
+from src.models.finance import BankTransaction, FinancialRollup, TaxInvoice, TransactionType
+from src.models.identity import EnterpriseProfile
+
+
+class TestFinancialRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine, autoflush=False)()
+        self.enterprise = EnterpriseProfile(name='شرکت آزمون', national_id='10300000000', economic_code='413000000000')
+        self.session.add(self.enterprise)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.engine)
+
+    def _add_transaction(self, ref, amount, date, kind=TransactionType.DEPOSIT):
+        # Same steps as the create endpoint
+        tx = BankTransaction(enterprise_id=self.enterprise.id, amount=amount, transaction_date=date, reference_id=ref, type=kind)
+        self.session.add(tx)
+        self.session.flush()
+        rollups.record_transaction(self.session, tx)
+        self.session.commit()
+        return tx
+
+    def test_create_update_delete_keep_rollups_consistent(self):
+        tx1 = self._add_transaction('TX1', 1000, datetime.datetime(2023, 1, 10))
+        self._add_transaction('TX2', 300, datetime.datetime(2023, 1, 11), TransactionType.WITHDRAWAL)
+        invoice = TaxInvoice(enterprise_id=self.enterprise.id, amount=800, issue_date=datetime.datetime(2023, 2, 1), tax_id='INV1')
+        self.session.add(invoice)
+        self.session.flush()
+        rollups.record_invoice(self.session, invoice)
+        self.session.commit()
+
+        january = self.session.query(FinancialRollup).filter_by(period='1401-10').one()
+        self.assertEqual((january.deposits_total, january.withdrawals_total, january.deposit_count), (1000, 300, 1))
+
+        # Update moves the row to another month, like the PUT endpoint
+        rollups.record_transaction(self.session, tx1, -1)
+        tx1.transaction_date = datetime.datetime(2023, 2, 5)
+        tx1.amount = 1500
+        rollups.record_transaction(self.session, tx1)
+        self.session.commit()
+
+        rollups.record_invoice(self.session, invoice, -1)
+        self.session.delete(invoice)
+        self.session.commit()
+
+        self.assertEqual(rollups.check_rollups(self.session), [])
+        summary = ledger_queries.get_rollup_summary(self.session, self.enterprise.id, 'month')
+        self.assertEqual([(b['period'], b['deposits_total'], b['withdrawals_total'], b['invoiced_total']) for b in summary], [
+            ('1401-10', 0, 300, 0), ('1401-11', 1500, 0, 0),
+        ])
+
+    def test_check_and_rebuild_detect_and_fix_drift(self):
+        self._add_transaction('TX1', 1000, datetime.datetime(2023, 1, 10))
+        # A write that bypassed the rollups
+        self.session.add(BankTransaction(enterprise_id=self.enterprise.id, amount=50, transaction_date=datetime.datetime(2023, 3, 1), reference_id='TX2'))
+        self.session.commit()
+
+        mismatches = rollups.check_rollups(self.session)
+        self.assertEqual([(ent_id, period) for ent_id, period, _, _ in mismatches], [(self.enterprise.id, '1401-12')])
+
+        self.assertEqual(rollups.rebuild_rollups(self.session), 2)
+        self.assertEqual(rollups.check_rollups(self.session), [])
+        totals = ledger_queries.get_rollup_totals(self.session, self.enterprise.id)
+        self.assertEqual(totals, [{"period": None, "total_deposits": 1050, "total_invoiced": 0}])
+
+    def test_each_write_is_one_upsert(self):
+        # No read-then-insert, so concurrent first writes to a period can't collide on uq_financial_rollup_period
+        enterprise_id = self.enterprise.id
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(self.engine, 'before_cursor_execute', listener)
+        for day, amount in [(1, 800), (2, 200)]:
+            rollups.record_invoice(self.session, TaxInvoice(enterprise_id=enterprise_id, amount=amount, issue_date=datetime.datetime(2023, 3, day)))
+        event.remove(self.engine, 'before_cursor_execute', listener)
+        self.session.commit()
+
+        self.assertEqual(len(statements), 2)
+        self.assertIn('ON CONFLICT', statements[0])
+        esfand = self.session.query(FinancialRollup).filter_by(period='1401-12').one()
+        self.assertEqual((esfand.invoiced_total, esfand.invoice_count, esfand.deposit_count), (1000, 2, 0))
+
+if __name__ == '__main__':
+    unittest.main()
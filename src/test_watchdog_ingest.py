@@ -0,0 +1,109 @@
+import datetime
+import io
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from src import watchdog_ingest
+from src.models.database import Base
+from src.models.watchdog import GazetteAnnouncement, TrademarkRegistration
+
+
+def announcement(n):
+    return {'title': f'آگهی {n}', 'date': datetime.date(2022, 1, n), 'content': 'متن', 'source_url': f'https://rrk.ir/{n}'}
+
+
+class TestIngestItems(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_items_are_committed_in_batches(self):
+        progress = []
+        report = watchdog_ingest.ingest_items(
+            self.db, watchdog_ingest.GAZETTE, (announcement(n) for n in [1, 2, 3, 2, 4]), batch_size=2,
+            on_batch=lambda report: progress.append(dict(report)),
+        )
+        self.assertEqual(report, {'received': 5, 'inserted': 4, 'updated': 0, 'unchanged': 1, 'skipped': 0})
+        self.assertEqual([step['received'] for step in progress], [2, 4, 5])
+        self.assertEqual(self.db.query(GazetteAnnouncement).count(), 4)
+
+    def test_a_failure_keeps_the_committed_batches(self):
+        def crawl():
+            yield from (announcement(n) for n in [1, 2, 3])
+            raise RuntimeError('connection lost')
+
+        with self.assertRaises(RuntimeError):
+            watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, crawl(), batch_size=2)
+        self.assertEqual([row.source_url for row in self.db.query(GazetteAnnouncement)], ['https://rrk.ir/1', 'https://rrk.ir/2'])
+
+    def test_every_item_is_counted_once(self):
+        watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, [announcement(1)])
+        # Repeats of a stored, unchanged item within one batch, and an item without its key
+        items = [announcement(1), announcement(1), announcement(2), {**announcement(3), 'source_url': None}]
+        report = watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, items)
+        self.assertEqual(report, {'received': 4, 'inserted': 1, 'updated': 0, 'unchanged': 1, 'skipped': 2})
+        self.assertEqual(report['received'], report['inserted'] + report['updated'] + report['unchanged'] + report['skipped'])
+
+    def test_json_lines(self):
+        stream = io.StringIO('{"title": "آگهی", "date": "2022-01-18", "source_url": "https://rrk.ir/1", "agahi_number": "1400"}\n\n')
+        report = watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, watchdog_ingest.read_json_lines(stream))
+        self.assertEqual(report['inserted'], 1)
+        self.assertEqual(self.db.query(GazetteAnnouncement).one().date, datetime.date(2022, 1, 18))
+
+    def test_trademarks_are_upserted_by_registration_number(self):
+        # One search page yields many trademarks with the same source_url
+        page = 'https://ipm.ssaa.ir/search?page=1'
+        crawl = [
+            {'name': 'پارس الکتریک', 'registration_number': '18544', 'status': 'ثبت شده', 'source_url': page},
+            {'name': 'پارس خزر', 'registration_number': '24100', 'status': 'ثبت شده', 'source_url': page},
+        ]
+        self.assertEqual(watchdog_ingest.ingest_items(self.db, watchdog_ingest.TRADEMARKS, crawl)['inserted'], 2)
+
+        crawl[1] = {**crawl[1], 'status': 'منقضی شده'}
+        crawl.append({'name': 'بی شماره', 'registration_number': '', 'source_url': page})
+        report = watchdog_ingest.ingest_items(self.db, watchdog_ingest.TRADEMARKS, crawl)
+        self.assertEqual(report, {'received': 3, 'inserted': 0, 'updated': 1, 'unchanged': 1, 'skipped': 1})
+
+        trademarks = self.db.query(TrademarkRegistration).order_by(TrademarkRegistration.registration_number).all()
+        self.assertEqual([(row.status, row.name_tokens) for row in trademarks], [('ثبت شده', 'الکتریک پارس'), ('منقضی شده', 'خزر پارس')])
+
+    def test_unchanged_items_are_recognised_by_their_content_hash(self):
+        watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, [announcement(1), announcement(2)])
+        stored = self.db.query(GazetteAnnouncement).filter_by(source_url='https://rrk.ir/1').one()
+        self.assertEqual(stored.content_hash, watchdog_ingest._row(watchdog_ingest.GAZETTE, announcement(1))['content_hash'])
+
+        report = watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, [announcement(1), {**announcement(2), 'content': 'اصلاحیه'}])
+        self.assertEqual(report, {'received': 2, 'inserted': 0, 'updated': 1, 'unchanged': 1, 'skipped': 0})
+
+        # Rows stored before content hashes existed are updated once
+        stored.content_hash = None
+        self.db.commit()
+        report = watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, [announcement(1)])
+        self.assertEqual(report['updated'], 1)
+        self.assertIsNotNone(self.db.query(GazetteAnnouncement).filter_by(source_url='https://rrk.ir/1').one().content_hash)
+
+    def test_page_validators_are_upserted(self):
+        url = 'https://rrk.ir/1'
+        watchdog_ingest.save_pages(self.db, 'gazette', {url: {'etag': '"a"', 'last_modified': None, 'content_hash': '1' * 64}})
+        watchdog_ingest.save_pages(self.db, 'gazette', {url: {'etag': '"b"', 'last_modified': None, 'content_hash': '2' * 64}})
+        self.assertEqual(watchdog_ingest.load_pages(self.db, 'gazette'), {url: {'etag': '"b"', 'last_modified': None, 'content_hash': '2' * 64}})
+        self.assertEqual(watchdog_ingest.load_pages(self.db, 'brand'), {})
+
+    def test_one_lookup_per_batch(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(self.db.get_bind(), 'before_cursor_execute', listener)
+        watchdog_ingest.ingest_items(self.db, watchdog_ingest.GAZETTE, (announcement(n) for n in range(1, 21)), batch_size=10)
+        event.remove(self.db.get_bind(), 'before_cursor_execute', listener)
+        self.assertEqual(len([statement for statement in statements if statement.startswith('SELECT')]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+"""
+Stores crawled watchdog items (gazette announcements, trademarks) in fixed-size batches.
+
+Items are consumed from any iterable, such as the live stream of a crawl
+(crawl_runner.CrawlProcess.crawl) or a JSON Lines file (`read_json_lines`), so memory
+does not grow with the size of the crawl. Each batch is committed on its own: if the
+crawl or the ingest fails part way, the batches before it are kept.
+
+Items are matched to stored rows by their natural key (source_url for announcements,
+registration_number for trademarks), one IN query per batch. Each row stores a
+content_hash of its item, so an unchanged item is recognised from the hash alone. New
+items are inserted with ON CONFLICT DO NOTHING, changed ones updated in bulk, and
+unchanged ones left alone.
+
+The crawls fetch pages conditionally (crawlers.dastyar_crawlers.middlewares): the
+validators of each fetched page are stored in crawl_pages by `save_pages`, after the
+page's items, and passed to the next crawl by `load_pages`.
+
+A JSON Lines backfill can be loaded from the command line:
+
+    python -m src.watchdog_ingest gazette backfill.jsonl
+"""
+import datetime
+import hashlib
+import itertools
+import json
+import sys
+
+from sqlalchemy import Date, func, select, update
+from sqlalchemy.orm import Session
+
+from src import data_versions
+from src.models import upsert, watchdog
+from src.models.database import SessionLocal
+from src.persian_text import normalize, token_key
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class WatchdogKind:
+    """
+    What a crawler's items are stored as.
+
+    :param key: The model's unique natural key column.
+    :param derive: Adds computed columns to a row; bulk writes bypass the model validators.
+    :param versioned: Stamp written rows with the watchdog version (a `changed_version` column).
+    """
+
+    def __init__(self, model, key: str, derive=None, versioned: bool = False):
+        self.model = model
+        self.key = key
+        self.derive = derive
+        self.versioned = versioned
+
+
+def _name_keys(row: dict):
+    if 'name' in row:
+        row['name_normalized'] = normalize(row['name'])
+        row['name_tokens'] = token_key(row['name'])
+
+
+GAZETTE = WatchdogKind(watchdog.GazetteAnnouncement, 'source_url')
+# Versioned: the brand index and the matching job re-read trademarks changed in place
+TRADEMARKS = WatchdogKind(watchdog.TrademarkRegistration, 'registration_number', derive=_name_keys, versioned=True)
+
+# Per crawler name
+KINDS = {'gazette': GAZETTE, 'brand': TRADEMARKS}
+
+
+def batched(items, size: int):
+    """Yields lists of up to `size` items."""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_json_lines(stream):
+    """Yields one item per non-empty line of a JSON Lines text stream."""
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def content_hash(row: dict) -> str:
+    """sha256 over the row's values, independent of key order."""
+    payload = json.dumps(sorted(row.items()), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _row(kind: WatchdogKind, item: dict) -> dict:
+    """
+    The item's values for the model's columns, with its content_hash. ISO date strings (as in
+    JSON Lines) become dates.
+    """
+    row = {}
+    for column in kind.model.__table__.columns:
+        if column.key in item and not column.primary_key and column.key != 'content_hash':
+            value = item[column.key]
+            if isinstance(column.type, Date) and isinstance(value, str):
+                value = datetime.date.fromisoformat(value)
+            row[column.key] = value
+    # Before `derive`: the derived columns follow from the others
+    row['content_hash'] = content_hash(row)
+    if kind.derive is not None:
+        kind.derive(row)
+    return row
+
+
+def _write_batch(db: Session, kind: WatchdogKind, batch: list, report: dict):
+    """
+    Inserts the batch's new items, updates the changed ones and commits. Each item is
+    counted once in `report`, so received = inserted + updated + unchanged + skipped.
+    """
+    table = kind.model.__table__
+    rows = {}
+    for item in batch:
+        row = _row(kind, item)
+        key = row.get(kind.key)
+        if not key:
+            report['skipped'] += 1
+            continue
+        if key in rows:
+            report['skipped'] += 1  # A repeat within the batch: the last one wins and is counted below
+        rows[key] = row
+    if not rows:
+        return
+
+    existing = {
+        key: (row_id, stored_hash)
+        for row_id, key, stored_hash in db.execute(
+            select(table.c.id, table.c[kind.key], table.c.content_hash).where(table.c[kind.key].in_(list(rows)))
+        )
+    }
+    new, changed = [], []
+    for key, row in rows.items():
+        if key not in existing:
+            new.append(row)
+            continue
+        row_id, stored_hash = existing[key]
+        if stored_hash != row['content_hash']:
+            changed.append({"id": row_id, **row})
+        else:
+            report['unchanged'] += 1
+
+    if new or changed:
+        data_versions.bump_watchdog(db)
+        if kind.versioned:
+            version = data_versions.watchdog_version(db)
+            for row in itertools.chain(new, changed):
+                row['changed_version'] = version
+
+    # DO NOTHING: a row inserted by a concurrent run since the lookup is left alone
+    # One executemany per set of columns, since rows of one statement must have the same keys
+    for _, group in itertools.groupby(sorted(new, key=sorted), key=sorted):
+        db.execute(upsert.insert_ignoring_conflicts(db, table), list(group))
+    if changed:
+        db.execute(update(kind.model), changed)
+    db.commit()
+    report['inserted'] += len(new)
+    report['updated'] += len(changed)
+
+
+def ingest_items(db: Session, kind: WatchdogKind, items, batch_size: int = DEFAULT_BATCH_SIZE, on_batch=None) -> dict:
+    """
+    Stores `items` in batches of `batch_size`, committing each one.
+
+    :param kind: GAZETTE or TRADEMARKS.
+    :param on_batch: Called with the running report after each committed batch, e.g. to show progress.
+    :return: {'received', 'inserted', 'updated', 'unchanged', 'skipped'} of the committed
+        batches; skipped items are missing their natural key or repeated later in their batch.
+    """
+    report = {"received": 0, "inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    for batch in batched(items, batch_size):
+        batch_report = dict(report)
+        try:
+            _write_batch(db, kind, batch, batch_report)
+        except Exception:
+            db.rollback()
+            raise
+        report = batch_report
+        report['received'] += len(batch)
+        if on_batch is not None:
+            on_batch(report)
+    return report
+
+
+def load_pages(db: Session, crawler_name: str) -> dict:
+    """The stored validators of the crawler's pages: url -> {'etag', 'last_modified', 'content_hash'}."""
+    pages = db.execute(
+        select(watchdog.CrawlPage.url, watchdog.CrawlPage.etag, watchdog.CrawlPage.last_modified, watchdog.CrawlPage.content_hash)
+        .where(watchdog.CrawlPage.crawler_name == crawler_name)
+    )
+    return {url: {'etag': etag, 'last_modified': last_modified, 'content_hash': page_hash} for url, etag, last_modified, page_hash in pages}
+
+
+def save_pages(db: Session, crawler_name: str, pages: dict):
+    """
+    Stores the validators of the pages a crawl fetched (url -> {'etag', 'last_modified',
+    'content_hash'}) and commits. Call it only once the crawl's items are stored: a page
+    recorded as fetched is skipped by the next crawl while it is unchanged.
+    """
+    table = watchdog.CrawlPage.__table__
+    for batch in batched(pages.items(), DEFAULT_BATCH_SIZE):
+        stmt = upsert.insert(db, table)
+        stmt = stmt.on_conflict_do_update(index_elements=['url'], set_={
+            'crawler_name': stmt.excluded.crawler_name,
+            'etag': stmt.excluded.etag,
+            'last_modified': stmt.excluded.last_modified,
+            'content_hash': stmt.excluded.content_hash,
+            'fetched_at': func.now(),
+        })
+        db.execute(stmt, [{'url': url, 'crawler_name': crawler_name, **validators} for url, validators in batch])
+    db.commit()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in KINDS:
+        print(f"Usage: python -m src.watchdog_ingest [{'|'.join(KINDS)}] FILE.jsonl")
+        sys.exit(1)
+    db_session = SessionLocal()
+    try:
+        with open(sys.argv[2], encoding='utf-8') as f:
+            progress = lambda report: print(", ".join(f"{count} {name}" for name, count in report.items()))
+            ingest_items(db_session, KINDS[sys.argv[1]], read_json_lines(f), on_batch=progress)
+    finally:
+        db_session.close()